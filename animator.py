@@ -0,0 +1,166 @@
+import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+
+"""
+ Animation
+
+ Plays a SpringMassSystem while it is running, in a window or into a
+ video file. Kept apart from main.py so that the simulation core loads
+ without matplotlib.
+"""
+
+
+class Animator:
+    """
+    Initialize an animator that plays a simulation while it is running.
+    Attributes:
+    -sms: SpringMassSystem to animate (the animator drives its run)
+    -trail: number of frames shown in the trail behind every mass
+    -fps: target frame rate
+    -speed: simulated seconds per real second
+    -xlim, ylim: axis limits (default: from the initial positions)
+
+    The frames come from the generator SpringMassSystem.iterate(). To hold
+    the frame rate, a frame advances the simulation to the time that
+    corresponds to the elapsed real time and skips the steps in between.
+    """
+
+    def __init__(self, sms, trail = 100, fps = 30, speed = 1.0, xlim = None, ylim = None):
+        self.sms = sms
+        self.trail = trail
+        self.fps = fps
+        self.speed = speed
+        self.xlim = xlim
+        self.ylim = ylim
+
+
+    def setup(self, fig, blit = True):
+        """
+        Create the artists and start the simulation
+        """
+
+        self.sms.start()
+        self.steps = self.sms.iterate()
+        pos = self.sms.positions()
+        self.fixtures = self.sms.store.fixtures.data("pos").copy()
+        self.i, self.j = self.sms.arrays["i"], self.sms.arrays["j"]
+
+        # Ring buffer of the last trail positions; the trail of every mass is drawn
+        # as one polyline, separated from the next mass by a NaN vertex
+        self.ring = np.repeat(pos[None].copy(), self.trail, axis = 0)
+        self.head = 0
+        self.done = False
+
+        # Default limits leave more room below the system (gravity)
+        points = np.concatenate([self.fixtures, pos])
+        lo, hi = points.min(axis = 0), points.max(axis = 0)
+        span = max((hi - lo).max(), 1.0)
+        if self.xlim is None:
+            self.xlim = (lo[0] - span, hi[0] + span)
+        if self.ylim is None:
+            self.ylim = (lo[1] - span, hi[1] + 0.5 * span)
+
+        ax = fig.add_subplot(xlim = self.xlim, ylim = self.ylim)
+        ax.set_aspect("equal")
+        ax.scatter(self.fixtures[:, 0], self.fixtures[:, 1], c = "green", s = 100, marker = "H")
+        # Animated artists are only drawn by blitting
+        self.trails, = ax.plot([], [], c = "blue", lw = 0.5, animated = blit)
+        self.springs = LineCollection([], colors = "k", linewidths = 1, animated = blit)
+        ax.add_collection(self.springs)
+        self.points, = ax.plot([], [], "o", c = "red", animated = blit)
+        self.time_text = ax.text(0.02, 0.95, "", transform = ax.transAxes, animated = blit)
+        return self.artists()
+
+
+    def artists(self):
+        return self.trails, self.springs, self.points, self.time_text
+
+
+    def advance(self, t):
+        """
+        Pull time steps from the simulation until simulated time t is reached
+        and return the positions at that time
+        """
+
+        while not self.done and self.sms.step * self.sms.delta_t < t:
+            try:
+                next(self.steps)
+            except StopIteration:
+                self.done = True
+        return self.sms.positions()
+
+
+    def draw(self, pos):
+        """
+        Update the artists with the positions of the current frame
+        """
+
+        with self.sms.phase("render"):
+            self.ring[self.head] = pos
+            self.head = (self.head + 1) % self.trail
+
+            # Oldest to newest position, one NaN separated polyline per mass
+            ordered = np.roll(self.ring, -self.head, axis = 0).transpose(1, 0, 2)
+            lines = np.concatenate([ordered, np.full((len(pos), 1, 2), np.nan)], axis = 1).reshape(-1, 2)
+            self.trails.set_data(lines[:, 0], lines[:, 1])
+
+            nodes = np.concatenate([self.fixtures, pos])
+            self.springs.set_segments(np.stack([nodes[self.i], nodes[self.j]], axis = 1))
+            self.points.set_data(pos[:, 0], pos[:, 1])
+            self.time_text.set_text(f"t = {self.sms.step * self.sms.delta_t:.2f} s")
+        return self.artists()
+
+
+    def realtime(self):
+        """
+        Frame generator for the interactive animation: every frame advances the
+        simulation to the real time elapsed since the start (times speed)
+        """
+
+        start = time.perf_counter()
+        while not self.done:
+            yield self.advance((time.perf_counter() - start) * self.speed)
+
+
+    def animate(self):
+        """
+        Show the animation in a window (blitted)
+        """
+
+        fig = plt.figure()
+        init = self.setup(fig)
+        self.anim = animation.FuncAnimation(fig, self.draw, frames = self.realtime, init_func = lambda: init,
+                                            interval = 1000 / self.fps, blit = True, cache_frame_data = False,
+                                            repeat = False)
+        plt.show()
+
+
+    def save(self, path, dpi = 100):
+        """
+        Render the animation to a video file without a window:
+        .gif through PillowWriter, anything else (e.g. .mp4) through FFMpegWriter.
+        Every frame advances the simulation by speed / fps seconds.
+        """
+
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        self.setup(fig, blit = False)
+
+        if path.endswith(".gif"):
+            writer = animation.PillowWriter(fps = self.fps)
+        else:
+            writer = animation.FFMpegWriter(fps = self.fps)
+
+        frame = 0
+        with writer.saving(fig, path, dpi):
+            while not self.done:
+                frame += 1
+                self.draw(self.advance(frame * self.speed / self.fps))
+                writer.grab_frame()
@@ -0,0 +1,263 @@
+import argparse
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import scenarios
+
+
+"""
+ Benchmark suite
+
+ Times the stages of a simulation separately (build, integrate, energy,
+ save) on the named test setups of scenarios.py and on synthetic chains,
+ grids and random graphs of 10 to 100k masses. Reports steps per second
+ and the peak memory allocated during every stage, and writes the results
+ as JSON so that engines can be compared and regressions caught. Memory
+ is traced in separate runs of the stages (tracing slows them down
+ severalfold), the timed runs are not traced;
+ the integration is traced on a second system built the same way, for a
+ few time steps (its recorder is allocated in full).
+
+ --startup times the cold start instead: a fresh interpreter importing the
+ simulation core, the command line tool, and a process pool whose workers
+ each run a small simulation, with and without importing matplotlib (the
+ plotting modules are only imported when rendering).
+
+ Usage:
+ python benchmark.py --engines numpy jit --sizes 10 1000 100000 --out results.json
+ python benchmark.py --compare old.json new.json
+ python benchmark.py --startup --out startup.json
+"""
+
+
+# Directory of the simulator modules (working directory of the cold start processes)
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# Time steps of the traced (untimed) integration: the recorder is allocated by start()
+# and every step allocates the same temporaries, so the peak is reached after a few steps
+TRACED_STEPS = 10
+
+
+def measure(function, memory = None):
+    """
+    Call function and return its result, the elapsed time and the peak
+    memory allocated by an untimed call of memory (default: function again)
+    (tracemalloc, includes NumPy arrays)
+    """
+
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    (function if memory is None else memory)()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {"seconds": elapsed, "peak_bytes": peak}
+
+
+def run_case(build, engine, integrator):
+    """
+    Build a system with build(engine, integrator) and time every stage
+    """
+
+    sms, stats = measure(lambda: build(engine = engine, integrator = integrator))
+    result = {"engine": engine,
+              "integrator": integrator,
+              "masses": len(sms.masses),
+              "springs": len(sms.springs),
+              "timesteps": sms.timesteps,
+              "stages": {"build": stats}}
+
+    def integrate():
+        sms.start()
+        sms.advance(sms.timesteps)
+
+    def traced():
+        # Integrating again needs a fresh system (built outside of the traced region)
+        fresh.start()
+        fresh.advance(min(fresh.timesteps, TRACED_STEPS))
+
+    # Compile the JIT kernel outside of the timed region
+    if engine == "jit":
+        warmup = scenarios.pendulum(timesteps = 1, engine = engine, integrator = integrator)
+        warmup.start()
+        warmup.state.advance(warmup.delta_t, 1)
+
+    fresh = build(engine = engine, integrator = integrator)
+    _, stats = measure(integrate, memory = traced)
+    if engine == "parallel":
+        fresh.state.close()
+    result["stages"]["integrate"] = stats
+    _, result["stages"]["energy"] = measure(sms.energySeries)
+
+    with tempfile.TemporaryDirectory() as directory:
+        _, result["stages"]["save"] = measure(lambda: sms.save(os.path.join(directory, "trajectories.traj")))
+
+    result["steps_per_second"] = sms.timesteps / result["stages"]["integrate"]["seconds"]
+    return result
+
+
+def run(engines = ("numpy", "jit"), integrator = "verlet", generators = ("chain", "grid", "random_graph"),
+        sizes = (10, 100, 1000, 10000, 100000), timesteps = 200, named = True):
+    """
+    Run the benchmark suite and return the results as a dictionary
+    """
+
+    cases = []
+    if named:
+        for name, build in scenarios.SCENARIOS.items():
+            cases.append((name, None, build))
+    for name in generators:
+        for n in sizes:
+            # Synthetic systems only record up to 10 time steps, so large sizes fit into memory
+            build = lambda n = n, generator = scenarios.GENERATORS[name], **options: \
+                generator(n, timesteps = timesteps, record_every = timesteps // math.gcd(timesteps, 10), **options)
+            cases.append((name, n, build))
+
+    results = []
+    for name, size, build in cases:
+        for engine in engines:
+            result = run_case(build, engine, integrator)
+            result["scenario"] = name
+            result["size"] = size
+            results.append(result)
+            print(f"{name:26s} {str(size or ''):>7s} {engine:6s} {result['steps_per_second']:12.0f} steps/s")
+
+    try:
+        from jit import HAVE_NUMBA
+    except ImportError:
+        HAVE_NUMBA = False
+    return {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "python": platform.python_version(),
+                     "numpy": np.__version__,
+                     "numba": HAVE_NUMBA,
+                     "machine": platform.machine(),
+                     "cpus": os.cpu_count()},
+            "results": results}
+
+
+def cold_start(code, repeat = 5):
+    """
+    Median wall time of a fresh Python interpreter running code
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd = HERE, check = True, stdout = subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def simulate_small(plotting = False):
+    """
+    Task of a pool worker: a short pendulum run (importing matplotlib first if plotting)
+    """
+
+    if plotting:
+        import matplotlib.pyplot
+    sms = scenarios.pendulum(timesteps = 100, engine = "numpy", integrator = "verlet")
+    sms.start()
+    sms.advance(sms.timesteps)
+    return sms.step
+
+
+def pool_start(workers = 2, plotting = False, repeat = 3):
+    """
+    Median wall time from creating a process pool (spawned workers, as on macOS
+    and Windows) until every worker has finished one small simulation
+    """
+
+    times = []
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context = context) as pool:
+            list(pool.map(simulate_small, [plotting] * workers))
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def startup(repeat = 5, workers = 2):
+    """
+    Cold start times in seconds: importing the simulation core and running the
+    command line tool in a fresh interpreter, and a process pool running small
+    simulations, each without and with importing matplotlib
+    """
+
+    results = {"interpreter": cold_start("pass", repeat),
+               "import_core": cold_start("import main", repeat),
+               "import_core_matplotlib": cold_start("import main, matplotlib.pyplot, matplotlib.animation", repeat),
+               "cli_help": cold_start("import sys, runpy; sys.argv = ['simulate.py', '--help']\n"
+                                      "try: runpy.run_path('simulate.py', run_name = '__main__')\n"
+                                      "except SystemExit: pass", repeat),
+               "pool": pool_start(workers, False, max(repeat // 2, 1)),
+               "pool_matplotlib": pool_start(workers, True, max(repeat // 2, 1))}
+    for name, seconds in results.items():
+        print(f"{name:26s} {seconds * 1000:8.1f} ms")
+    return {"meta": {"python": platform.python_version(), "cpus": os.cpu_count(), "workers": workers},
+            "startup": results}
+
+
+def compare(old, new, threshold = 0.1):
+    """
+    Compare two benchmark result dictionaries and return the cases that got
+    slower by more than threshold (relative steps per second)
+    """
+
+    def key(r):
+        return r["scenario"], r["size"], r["engine"], r["integrator"]
+
+    baseline = {key(r): r for r in old["results"]}
+    regressions = []
+    for r in new["results"]:
+        if key(r) in baseline:
+            ratio = r["steps_per_second"] / baseline[key(r)]["steps_per_second"]
+            if ratio < 1 - threshold:
+                regressions.append({"case": key(r), "ratio": ratio})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Spring mass system benchmarks")
+    parser.add_argument("--engines", nargs = "+", default = ["numpy", "jit"])
+    parser.add_argument("--integrator", default = "verlet")
+    parser.add_argument("--generators", nargs = "+", default = list(scenarios.GENERATORS))
+    parser.add_argument("--sizes", nargs = "+", type = int, default = [10, 100, 1000, 10000, 100000])
+    parser.add_argument("--timesteps", type = int, default = 200, help = "time steps of the synthetic systems")
+    parser.add_argument("--no-named", action = "store_true", help = "skip the setups of test.py")
+    parser.add_argument("--out", default = "benchmark.json")
+    parser.add_argument("--compare", nargs = 2, metavar = ("OLD", "NEW"), help = "report regressions and exit")
+    parser.add_argument("--startup", action = "store_true", help = "time the cold start instead")
+    args = parser.parse_args()
+
+    if args.startup:
+        results = startup()
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent = 1)
+        print(f"Saved results to \"{args.out}\"")
+    elif args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        for regression in compare(old, new):
+            print(f"{regression['case']}: {regression['ratio']:.2f}x")
+    else:
+        results = run(args.engines, args.integrator, args.generators, args.sizes, args.timesteps, not args.no_named)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent = 1)
+        print(f"Saved results to \"{args.out}\"")
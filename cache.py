@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import checkpoint
+from engine import pack_system
+from trajectory import TrajectoryFile
+
+
+"""
+ Result cache
+
+ Keeps the results of runs on disk, so that identical runs (e.g. when
+ re-plotting, or parameter sweeps overlapping earlier ones) are read back
+ instead of integrated again: sms.run(cache = ResultCache(directory)).
+
+ Every result is addressed by a SHA-256 hash of everything that determines
+ it except its length: the topology and parameters of the springs, the
+ masses, the fixtures, the initial positions and velocities, gravity, the
+ time step, the recording stride, the engine, the integrator (and its
+ tolerances) and the contact settings. A result holds the trajectory file of the run (see
+ trajectory.py) and a checkpoint of its final state (see checkpoint.py):
+
+ -a run as long as the cached one, or shorter, is a hit: the records are memory-mapped from the cached
+  trajectory file and the masses are moved to the final state
+ -a longer run continues the cached one from its final state (with the
+  same results as running it from the start) and replaces it
+
+ The total size of the results is bounded: the least recently used
+ results are deleted first (the latest result is always kept). The index
+ of the results (index.json) is replaced atomically.
+"""
+
+
+FORMAT = 1
+
+
+def key(sms):
+    """
+    Hexadecimal SHA-256 hash of the system and settings of a run of sms
+    (everything but the number of time steps)
+    """
+
+    arrays = pack_system(sms)
+    h = hashlib.sha256()
+    for name in checkpoint.SYSTEM:
+        a = np.ascontiguousarray(arrays[name])
+        h.update(f"{name}:{a.dtype.str}:{a.shape}".encode())
+        h.update(a.tobytes())
+
+    contact = sms.contact
+    settings = {"format": FORMAT,
+                "g": sms.g,
+                "delta_t": sms.delta_t,
+                "record_every": sms.record_every,
+                "engine": sms.engine,
+                "workers": sms.workers if sms.engine == "parallel" else None,
+                "integrator": sms.integrator,
+                "tolerances": [sms.rtol, sms.atol],
+                "contact": None if contact is None else [contact.radius, contact.stiffness, contact.skin,
+                                                        contact.exclude_connected]}
+    h.update(json.dumps(settings, sort_keys = True).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Initialize a result cache in a directory (created if needed).
+    Attributes:
+    -directory: directory of the index, trajectory files and checkpoints
+    -max_bytes: largest total size of the cached results
+    -index: cached results by key: number of time steps ("steps"), trajectory file
+     ("trajectory") and checkpoint ("checkpoint") names, size ("bytes"), time of the
+     last use ("used")
+    -hits, misses, resumed: number of runs read from the cache, run from the start and
+     continued from a cached result
+    """
+
+    def __init__(self, directory, max_bytes = 2**30):
+        if max_bytes <= 0:
+            raise ValueError("Cache size must be positive")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+        self.index = self.load()
+        self.hits = self.misses = self.resumed = 0
+
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+
+    def load(self):
+        """
+        Read the index of the cached results (entries whose files are gone are dropped)
+        """
+
+        try:
+            with open(self.path("index.json")) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        return {k: entry for k, entry in index.items()
+                if os.path.exists(self.path(entry["trajectory"])) and os.path.exists(self.path(entry["checkpoint"]))}
+
+
+    def save(self):
+        """
+        Write the index of the cached results (atomically)
+        """
+
+        tmp = self.path("index.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.path("index.json"))
+
+
+    def size(self):
+        """
+        Total size of the cached results in bytes
+        """
+
+        return sum(entry["bytes"] for entry in self.index.values())
+
+
+    def remove(self, k):
+        """
+        Delete the cached result k
+        """
+
+        entry = self.index.pop(k)
+        for name in (entry["trajectory"], entry["checkpoint"]):
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+
+    def evict(self, keep = None):
+        """
+        Delete the least recently used results (but not result keep)
+        until the cached results fit into max_bytes
+        """
+
+        for k in sorted(self.index, key = lambda k: self.index[k]["used"]):
+            if self.size() <= self.max_bytes:
+                break
+            if k != keep:
+                self.remove(k)
+
+
+    def run(self, sms):
+        """
+        Run sms (see SpringMassSystem.run()) or read its result from the cache.
+        Afterwards sms.recorder is the trajectory file of the result (memory-mapped)
+        and the masses are in their final state. Returns the trajectory file.
+        """
+
+        if sms.compression is not None:
+            raise ValueError("Cached runs are recorded into trajectory files, disable compress()")
+        k = key(sms)
+        entry = self.index.get(k)
+        if entry is not None and entry["steps"] >= sms.timesteps:
+            # Runs end on a recorded time step (see SpringMassSystem): the final state
+            # of a shorter run is a record of the cached one
+            return self.hit(sms, k)
+        return self.compute(sms, k)
+
+
+    def hit(self, sms, k):
+        """
+        Read the result of a run of sms from the cached result k
+        """
+
+        entry = self.index[k]
+        entry["used"] = time.time()
+        self.evict(keep = k)
+        self.save()
+        self.hits += 1
+
+        with sms.phase("io"):
+            sms.arrays = pack_system(sms)
+            recorder = TrajectoryFile.open(self.path(entry["trajectory"]))
+            recorder.count = sms.timesteps // sms.record_every + 1
+            if entry["steps"] == sms.timesteps:
+                data = checkpoint.read(self.path(entry["checkpoint"]))
+                pos, v = data["pos"], data["v"]
+            else:
+                pos, v = recorder.positions[recorder.count - 1], recorder.velocities[recorder.count - 1]
+
+        masses = sms.store.masses
+        masses.data("pos")[:] = pos
+        masses.data("v")[:] = v
+        sms.state = None
+        sms.recorder = recorder
+        sms.step = sms.timesteps
+        sms.viewTrajectories()
+        sms.E_i = sms.energy(0)
+        sms.E_f = sms.energy(-1)
+        print("--- CACHE ---")
+        print(f"Read {sms.timesteps} time steps from the cache ({entry['steps']} cached)")
+
+        if sms.save_csv:
+            sms.save()
+        return recorder
+
+
+    def compute(self, sms, k):
+        """
+        Run sms into a new result k, continuing the cached result k (if any, it is shorter)
+        """
+
+        entry = self.index.get(k)
+        name = f"{k}-{sms.timesteps}"
+        trajectory, ckpt = name + ".traj", name + ".ckpt"
+        with sms.phase("io"):
+            recorder = TrajectoryFile.create(self.path(trajectory), len(sms.masses), sms.timesteps, sms.record_every,
+                                             sms.delta_t, sms.describe())
+        if entry is not None and entry["steps"] < sms.timesteps:
+            # Continue the cached run: its records, then its final state
+            with sms.phase("io"):
+                cached = TrajectoryFile.open(self.path(entry["trajectory"]))
+                recorder.positions[:cached.count] = cached.positions[:cached.count]
+                recorder.velocities[:cached.count] = cached.velocities[:cached.count]
+                recorder.count = cached.count
+                data = checkpoint.read(self.path(entry["checkpoint"]))
+                del cached
+            sms.start(recorder)
+            checkpoint.restore(sms, data)
+            print("--- CACHE ---")
+            print(f"Continuing {entry['steps']} cached time steps")
+            self.resumed += 1
+        else:
+            recorder.record(0, sms.store.masses.data("pos"), sms.store.masses.data("v"))
+            sms.start(recorder)
+            self.misses += 1
+
+        sms.advance(sms.timesteps - sms.step)
+        with sms.phase("io"):
+            checkpoint.write(sms, self.path(ckpt))
+        sms.finish()
+
+        # The new result replaces the shorter cached result
+        if k in self.index and self.index[k]["trajectory"] != trajectory:
+            self.remove(k)
+        self.index[k] = {"steps": sms.timesteps,
+                         "trajectory": trajectory,
+                         "checkpoint": ckpt,
+                         "bytes": os.path.getsize(self.path(trajectory)) + os.path.getsize(self.path(ckpt)),
+                         "used": time.time()}
+        self.evict(keep = k)
+        self.save()
+        return recorder
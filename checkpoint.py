@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+
+from compression import CompressedTrajectory
+from engine import pack_system
+from trajectory import TrajectoryBuffer, TrajectoryFile, TrajectoryWindow
+
+
+"""
+ Checkpoints
+
+ Saves the complete state of a running simulation (time step, positions,
+ velocities and time of the engine, cached values and counters of the
+ integrator, number of recorded time steps) so that a run that died can
+ be resumed from the last checkpoint with bit-identical results
+ (sms.autosave(path, every), sms.resume(path)).
+
+ Checkpoints are NPZ files. They are written to a temporary file first and
+ then renamed over the previous checkpoint, so a checkpoint file is always
+ complete. Runs that record into a trajectory file (save = True) flush the
+ file before the checkpoint is written and continue writing to it when
+ resumed. Runs recording into memory append the records since the previous
+ checkpoint to a trajectory file next to the checkpoint (path + ".traj"),
+ so every record is written once; the checkpoint holds the number of
+ valid records. Streamed runs (only the latest records are kept) and
+ compressed runs (see compression.py) store their records in the checkpoint.
+ The checkpoint also holds the initial state and parameters of the system,
+ to check that a checkpoint is resumed with the system it was written for.
+"""
+
+
+FORMAT = 1
+
+# Initial state and parameters of the system (see pack_system)
+SYSTEM = ("fixtures_pos", "m", "pos", "v", "i", "j", "k", "l0")
+
+
+def write(sms, path):
+    """
+    Write a checkpoint of the current state of a run of sms to path (atomically)
+    """
+
+    recorder = sms.recorder
+    if recorder is None:
+        raise RuntimeError("No run to checkpoint, call start() first")
+
+    data = {"format": FORMAT,
+            "step": sms.step,
+            "timesteps": sms.timesteps,
+            "delta_t": sms.delta_t,
+            "record_every": sms.record_every,
+            "engine": sms.engine,
+            "integrator": sms.integrator,
+            "E_i": sms.E_i,
+            "count": recorder.count}
+    data.update({"system." + name: sms.arrays[name] for name in SYSTEM})
+
+    if sms.engine == "python":
+        nf = len(sms.nodes) - len(sms.velocities)
+        data.update(pos = np.array(sms.nodes[nf:], dtype = float).reshape(-1, 2),
+                    v = np.array(sms.velocities, dtype = float).reshape(-1, 2),
+                    t = sms.step * sms.delta_t)
+    else:
+        data.update(pos = sms.state.pos, v = sms.state.v, t = sms.state.t)
+        data.update({"integrator." + name: value for name, value in sms.state.integrator.state().items()})
+
+    if isinstance(recorder, TrajectoryFile):
+        recorder.flush()
+        data["trajectory"] = os.path.abspath(recorder.path)
+    elif isinstance(recorder, CompressedTrajectory):
+        data.update({"compressed." + name: value for name, value in recorder.state().items()})
+    elif isinstance(recorder, TrajectoryWindow):
+        data["positions"] = recorder.view("positions")
+        data["velocities"] = recorder.view("velocities")
+        data.update(window = len(recorder.positions), first = recorder.first, drift = recorder.drift)
+    else:
+        data["records"] = os.path.abspath(records(sms, path))
+
+    # Write a temporary file and replace the previous checkpoint with it
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def records(sms, path):
+    """
+    Append the records of sms (recorded into memory) written since the previous
+    checkpoint of the run to the records file of the checkpoint path (created by
+    the first checkpoint of the run). Returns the path of the records file.
+    """
+
+    recorder = sms.recorder
+    target = path + ".traj"
+    f = sms.checkpoint_records
+    if f is None or os.path.abspath(f.path) != os.path.abspath(target):
+        f = TrajectoryFile.create(target, len(sms.masses), sms.timesteps, sms.record_every,
+                                  sms.delta_t, sms.describe())
+        sms.checkpoint_records = f
+
+    # Records after the previous checkpoint may have been written again (see recorder())
+    start = min(f.count, recorder.count)
+    f.positions[start:recorder.count] = recorder.positions[start:recorder.count]
+    f.velocities[start:recorder.count] = recorder.velocities[start:recorder.count]
+    f.count = recorder.count
+    f.flush()
+    return target
+
+
+def read(path):
+    """
+    Read a checkpoint into a dictionary (numbers and strings as Python objects)
+    """
+
+    with np.load(path) as f:
+        data = {name: f[name] if f[name].ndim else f[name].item() for name in f.files}
+    if data.get("format") != FORMAT:
+        raise ValueError(f"{path} is not a checkpoint of a supported format")
+    return data
+
+
+def check(sms, data):
+    """
+    Check that a checkpoint was written by a run of sms (same system, in its
+    initial state, and same settings)
+    """
+
+    for name in ("timesteps", "delta_t", "record_every", "engine", "integrator"):
+        if data[name] != getattr(sms, name):
+            raise ValueError(f"Checkpoint does not match the system: {name} is {data[name]}, not {getattr(sms, name)}")
+    arrays = pack_system(sms)
+    for name in SYSTEM:
+        if not np.array_equal(data["system." + name], arrays[name]):
+            raise ValueError(f"Checkpoint does not match the system: different {name}")
+
+
+def recorder(sms, data):
+    """
+    Trajectory recorder of a checkpoint: the trajectory file the run was writing
+    (opened for writing), the compressed recorder or a buffer holding the records
+    of the checkpoint
+    """
+
+    if "compressed.count" in data:
+        recorder = CompressedTrajectory.fromState({name[len("compressed."):]: value for name, value in data.items()
+                                                   if name.startswith("compressed.")})
+    elif "trajectory" in data:
+        recorder = TrajectoryFile.open(data["trajectory"], "r+")
+        if recorder.header["shape"] != [sms.timesteps // sms.record_every + 1, len(sms.masses), 2]:
+            raise ValueError(f"Trajectory file {data['trajectory']} does not match the system")
+    elif "records" in data:
+        f = TrajectoryFile.open(data["records"])
+        if f.header["shape"] != [sms.timesteps // sms.record_every + 1, len(sms.masses), 2]:
+            raise ValueError(f"Records file {data['records']} does not match the system")
+        recorder = TrajectoryBuffer(len(sms.masses), sms.timesteps, sms.record_every)
+        recorder.positions[:data["count"]] = f.positions[:data["count"]]
+        recorder.velocities[:data["count"]] = f.velocities[:data["count"]]
+        del f
+    else:
+        if "window" in data:
+            recorder = TrajectoryWindow(len(sms.masses), data["window"], sms.record_every)
+            recorder.first, recorder.drift = data["first"], data["drift"]
+        else:
+            recorder = TrajectoryBuffer(len(sms.masses), sms.timesteps, sms.record_every)
+        recorder.positions[:len(data["positions"])] = data["positions"]
+        recorder.velocities[:len(data["velocities"])] = data["velocities"]
+    # Records written after the checkpoint are written again
+    recorder.count = data["count"]
+    return recorder
+
+
+def restore(sms, data):
+    """
+    Restore the state of a run of sms (started with the recorder of the checkpoint)
+    """
+
+    sms.step = data["step"]
+    sms.E_i = data["E_i"]
+    if "records" in data:
+        # The following checkpoints append to the records file
+        sms.checkpoint_records = TrajectoryFile.open(data["records"], "r+")
+        sms.checkpoint_records.count = data["count"]
+    masses = sms.store.masses
+    masses.data("pos")[:] = data["pos"]
+    masses.data("v")[:] = data["v"]
+
+    if sms.engine == "python":
+        nf = len(sms.fixtures)
+        sms.nodes[nf:] = data["pos"].tolist()
+        sms.velocities = data["v"].tolist()
+        return
+
+    state = sms.state
+    state.pos[...] = data["pos"]
+    state.v[...] = data["v"]
+    state.t = data["t"]
+    prefix = "integrator."
+    state.integrator.restore(state, {name[len(prefix):]: value for name, value in data.items() if name.startswith(prefix)})
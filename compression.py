@@ -0,0 +1,513 @@
+import json
+
+import numpy as np
+
+
+"""
+ Compressed trajectories
+
+ Recording every time step of every mass (see trajectory.py) spends most
+ of the memory on smooth stretches of the trajectories. A compressed
+ recording (sms.compress(tol)) keeps a sample (position and velocity) of a
+ mass only where interpolating between its kept samples would miss a
+ recorded position by more than the tolerance tol of that mass, or a
+ recorded velocity by more than vtol:
+
+ -"linear": straight lines between the kept positions. A sample is kept
+  once no line from the last kept sample passes all skipped records
+  within the tolerances (tracked as the range of feasible slopes, O(1) per
+  mass and record)
+ -"hermite": cubic Hermite curves through the kept positions, with the kept
+  velocities as tangents: fewer samples on smooth curves. The skipped
+  records (at most max_gap per mass) are checked against the curve on
+  every record.
+
+ Velocities are interpolated linearly between the kept velocities in both
+ cases. The kept samples are quantized (to integer multiples of a quarter
+ of the tolerances) and the tests run on the quantized values, so the
+ reconstruction stays within the tolerances. Blocks of kept samples are
+ sorted by mass and record and stored as the differences of consecutive
+ values in the smallest integer type holding them.
+
+ Readers reconstruct any record from the neighbouring kept samples:
+ view() returns a lazy array-like (shape (count, n_masses, 2)) that only
+ reconstructs the records and masses indexed, so plotting, energies and
+ checkpoints work on compressed recordings as on a trajectory buffer.
+ The energies are computed from the reconstructed states: the energy
+ drift includes the errors allowed by the tolerances.
+
+ File layout (compression.load(path)): NPZ archive of the state of the
+ recorder (see CompressedTrajectory.state()), zlib compressed.
+"""
+
+
+METHODS = ("linear", "hermite")
+
+# Default velocity tolerance: VTOL times the position tolerance per duration of the run
+VTOL = 10.0
+
+# Kept samples collected before they are sorted and delta encoded into a block
+BLOCK = 1 << 16
+
+
+def packed(a):
+    """
+    Integer array a in the smallest signed integer type holding its values
+    """
+
+    lo, hi = (a.min(), a.max()) if a.size else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return a.astype(dtype)
+    return a.astype(np.int64)
+
+
+def encode(fields):
+    """
+    Delta encoding of integer arrays (along the first axis): dictionary of the first
+    row ("<name>.first") and the differences of consecutive rows ("<name>.delta")
+    """
+
+    encoded = {}
+    for name, a in fields.items():
+        encoded[name + ".first"] = a[:1].astype(np.int64)
+        encoded[name + ".delta"] = packed(np.diff(a, axis = 0))
+    return encoded
+
+
+def decode(encoded, name):
+    """
+    Integer array name of a delta encoding (see encode())
+    """
+
+    first = encoded[name + ".first"]
+    return np.concatenate([first, first + np.cumsum(encoded[name + ".delta"], axis = 0, dtype = np.int64)])
+
+
+def hermite(s, h, x0, v0, x1, v1):
+    """
+    Cubic Hermite curve from x0 (velocity v0) to x1 (velocity v1) over the time h,
+    evaluated at the fractions s of h
+    """
+
+    s, h = s[..., None], h[..., None]
+    s2, s3 = s * s, s * s * s
+    return (2 * s3 - 3 * s2 + 1) * x0 + (s3 - 2 * s2 + s) * h * v0 + (3 * s2 - 2 * s3) * x1 + (s3 - s2) * h * v1
+
+
+class CompressedView:
+    """
+    Initialize a lazy read-only view of a compressed recording.
+    Attributes:
+    -recorder: CompressedTrajectory the records are reconstructed from
+    -field: "positions" or "velocities"
+    -records: numbers of the records in the view
+    -transposed: layout (record, coordinate, mass) instead of (record, mass, coordinate)
+
+    Indexing with records only (e.g. view[start:stop]) returns a view, any other
+    index reconstructs the selected records and masses into an array.
+    """
+
+    ndim = 3
+    dtype = np.dtype(float)
+
+    def __init__(self, recorder, field, records, transposed = False):
+        self.recorder = recorder
+        self.field = field
+        self.records = records
+        self.transposed = transposed
+
+
+    @property
+    def shape(self):
+        if self.transposed:
+            return (len(self.records), 2, self.recorder.n_masses)
+        return (len(self.records), self.recorder.n_masses, 2)
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        records = self.records[key[0]]
+        if len(key) == 1 and np.ndim(records) == 1:
+            return CompressedView(self.recorder, self.field, records, self.transposed)
+
+        rest = key[1:]
+        masses = np.arange(self.recorder.n_masses)
+        if rest and not self.transposed:
+            masses, rest = masses[rest[0]], rest[1:]
+        data = self.recorder.reconstruct(np.atleast_1d(records), np.atleast_1d(masses), self.field)
+        if np.ndim(masses) == 0:
+            data = data[:, 0]
+        elif self.transposed:
+            data = data.transpose(0, 2, 1)
+        if np.ndim(records) == 0:
+            data = data[0]
+        return data[rest] if rest else data
+
+
+    def __array__(self, dtype = None, copy = None):
+        data = self[:, :]
+        return data if dtype is None else data.astype(dtype)
+
+
+    def transpose(self, *axes):
+        """
+        View in the layout (record, coordinate, mass) (only axes (0, 2, 1) are supported)
+        """
+
+        if tuple(axes) != (0, 2, 1):
+            raise ValueError("Compressed views can only swap the mass and coordinate axes")
+        return CompressedView(self.recorder, self.field, self.records, not self.transposed)
+
+
+class CompressedTrajectory:
+    """
+    Initialize a compressed trajectory recorder (same interface as TrajectoryBuffer).
+    Attributes:
+    -n_masses: number of masses
+    -size: number of records the run holds (timesteps // stride + 1)
+    -stride: record every stride-th time step
+    -delta_t: time step (scales the velocities of the Hermite curves)
+    -tol: largest distance of a reconstructed position from the recorded one, per mass
+    -vtol: same for the velocities (default VTOL * tol / duration of the run)
+    -method: interpolation between the kept samples, "linear" or "hermite"
+    -quantum: quantization step of the kept positions, per mass (default tol / 4;
+     velocities: vquantum = vtol / 4)
+    -max_gap: largest number of records between kept samples ("hermite" only)
+    -count: number of records written so far
+    -blocks: delta encoded blocks of kept samples (see encode())
+    -anchor: record of the last kept sample of every mass
+    """
+
+    # Number of the record held in the first row (all records are kept)
+    first = 0
+
+    def __init__(self, n_masses, timesteps, stride = 1, delta_t = 1.0, tol = 1e-3, method = "linear",
+                 vtol = None, quantum = None, max_gap = 64):
+        if stride < 1:
+            raise ValueError("Recording stride must be at least 1")
+        if method not in METHODS:
+            raise ValueError(f"Unknown interpolation method: {method}")
+        tol = np.broadcast_to(np.asarray(tol, dtype = float), (n_masses,)).copy()
+        quantum = tol / 4 if quantum is None else np.broadcast_to(np.asarray(quantum, dtype = float), (n_masses,)).copy()
+        duration = max(timesteps, 1) * delta_t
+        vtol = VTOL * tol / duration if vtol is None else np.broadcast_to(np.asarray(vtol, dtype = float), (n_masses,)).copy()
+        if np.any(tol <= 0) or np.any(quantum <= 0) or np.any(vtol <= 0):
+            raise ValueError("Tolerances and quantum must be positive")
+        if np.any(quantum > np.sqrt(2) * tol):
+            raise ValueError("Quantum must be at most sqrt(2) times the tolerance")
+        if max_gap < 1:
+            raise ValueError("Largest gap must be at least 1 record")
+
+        self.n_masses = n_masses
+        self.size = timesteps // stride + 1
+        self.stride = stride
+        self.delta_t = delta_t
+        self.tol = tol
+        self.vtol = vtol
+        self.method = method
+        self.quantum = quantum
+        self.vquantum = vtol / 4
+        self.max_gap = max_gap
+        # Per coordinate (positions and velocities) quantization steps and largest deviations
+        # (within them in both coordinates, the distance is within the tolerance)
+        self.scale = np.repeat(np.column_stack([self.quantum, self.vquantum]), 2, axis = 1)
+        self.deviation = np.repeat(np.column_stack([tol, vtol]), 2, axis = 1) / np.sqrt(2)
+        self.count = 0
+        self.blocks = []
+        self.pending = []
+        self.n_pending = 0
+
+        # Last kept sample of every mass and the latest record, quantized positions and velocities
+        self.anchor = np.zeros(n_masses, dtype = np.int64)
+        self.q = np.zeros((n_masses, 4), dtype = np.int64)
+        self.last = self.q.copy()
+        # "linear": range of slopes of the lines from the last kept sample through all skipped records.
+        # "hermite": recorded positions and velocities of the records since the last kept sample
+        self.lo = np.full((n_masses, 4), -np.inf)
+        self.hi = np.full((n_masses, 4), np.inf)
+        self.window = np.zeros((max_gap + 1, n_masses, 4)) if method == "hermite" else None
+        self.table = None
+
+
+    @property
+    def n_samples(self):
+        """
+        Number of kept samples (position and velocity of one mass at one record)
+        """
+
+        return sum(len(block["record.delta"]) + 1 for block in self.blocks if len(block["record.first"])) + self.n_pending
+
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the kept samples
+        """
+
+        encoded = sum(a.nbytes for block in self.blocks for a in block.values())
+        return encoded + sum(a.nbytes for sample in self.pending for a in sample)
+
+
+    def ratio(self):
+        """
+        Size of the records as uncompressed positions and velocities (float64)
+        divided by the size of the kept samples
+        """
+
+        return self.count * self.n_masses * 4 * 8 / max(self.nbytes, 1)
+
+
+    def record(self, step, pos, v = None):
+        """
+        Compress the positions (and velocities) of time step step
+        if it falls on the recording stride (records are written in order)
+        """
+
+        if step % self.stride:
+            return
+        r = step // self.stride
+        if r != self.count or r >= self.size:
+            return
+
+        x = np.empty((self.n_masses, 4))
+        x[:, :2] = pos
+        x[:, 2:] = 0.0 if v is None else v
+        q = np.rint(x / self.scale).astype(np.int64)
+
+        if r == 0:
+            self.keep(np.arange(self.n_masses), 0, q)
+        else:
+            # Keep the previous record of the masses the interpolation to this record fails for
+            broken = np.flatnonzero(~self.fits(r, x, q))
+            if len(broken):
+                self.keep(broken, r - 1, self.last[broken])
+                self.lo[broken], self.hi[broken] = -np.inf, np.inf
+        if self.method == "linear":
+            self.narrow(r, x)
+        else:
+            self.window[r % len(self.window)] = x
+
+        self.last = q
+        self.count = r + 1
+        self.table = None
+
+
+    def fits(self, r, x, q):
+        """
+        Masses whose records since their last kept sample are reconstructed within the
+        tolerances by the interpolation to record r (positions and velocities x,
+        quantized q)
+        """
+
+        H = r - self.anchor
+        x0 = self.q * self.scale
+        x1 = q * self.scale
+        if self.method == "linear":
+            slope = (x1 - x0) / H[:, None]
+            return np.all((slope >= self.lo) & (slope <= self.hi), axis = 1)
+
+        fits = H <= self.max_gap
+        D = min(H.max(), self.max_gap) - 1
+        if D > 0:
+            d = np.arange(1, D + 1)
+            s = d / H[:, None]
+            h = H[:, None] * (self.stride * self.delta_t)
+            skipped = self.window[(self.anchor[:, None] + d) % len(self.window), np.arange(self.n_masses)[:, None]]
+            x0, x1 = x0[:, None], x1[:, None]
+            curve = np.concatenate([hermite(s, h, x0[..., :2], x0[..., 2:], x1[..., :2], x1[..., 2:]),
+                                    x0[..., 2:] + s[..., None] * (x1[..., 2:] - x0[..., 2:])], axis = -1)
+            error = np.abs(curve - skipped) > self.deviation[:, None]
+            fits &= ~np.any(error & (d < H[:, None])[..., None], axis = (1, 2))
+        return fits
+
+
+    def narrow(self, r, x):
+        """
+        Narrow the range of slopes from the last kept sample of every mass to the lines
+        passing record r (positions and velocities x) within the tolerances
+        """
+
+        H = (r - self.anchor)[:, None]
+        x0 = self.q * self.scale
+        e = self.deviation
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            # Records that were just kept (H = 0) do not narrow the range
+            self.lo = np.where(H > 0, np.maximum(self.lo, (x - e - x0) / H), self.lo)
+            self.hi = np.where(H > 0, np.minimum(self.hi, (x + e - x0) / H), self.hi)
+
+
+    def keep(self, masses, r, q):
+        """
+        Keep the samples of record r of the given masses (quantized positions and velocities q)
+        """
+
+        self.pending.append((masses.astype(np.int64), np.full(len(masses), r, dtype = np.int64), q))
+        self.n_pending += len(masses)
+        self.anchor[masses] = r
+        self.q[masses] = q
+        if self.n_pending >= BLOCK:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Sort the pending kept samples by mass and record into a delta encoded block
+        """
+
+        if not self.pending:
+            return
+        mass, record, q = (np.concatenate(a) for a in zip(*self.pending))
+        order = np.lexsort((record, mass))
+        self.blocks.append(encode({"mass": mass[order], "record": record[order], "q": q[order]}))
+        self.pending = []
+        self.n_pending = 0
+
+
+    def samples(self):
+        """
+        All kept samples sorted by mass and record: masses, records and quantized
+        positions and velocities
+        """
+
+        self.flush()
+        if not self.blocks:
+            return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros((0, 4), dtype = np.int64)
+        mass, record, q = (np.concatenate([decode(block, name) for block in self.blocks])
+                           for name in ("mass", "record", "q"))
+        order = np.lexsort((record, mass))
+        return mass[order], record[order], q[order]
+
+
+    def lookup(self):
+        """
+        Table of the kept samples and the latest record of every mass, sorted by mass and
+        record (cached until the next record): sort key, records, positions and velocities
+        and the index of the last sample of every mass
+        """
+
+        if self.table is None:
+            mass, record, q = self.samples()
+            # The interpolation since the last kept samples ends at the latest record
+            tail = np.flatnonzero(self.anchor < self.count - 1)
+            mass = np.concatenate([mass, tail])
+            record = np.concatenate([record, np.full(len(tail), self.count - 1)])
+            q = np.concatenate([q, self.last[tail]])
+            order = np.lexsort((record, mass))
+            mass, record = mass[order], record[order]
+            x = q[order] * self.scale[mass]
+            last = np.searchsorted(mass, np.arange(self.n_masses), side = "right") - 1
+            self.table = (mass * self.size + record, record, x, last)
+        return self.table
+
+
+    def reconstruct(self, records, masses, field = "positions"):
+        """
+        Positions (or velocities) of the given masses at the given records,
+        shape (len(records), len(masses), 2)
+        """
+
+        records, masses = np.asarray(records), np.asarray(masses)
+        if np.any(records >= self.count) or np.any(records < 0):
+            raise IndexError(f"Record out of range (recorded: {self.count})")
+        key, record, x, last = self.lookup()
+        k = np.searchsorted(key, masses[None, :] * self.size + records[:, None], side = "right") - 1
+        k1 = np.minimum(k + 1, last[masses][None, :])
+        H = record[k1] - record[k]
+        s = np.where(H > 0, (records[:, None] - record[k]) / np.maximum(H, 1), 0.0)
+        x0, x1 = x[k], x[k1]
+
+        if self.method == "hermite" and field == "positions":
+            return hermite(s, H * (self.stride * self.delta_t), x0[..., :2], x0[..., 2:], x1[..., :2], x1[..., 2:])
+        columns = slice(0, 2) if field == "positions" else slice(2, 4)
+        return x0[..., columns] + s[..., None] * (x1[..., columns] - x0[..., columns])
+
+
+    def view(self, field = "positions"):
+        """
+        Lazy read-only view of the records written so far, shape (count, n_masses, 2)
+        (field: "positions" or "velocities"), see CompressedView
+        """
+
+        return CompressedView(self, field, np.arange(self.count))
+
+
+    def trajectories(self):
+        """
+        Lazy read-only view in the layout of SpringMassSystem.trajectories:
+        one element per record containing [x_coords, y_coords] of all masses
+        """
+
+        return self.view().transpose(0, 2, 1)
+
+
+    def trajectory(self, n):
+        """
+        Reconstructed trajectory of mass n, shape (count, 2)
+        """
+
+        trajectory = self.reconstruct(np.arange(self.count), [n])[:, 0]
+        trajectory.flags.writeable = False
+        return trajectory
+
+
+    def state(self):
+        """
+        Dictionary of arrays holding the complete state of the recorder
+        (the kept samples are merged into one block)
+        """
+
+        mass, record, q = self.samples()
+        self.blocks = [encode({"mass": mass, "record": record, "q": q})] if len(mass) else []
+        state = {"n_masses": self.n_masses, "size": self.size, "stride": self.stride, "delta_t": self.delta_t,
+                 "tol": self.tol, "method": self.method, "quantum": self.quantum, "vtol": self.vtol,
+                 "max_gap": self.max_gap, "count": self.count, "anchor": self.anchor, "q": self.q,
+                 "last": self.last, "lo": self.lo, "hi": self.hi}
+        if self.window is not None:
+            state["window"] = self.window
+        if self.blocks:
+            state.update({"samples." + name: a for name, a in self.blocks[0].items()})
+        return state
+
+
+    @classmethod
+    def fromState(cls, state):
+        """
+        Recorder with the state of a dictionary written by state()
+        """
+
+        recorder = cls(int(state["n_masses"]), (int(state["size"]) - 1) * int(state["stride"]), int(state["stride"]),
+                       float(state["delta_t"]), state["tol"], str(state["method"]), state["vtol"],
+                       state["quantum"], int(state["max_gap"]))
+        recorder.count = int(state["count"])
+        for name in ("anchor", "q", "last", "lo", "hi", "window"):
+            if name in state:
+                setattr(recorder, name, np.array(state[name]))
+        samples = {name[len("samples."):]: np.asarray(a) for name, a in state.items() if name.startswith("samples.")}
+        recorder.blocks = [samples] if samples else []
+        return recorder
+
+
+    def save(self, path, system = None):
+        """
+        Write the compressed recording to path (NPZ, read it back with load(path)).
+        system is a JSON serializable description of the simulated system.
+        """
+
+        with open(path, "wb") as f:
+            np.savez_compressed(f, header = json.dumps({"system": system}), **self.state())
+
+
+def load(path):
+    """
+    Open a compressed recording written by CompressedTrajectory.save()
+    """
+
+    with np.load(path) as f:
+        state = {name: f[name] for name in f.files}
+    return CompressedTrajectory.fromState(state)
@@ -0,0 +1,157 @@
+import numpy as np
+
+
+"""
+ Contact forces
+
+ Penalty contact between masses: every mass is a disc of the same radius,
+ and two overlapping discs are pushed apart by a force proportional to
+ their overlap (stiffness * (2 * radius - distance)), acting along the line
+ between their centres. Masses connected by a spring do not collide by default.
+
+ Candidate pairs come from a uniform grid (cell lists) with a cell size
+ of the cutoff distance 2 * radius + skin: the masses are sorted by cell,
+ and the masses of every occupied cell are paired with the masses of the
+ same cell and of 4 of its 8 neighbour cells, so every pair is found once.
+ The pair list stays valid until a mass has moved more than skin / 2,
+ and the sort starts from the order of the previous build (nearly sorted
+ input, so the stable sort takes close to linear time).
+
+ The contact forces are added to the spring forces of the engine
+ (sms.collisions(radius, stiffness)), so they work with all integrators.
+ The pairs in contact are summed in a fixed order, so the forces do not
+ depend on when the pair list was built.
+"""
+
+
+# Cell offsets (dx, dy) visited from every cell: half of the 3x3 stencil
+STENCIL = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+
+class Contact:
+    """
+    Initialize penalty contact between masses.
+    Attributes:
+    -radius: contact radius of the masses (masses closer than 2 * radius are in contact)
+    -stiffness: penalty stiffness (force per overlap length)
+    -skin: extra distance of the pair list (rebuilt after a mass has moved skin / 2)
+    -exclude_connected: masses connected by a spring do not collide
+    -a, b: mass indices of the candidate pairs (a < b, sorted)
+    -reference: positions of the masses at the last build of the pair list
+    -excluded: keys a * n_masses + b of the pairs connected by a spring (sorted)
+    -n_builds: number of builds of the pair list
+    -n_contacts: number of pairs in contact at the last force evaluation
+    """
+
+    def __init__(self, radius, stiffness, skin = None, exclude_connected = True):
+        if radius <= 0 or stiffness <= 0:
+            raise ValueError("Contact radius and stiffness must be positive")
+        self.radius = radius
+        self.stiffness = stiffness
+        self.skin = 0.5 * radius if skin is None else skin
+        self.exclude_connected = exclude_connected
+        self.excluded = np.empty(0, dtype = np.int64)
+        self.order = None
+        self.reset()
+
+
+    def reset(self, topology = None):
+        """
+        Discard the pair list (and take the springs to exclude from topology, if given)
+        """
+
+        self.a = self.b = self.reference = None
+        self.n_builds = 0
+        self.n_contacts = 0
+        if topology is not None and self.exclude_connected:
+            nf, n = topology.n_fixtures, topology.n_masses
+            free = (topology.i >= nf) & (topology.j >= nf)
+            a, b = topology.i[free] - nf, topology.j[free] - nf
+            self.excluded = np.unique(np.minimum(a, b).astype(np.int64) * n + np.maximum(a, b))
+
+
+    def build(self, pos):
+        """
+        Build the list of candidate pairs (closer than 2 * radius + skin) of the masses at pos
+        """
+
+        n = len(pos)
+        cutoff = 2 * self.radius + self.skin
+        self.reference = pos.copy()
+        self.n_builds += 1
+        if n == 0:
+            self.a = self.b = np.empty(0, dtype = np.int64)
+            return
+        cell = np.floor(pos / cutoff).astype(np.int64)
+        cell -= cell.min(axis = 0)
+        # One empty row of cells between the columns, so that dy = +-1 never wraps around
+        ny = cell[:, 1].max() + 2
+        key = cell[:, 0] * ny + cell[:, 1]
+
+        # Sort by cell, starting from the previous order
+        if self.order is None or len(self.order) != n:
+            self.order = np.arange(n)
+        self.order = self.order[np.argsort(key[self.order], kind = "stable")]
+        sorted_key = key[self.order]
+
+        # Occupied cells: key, first position in the sorted order and number of masses
+        first = np.concatenate([[0], np.flatnonzero(np.diff(sorted_key)) + 1])
+        cells = sorted_key[first]
+        counts = np.diff(np.append(first, n))
+
+        a, b = [], []
+        for dx, dy in STENCIL:
+            # Occupied neighbour cells (sorted queries into the sorted cells)
+            target = cells + dx * ny + dy
+            other = np.minimum(np.searchsorted(cells, target), len(cells) - 1)
+            hit = np.flatnonzero(cells[other] == target)
+            ca, cb = hit, other[hit]
+
+            # All pairs of a mass of cell ca and a mass of cell cb
+            na, nb = counts[ca], counts[cb]
+            m = na * nb
+            local = np.arange(m.sum()) - np.repeat(np.cumsum(m) - m, m)
+            nb = np.repeat(nb, m)
+            ia = np.repeat(first[ca], m) + local // nb
+            ib = np.repeat(first[cb], m) + local % nb
+            if dx == 0 and dy == 0:
+                # Pairs within a cell once
+                ia, ib = ia[ia < ib], ib[ia < ib]
+            a.append(self.order[ia])
+            b.append(self.order[ib])
+        a, b = np.concatenate(a), np.concatenate(b)
+
+        # Within the cutoff, sorted
+        d = pos[b] - pos[a]
+        keep = np.einsum("ec,ec->e", d, d) < cutoff * cutoff
+        keys = np.sort(np.minimum(a[keep], b[keep]) * n + np.maximum(a[keep], b[keep]))
+        if len(self.excluded):
+            keys = keys[~np.isin(keys, self.excluded, assume_unique = True)]
+
+        self.a, self.b = keys // n, keys % n
+
+
+    def forces(self, pos):
+        """
+        Contact forces acting on the masses at pos, shape (n_masses, 2)
+        """
+
+        if pos.ndim != 2:
+            raise ValueError("Contact forces do not support batched engines")
+        if self.reference is None or len(self.reference) != len(pos) or \
+                np.max(np.einsum("nc,nc->n", pos - self.reference, pos - self.reference)) > (0.5 * self.skin) ** 2:
+            self.build(pos)
+
+        F = np.zeros_like(pos)
+        d = pos[self.b] - pos[self.a]
+        l = np.sqrt(np.einsum("ec,ec->e", d, d))
+        touching = (l < 2 * self.radius) & (l > 0)
+        self.n_contacts = int(np.count_nonzero(touching))
+        if self.n_contacts:
+            d, l = d[touching], l[touching]
+            # Force acting on mass b; mass a gets the opposite force
+            f = (self.stiffness * (2 * self.radius - l) / l)[:, None] * d
+            np.add.at(F, self.b[touching], f)
+            np.add.at(F, self.a[touching], -f)
+        return F
+
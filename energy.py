@@ -0,0 +1,74 @@
+import numpy as np
+
+
+"""
+ Energy accounting
+
+ Vectorized kinetic, gravitational and elastic energy of a spring mass
+ system for any number of recorded states at once. The arrays describing
+ the system are the ones returned by pack_system() (engine.py).
+"""
+
+
+def kinetic(v, m):
+    """
+    Kinetic energy of the masses, v: velocities of shape (..., n_masses, 2)
+    """
+
+    return 0.5 * np.einsum("n,...nc,...nc->...", m, v, v)
+
+
+def gravitational(pos, m, g):
+    """
+    Potential energy of the masses in the gravity field (zero at y = 0),
+    g: signed gravitational acceleration (negative: pointing downwards)
+    """
+
+    return -g * np.einsum("n,...n->...", m, pos[..., 1])
+
+
+def elastic(pos, fixtures_pos, i, j, k, l0):
+    """
+    Potential energy 1/2 * k * (l - l0)^2 of the springs,
+    i, j: node indices of the spring ends (fixtures first, then masses)
+    """
+
+    nodes = np.concatenate([np.broadcast_to(fixtures_pos, pos.shape[:-2] + fixtures_pos.shape), pos], axis = -2)
+    d = nodes[..., j, :] - nodes[..., i, :]
+    l = np.sqrt(np.einsum("...c,...c->...", d, d))
+    return 0.5 * np.sum(k * (l - l0) ** 2, axis = -1)
+
+
+def energies(positions, velocities, arrays, chunk_size = 4096):
+    """
+    Kinetic, gravitational, elastic and total energy of every record in
+    positions and velocities (shape (n_records, n_masses, 2)).
+    The records are processed in chunks of chunk_size to bound the memory
+    used for the spring vectors.
+    Returns a dictionary of arrays of shape (n_records,).
+    """
+
+    n = len(positions)
+    result = {name: np.empty(n) for name in ("kinetic", "gravitational", "elastic")}
+
+    for start in range(0, n, chunk_size):
+        pos = np.asarray(positions[start:start + chunk_size])
+        v = np.asarray(velocities[start:start + chunk_size])
+        part = slice(start, start + len(pos))
+        result["kinetic"][part] = kinetic(v, arrays["m"])
+        result["gravitational"][part] = gravitational(pos, arrays["m"], arrays["g"])
+        result["elastic"][part] = elastic(pos, arrays["fixtures_pos"], arrays["i"], arrays["j"],
+                                          arrays["k"], arrays["l0"])
+
+    result["total"] = result["kinetic"] + result["gravitational"] + result["elastic"]
+    return result
+
+
+def max_drift(total):
+    """
+    Largest deviation of the total energy from its initial value,
+    relative to the initial value
+    """
+
+    total = np.asarray(total)
+    return np.max(np.abs(total - total[0])) / abs(total[0])
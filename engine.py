@@ -0,0 +1,161 @@
+import numpy as np
+
+from integrators import get_integrator
+
+
+"""
+ Vectorized force engine
+
+ Packs the fixtures, masses and springs of a SpringMassSystem into
+ contiguous NumPy arrays (struct of arrays) so that all spring forces
+ of a time step are computed in one batched pass instead of walking
+ the attached lists of every mass. The springs come from the compiled
+ topology of the system (topology.py).
+"""
+
+
+def pack_system(sms):
+    """
+    Pack the Fixture, Mass and Spring objects of a SpringMassSystem into arrays.
+    Spring end points are node indices: fixtures first, then masses.
+    The spring arrays are the (read-only) edge table of the compiled topology
+    of the system (see topology.py).
+    """
+
+    topology = sms.compile()
+    fixtures, masses = sms.store.fixtures, sms.store.masses
+
+    return {"fixtures_pos": fixtures.data("pos").copy(),
+            "m": masses.data("m").copy(),
+            "pos": masses.data("pos").copy(),
+            "v": masses.data("v").copy(),
+            "i": topology.i,
+            "j": topology.j,
+            "k": topology.k,
+            "l0": topology.l0,
+            "g": sms.g}
+
+
+class VectorEngine:
+    """
+    Initialize a vectorized engine.
+    Attributes:
+    -nodes: positions of all fixtures followed by all masses, shape (..., n_nodes, 2)
+    -pos: positions of the masses (view into nodes), shape (..., n_masses, 2)
+    -v: velocities of the masses, shape (..., n_masses, 2)
+    -m: masses, shape (..., n_masses)
+    -n_fixtures: number of fixtures (masses start at this node index)
+    -i, j: node indices of the two ends of every spring
+    -k: spring constants, shape (..., n_springs)
+    -l0: rest lengths, shape (..., n_springs)
+    -g: gravitational acceleration (signed, as in SpringMassSystem)
+    -t: simulated time
+    -integrator: time integrator advancing the state (see integrators.py)
+    -contact: contact forces between the masses added to the spring forces
+     (see contact.py), None without contact
+
+    Leading dimensions of nodes and v (if any) are treated as a batch
+    of independent systems sharing the same topology.
+    """
+
+    def __init__(self, fixtures_pos, m, pos, v, i, j, k, l0, g = -9.81, integrator = "euler"):
+        fixtures_pos = np.asarray(fixtures_pos, dtype = float).reshape(-1, 2)
+        pos = np.asarray(pos, dtype = float)
+        self.n_fixtures = len(fixtures_pos)
+        self.m = np.asarray(m, dtype = float)
+        self.i = np.asarray(i, dtype = np.intp)
+        self.j = np.asarray(j, dtype = np.intp)
+        self.k = np.asarray(k, dtype = float)
+        self.l0 = np.asarray(l0, dtype = float)
+        self.g = g
+        self.t = 0.0
+
+        # Fixtures are stored in front of the masses, so that spring end points
+        # can be gathered with a single index array
+        v = np.asarray(v, dtype = float)
+        batch = np.broadcast_shapes(pos.shape[:-2], v.shape[:-2], self.m.shape[:-1],
+                                    self.k.shape[:-1], self.l0.shape[:-1])
+        self.nodes = np.empty(batch + (self.n_fixtures + self.m.shape[-1], 2))
+        self.nodes[..., :self.n_fixtures, :] = fixtures_pos
+        self.nodes[..., self.n_fixtures:, :] = pos
+        self.pos = self.nodes[..., self.n_fixtures:, :]
+        self.v = np.array(np.broadcast_to(v, self.pos.shape), dtype = float)
+
+        self.gravity = np.array([0.0, self.g])
+        self.integrator = get_integrator(integrator)
+        self.contact = None
+
+
+    @classmethod
+    def fromSystem(cls, sms, integrator = "euler"):
+        """
+        Pack the Fixture, Mass and Spring objects of a SpringMassSystem
+        """
+
+        engine = cls(**pack_system(sms), integrator = integrator)
+        engine.system = sms
+        return engine
+
+
+    def forces(self, nodes = None):
+        """
+        Calculate the total force acting on every node (fixtures included).
+        Every spring force is computed once and applied to both ends with
+        opposite signs. Contact forces (if any) are added to the masses.
+        """
+
+        if nodes is None:
+            nodes = self.nodes
+
+        # Spring vectors pointing from end i to end j
+        d = nodes[..., self.j, :] - nodes[..., self.i, :]
+        l = np.sqrt(np.einsum("...c,...c->...", d, d))
+        # Force acting on end i; end j gets the opposite force
+        f = (self.k * (l - self.l0) / l)[..., None] * d
+
+        F = np.zeros_like(nodes)
+        np.add.at(F, (Ellipsis, self.i, slice(None)), f)
+        np.add.at(F, (Ellipsis, self.j, slice(None)), -f)
+        if self.contact is not None:
+            F[..., self.n_fixtures:, :] += self.contact.forces(nodes[..., self.n_fixtures:, :])
+        return F
+
+
+    def acceleration(self, nodes = None):
+        """
+        Calculate the acceleration of every mass
+        """
+
+        F = self.forces(nodes)[..., self.n_fixtures:, :]
+        return F / self.m[..., None] + self.gravity
+
+
+    def accelerationAt(self, pos):
+        """
+        Calculate the acceleration of every mass if the masses were at pos
+        """
+
+        nodes = self.nodes.copy()
+        nodes[..., self.n_fixtures:, :] = pos
+        return self.acceleration(nodes)
+
+
+    def step(self, delta_t):
+        """
+        Advance the system by delta_t with the integrator of the engine
+        (explicit Euler by default, same scheme as SpringMassSystem.update)
+        """
+
+        self.integrator.advance(self, delta_t)
+
+
+    def sync(self):
+        """
+        Write positions, velocities and forces back into the Mass objects
+        """
+
+        F = self.forces()[..., self.n_fixtures:, :]
+        masses = self.system.store.masses
+        masses.data("pos")[:] = self.pos
+        masses.data("v")[:] = self.v
+        masses.data("f")[:] = F + self.m[:, None] * self.gravity
@@ -0,0 +1,142 @@
+import concurrent.futures
+import os
+
+import numpy as np
+
+from engine import VectorEngine, pack_system
+from integrators import get_integrator
+
+
+"""
+ Ensemble runner
+
+ Integrates many parameter variants of one spring mass system at once.
+ The variants share the topology (fixtures, masses, springs) of a
+ SpringMassSystem and differ in spring constants, rest lengths, masses
+ and initial conditions. Variants are integrated as one batched array
+ per process and the batches are distributed over a process pool.
+ Nothing is plotted.
+"""
+
+
+# Parameters that can vary between the members of an ensemble
+PARAMETERS = ("k", "l0", "m", "pos", "v")
+
+
+def _integrate_batch(base, params, timesteps, delta_t, integrator, tolerances, stride):
+    """
+    Integrate one batch of ensemble members (runs in a worker process).
+    Returns the recorded positions, shape (batch, n_records, n_masses, 2).
+    """
+
+    arrays = dict(base)
+    arrays.update(params)
+    engine = VectorEngine(**arrays, integrator = get_integrator(integrator, **tolerances))
+
+    result = np.empty((len(engine.pos), timesteps // stride + 1) + engine.pos.shape[-2:])
+    result[:, 0] = engine.pos
+    for step in range(1, timesteps + 1):
+        engine.step(delta_t)
+        if step % stride == 0:
+            result[:, step // stride] = engine.pos
+    return result
+
+
+class Ensemble:
+    """
+    Initialize an ensemble.
+    Attributes:
+    -base: packed arrays of the SpringMassSystem all members are derived from (see pack_system)
+    -params: varied parameters, one array per name in PARAMETERS,
+     shape (n_ensemble,) + shape of the base array
+    -n_ensemble: number of members
+    -time, timesteps, delta_t: time interval, as in SpringMassSystem
+    -integrator: integrator name (see integrators.py, default: the integrator of the system)
+    -tolerances: rtol and atol of the system (rk45 only, if set); every member is stepped with
+     its own step size, so results do not depend on the batches
+    -record_every: record the positions only every record_every-th time step
+     (must divide timesteps)
+
+    params is a table of parameter sets: either a dictionary of columns
+    (first axis = ensemble member) or a list of dictionaries (one per member).
+    Per-member values may be scalars or full arrays, e.g. {"k": [500, 1000]}
+    sets all spring constants of member 0 to 500 and of member 1 to 1000.
+    """
+
+    def __init__(self, sms, params, integrator = None, record_every = 1):
+        self.base = pack_system(sms)
+        self.time = sms.time
+        self.timesteps = sms.timesteps
+        self.delta_t = sms.delta_t
+        self.integrator = sms.integrator if integrator is None else integrator
+        self.tolerances = {}
+        if self.integrator == sms.integrator:
+            self.tolerances = {name: value for name, value in (("rtol", sms.rtol), ("atol", sms.atol))
+                               if value is not None}
+        if record_every < 1 or self.timesteps % record_every:
+            raise ValueError("record_every must divide the number of time steps (the final state is recorded)")
+        self.record_every = record_every
+
+        # List of rows -> dictionary of columns
+        if isinstance(params, (list, tuple)):
+            params = {name: [row[name] for row in params] for name in params[0]}
+
+        self.params = {}
+        for name, value in params.items():
+            if name not in PARAMETERS:
+                raise ValueError(f"Unknown ensemble parameter: {name}")
+            value = np.asarray(value, dtype = float)
+            base = self.base[name]
+            # Trailing dimensions of per-member values broadcast against the base array
+            value = value.reshape(value.shape + (1,) * (base.ndim + 1 - value.ndim))
+            self.params[name] = value
+
+        sizes = {len(value) for value in self.params.values()}
+        if len(sizes) != 1:
+            raise ValueError("All ensemble parameters must have the same number of members")
+        self.n_ensemble = sizes.pop()
+        for name, value in self.params.items():
+            self.params[name] = np.broadcast_to(value, (self.n_ensemble,) + self.base[name].shape)
+
+
+    def batches(self, batch_size):
+        """
+        Split the ensemble into batches of at most batch_size members
+        """
+
+        for start in range(0, self.n_ensemble, batch_size):
+            stop = min(start + batch_size, self.n_ensemble)
+            yield start, stop, {name: np.ascontiguousarray(value[start:stop])
+                                for name, value in self.params.items()}
+
+
+    def run(self, batch_size = None, workers = None):
+        """
+        Integrate all members and return their recorded positions,
+        shape (n_ensemble, timesteps // record_every + 1, n_masses, 2).
+        workers = 1 integrates in the calling process, otherwise the batches
+        are distributed over a process pool with the given number of
+        workers (default: number of CPUs).
+        """
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if batch_size is None:
+            batch_size = -(-self.n_ensemble // workers)
+
+        n_records = self.timesteps // self.record_every + 1
+        result = np.empty((self.n_ensemble, n_records, len(self.base["m"]), 2))
+        args = (self.timesteps, self.delta_t, self.integrator, self.tolerances, self.record_every)
+
+        if workers == 1:
+            for start, stop, params in self.batches(batch_size):
+                result[start:stop] = _integrate_batch(self.base, params, *args)
+            return result
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+            futures = {pool.submit(_integrate_batch, self.base, params, *args): (start, stop)
+                       for start, stop, params in self.batches(batch_size)}
+            for future in concurrent.futures.as_completed(futures):
+                start, stop = futures[future]
+                result[start:stop] = future.result()
+        return result
@@ -0,0 +1,133 @@
+import numpy as np
+import scipy.sparse.linalg as spla
+
+import energy
+from engine import VectorEngine, pack_system
+from implicit import SparseJacobian
+
+
+"""
+ Static equilibrium
+
+ Finds the rest shape of a spring mass system directly, instead of
+ integrating until it settles (which it never does without damping):
+ the positions of the masses that minimize the total potential energy
+ U = elastic energy of the springs + gravitational energy.
+
+ Newton's method on the gradient of U (minus the total force on every
+ mass) with the sparse Hessian of U (minus the stiffness matrix of the
+ springs, see implicit.py). Near buckling the Hessian is indefinite
+ (compressed springs have negative transverse stiffness): if the Newton
+ step does not point downhill, a multiple of the identity is added to the
+ Hessian until it does. A backtracking line search on U makes every
+ step decrease the energy.
+
+ Requires scipy.
+"""
+
+
+def potential(engine, pos):
+    """
+    Total potential energy (elastic and gravitational) of the masses at pos
+    """
+
+    fixtures = engine.nodes[:engine.n_fixtures]
+    return float(energy.elastic(pos, fixtures, engine.i, engine.j, engine.k, engine.l0)
+                 + energy.gravitational(pos, engine.m, engine.g))
+
+
+def tension(engine, pos):
+    """
+    Largest spring force (absolute value) with the masses at pos
+    """
+
+    nodes = np.concatenate([engine.nodes[:engine.n_fixtures], pos])
+    d = nodes[engine.j] - nodes[engine.i]
+    l = np.sqrt(np.einsum("ec,ec->e", d, d))
+    return np.max(np.abs(engine.k * (l - engine.l0)), initial = 0.0)
+
+
+def solve(sms, pos = None, tol = 1e-9, max_iter = 100):
+    """
+    Static equilibrium of a SpringMassSystem, starting from pos (default: the
+    current positions of the masses). tol is the largest remaining force relative
+    to the largest spring force or weight (the forces that have to cancel).
+    Returns a dictionary: equilibrium positions ("pos"), remaining forces ("force"),
+    potential energy ("energy"), largest remaining force ("residual"), Newton
+    iterations ("iterations") and iterations that needed a shifted Hessian ("shifted").
+    """
+
+    arrays = pack_system(sms)
+    if pos is not None:
+        arrays["pos"] = pos
+    engine = VectorEngine(**arrays)
+    jacobian = SparseJacobian(engine)
+    nf = engine.n_fixtures
+
+    def gradient(x):
+        return -engine.accelerationAt(x) * engine.m[:, None]
+
+    x = engine.pos.copy()
+    G = gradient(x)
+    U = potential(engine, x)
+    weight = np.max(engine.m, initial = 0.0) * abs(engine.g)
+    shift = 0.0
+    iterations = shifted = 0
+
+    while np.max(np.abs(G), initial = 0.0) > tol * max(weight, tension(engine, x), 1e-300):
+        if iterations == max_iter:
+            raise RuntimeError(f"No static equilibrium found after {max_iter} Newton iterations "
+                               f"(remaining force {np.max(np.abs(G)):.3g})")
+        iterations += 1
+
+        # Hessian of U: minus the stiffness matrix of the springs at x
+        nodes = engine.nodes.copy()
+        nodes[nf:] = x
+        data = -jacobian.data(engine, nodes, definite = False)
+        diagonal = data[jacobian.diagonal].copy()
+        size = max(np.max(np.abs(diagonal), initial = 0.0), 1e-300)
+
+        # Newton step, with the Hessian shifted until the step points downhill
+        g = G.ravel()
+        shift = shift / 10 if shift > 1e-12 * size else 0.0
+        if shift == 0 and np.min(diagonal) <= 1e-12 * size:
+            # Masses without stiffness in some direction (e.g. slack springs at rest length):
+            # the Hessian is singular, and SuperLU is slow to find out
+            shift = 1e-8 * size
+        while True:
+            data[jacobian.diagonal] = diagonal + shift
+            try:
+                # Symmetric matrix: symmetric fill-reducing ordering, pivots from the diagonal
+                lu = spla.splu(jacobian.matrix(data).tocsc(), permc_spec = "MMD_AT_PLUS_A", diag_pivot_thresh = 0.0)
+                dx = -lu.solve(g)
+                if np.all(np.isfinite(dx)) and dx @ g < 0:
+                    break
+            except RuntimeError:
+                # Singular matrix
+                pass
+            shift = max(10 * shift, 1e-8 * size)
+            if shift > 1e12 * size:
+                raise RuntimeError("No descent direction found (is every mass held by a spring?)")
+        shifted += shift > 0
+
+        # Backtracking line search on the potential energy (Armijo condition). Close to
+        # the minimum, changes of U are lost in rounding: full steps that reduce the force are taken
+        dx = dx.reshape(x.shape)
+        alpha = 1.0
+        while True:
+            x_new = x + alpha * dx
+            U_new = potential(engine, x_new)
+            G_new = gradient(x_new)
+            if U_new <= U + 1e-4 * alpha * (dx.ravel() @ g) or alpha < 1e-10 or \
+                    (alpha == 1.0 and U_new <= U + 1e-12 * abs(U) and np.max(np.abs(G_new)) < 0.5 * np.max(np.abs(G))):
+                break
+            alpha /= 2
+
+        x, U, G = x_new, U_new, G_new
+
+    return {"pos": x,
+            "force": -G,
+            "energy": U,
+            "residual": float(np.max(np.abs(G), initial = 0.0)),
+            "iterations": iterations,
+            "shifted": shifted}
@@ -0,0 +1,339 @@
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+from integrators import INTEGRATORS, Integrator
+
+
+"""
+ Implicit integrators for stiff networks
+
+ Backward Euler and the trapezoidal rule solve a nonlinear system for the
+ new positions every step with Newton's method. The Newton matrix
+ M - c * K (M: mass matrix, K: Jacobian of the spring forces with respect
+ to the positions of the masses) is sparse with one 2x2 block per spring
+ end point pair. Its sparsity pattern, the fill-reducing ordering of the
+ LU factorization and the LU factors themselves are reused for as long
+ as possible:
+ -pattern and ordering: until the topology (spring end points) changes
+ -LU factors: across Newton iterations and steps, until Newton converges
+  too slowly or the step size changes
+
+ Requires scipy.
+"""
+
+
+class SparseJacobian:
+    """
+    Initialize the sparsity pattern of the stiffness matrix K = dF/dx of
+    the spring forces with respect to the mass coordinates
+    (DOF 2 * n + c is coordinate c of mass n).
+    Attributes:
+    -n_dofs: number of degrees of freedom (2 * n_masses)
+    -i, j: spring end points the pattern was built for
+    -indices, indptr: CSR structure of K (diagonal always included)
+    -diagonal: positions of the diagonal entries in the CSR data array
+    """
+
+    def __init__(self, engine):
+        nf = engine.n_fixtures
+        self.i, self.j = engine.i, engine.j
+        self.n_dofs = 2 * engine.m.shape[-1]
+        a, b = self.i - nf, self.j - nf # Mass indices of the end points (negative: fixture)
+
+        # Every spring contributes the blocks (a, a) and (b, b) with sign -1 and
+        # (a, b) and (b, a) with sign +1; blocks touching a fixture are dropped
+        rows, cols, signs, edges = [], [], [], []
+        for r, c, sign in ((a, a, -1.0), (a, b, 1.0), (b, a, 1.0), (b, b, -1.0)):
+            e = np.flatnonzero((r >= 0) & (c >= 0))
+            rows.append(r[e])
+            cols.append(c[e])
+            signs.append(np.full(len(e), sign))
+            edges.append(e)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        signs, edges = np.concatenate(signs), np.concatenate(edges)
+
+        # Expand the blocks to their 4 entries (p, q)
+        p = np.tile(np.repeat([0, 1], 2), len(rows))
+        q = np.tile([0, 1, 0, 1], len(rows))
+        self.rows = np.repeat(2 * rows, 4) + p
+        self.cols = np.repeat(2 * cols, 4) + q
+        self.p, self.q = p, q
+        self.signs = np.repeat(signs, 4)
+        self.edges = np.repeat(edges, 4)
+
+        # Unique (row, col) keys in row major order define the CSR structure;
+        # the diagonal is added so that M - c * K has the same pattern as K
+        diag = np.arange(self.n_dofs)
+        keys = np.concatenate([self.rows * self.n_dofs + self.cols, diag * self.n_dofs + diag])
+        unique, inverse = np.unique(keys, return_inverse = True)
+        self.inverse = inverse[:len(self.rows)]
+        self.diagonal = inverse[len(self.rows):]
+        self.nnz = len(unique)
+        self.indices = unique % self.n_dofs
+        self.indptr = np.searchsorted(unique // self.n_dofs, np.arange(self.n_dofs + 1))
+
+
+    def matches(self, engine):
+        """
+        Check whether the pattern is still valid for the topology of engine
+        """
+
+        return self.i is engine.i and self.j is engine.j
+
+
+    def data(self, engine, nodes, definite = True):
+        """
+        CSR data array of K for the node positions nodes
+        (definite: without the negative stiffness of compressed springs)
+        """
+
+        d = nodes[self.j] - nodes[self.i]
+        l = np.sqrt(np.einsum("ec,ec->e", d, d))
+        u = d / l[:, None]
+        uu = u[:, :, None] * u[:, None, :]
+        # Derivative of the force on end i with respect to the position of end j.
+        # Compressed springs make K indefinite; dropping their negative transverse
+        # stiffness keeps the Newton matrix positive definite
+        s = 1.0 - engine.l0 / l
+        if definite:
+            s = np.maximum(s, 0.0)
+        Ke = engine.k[:, None, None] * (uu + s[:, None, None] * (np.eye(2) - uu))
+
+        values = self.signs * Ke[self.edges, self.p, self.q]
+        return np.bincount(self.inverse, values, minlength = self.nnz)
+
+
+    def matrix(self, data):
+        """
+        Sparse CSR matrix with the pattern of K
+        """
+
+        return sp.csr_matrix((data, self.indices, self.indptr), shape = (self.n_dofs, self.n_dofs))
+
+
+class ImplicitIntegrator(Integrator):
+    """
+    Initialize an implicit integrator. Attributes in addition to Integrator:
+    -tol: Newton tolerance on the position update (relative to the size of the positions)
+    -max_iter: maximum number of Newton iterations per step
+    -refactor_after: refactorize the Newton matrix if Newton needs more iterations than this
+     (Newton iterations use a backtracking line search on the residual)
+    -n_newton: total number of Newton iterations
+    -n_factorizations: number of LU factorizations
+    """
+
+    # Weight c of the implicit acceleration in x_new = x + h * v + c * h^2 * (...)
+    c = None
+
+    def __init__(self, tol = 1e-10, max_iter = 20, refactor_after = 4):
+        super().__init__()
+        self.tol = tol
+        self.max_iter = max_iter
+        self.refactor_after = refactor_after
+        self.n_newton = 0
+        self.n_factorizations = 0
+        self.jacobian = None
+        self.order = None
+        self.lu = None
+        self.lu_h = None
+        self.lu_x = None
+        self.permuted = False
+        self.a = None
+
+
+    def reset(self):
+        self.lu = None
+        self.a = None
+
+
+    def stats(self):
+        stats = super().stats()
+        stats["newton_iterations"] = self.n_newton
+        stats["factorizations"] = self.n_factorizations
+        return stats
+
+
+    def state(self):
+        state = super().state()
+        state["n_newton"] = self.n_newton
+        state["n_factorizations"] = self.n_factorizations
+        if self.a is not None:
+            state["a"] = self.a
+        if self.order is not None:
+            state["order"] = self.order
+            state["inverse_order"] = self.inverse_order
+        if self.lu is not None:
+            # The LU factors cannot be saved; they are recomputed from the positions
+            # they were computed at, so that the following Newton iterations are identical
+            state["lu_x"] = self.lu_x
+            state["lu_h"] = self.lu_h
+            state["permuted"] = self.permuted
+        return state
+
+
+    def restore(self, engine, state):
+        super().restore(engine, state)
+        self.a = np.array(state["a"]) if "a" in state else None
+        self.jacobian = SparseJacobian(engine)
+        self.order = self.lu = None
+        if "lu_x" in state:
+            if state["permuted"]:
+                self.order, self.inverse_order = np.array(state["order"]), np.array(state["inverse_order"])
+            self.factorize(engine, np.array(state["lu_x"]), float(state["lu_h"]))
+        if "order" in state:
+            self.order, self.inverse_order = np.array(state["order"]), np.array(state["inverse_order"])
+        self.n_newton = int(state["n_newton"])
+        self.n_factorizations = int(state["n_factorizations"])
+
+
+    def factorize(self, engine, x, h):
+        """
+        Assemble M - c * h^2 * K at positions x and compute its LU factors.
+        The fill-reducing column ordering is computed once per topology.
+        """
+
+        if self.jacobian is None or not self.jacobian.matches(engine):
+            self.jacobian = SparseJacobian(engine)
+            self.order = None
+
+        nodes = engine.nodes.copy()
+        nodes[engine.n_fixtures:] = x
+        data = -self.c * h * h * self.jacobian.data(engine, nodes)
+        data[self.jacobian.diagonal] += np.repeat(engine.m, 2)
+        A = self.jacobian.matrix(data).tocsc()
+
+        if self.order is None:
+            # First factorization: let SuperLU choose the ordering and keep it.
+            # The matrix is symmetric, so the ordering is applied to rows and columns
+            # alike and pivots are taken from the diagonal
+            self.lu = spla.splu(A, permc_spec = "MMD_AT_PLUS_A", diag_pivot_thresh = 0.0)
+            # L U = Pr A Pc with Pc[n, perm_c[n]] = 1, i.e. column n of A Pc is column argsort(perm_c)[n] of A
+            self.order = np.argsort(self.lu.perm_c)
+            self.inverse_order = self.lu.perm_c
+            self.permuted = False
+        else:
+            self.lu = spla.splu(A[self.order][:, self.order], permc_spec = "NATURAL", diag_pivot_thresh = 0.0)
+            self.permuted = True
+        self.lu_h = h
+        self.lu_x = x.copy()
+        self.n_factorizations += 1
+
+
+    def solve(self, r):
+        """
+        Solve (M - c * h^2 * K) dx = r with the cached LU factors
+        """
+
+        if self.permuted:
+            return self.lu.solve(r[self.order])[self.inverse_order]
+        return self.lu.solve(r)
+
+
+    def explicitPart(self, engine, h):
+        """
+        Part of x_new that does not depend on the new acceleration
+        """
+
+        raise NotImplementedError
+
+
+    def newVelocity(self, engine, x_new, a_new, h):
+        """
+        Velocity at the end of the step
+        """
+
+        raise NotImplementedError
+
+
+    def advance(self, engine, delta_t):
+        if engine.pos.ndim != 2:
+            raise ValueError("Implicit integrators do not support batched engines")
+        if self.lu is not None and (self.lu_h != delta_t or not self.jacobian.matches(engine)):
+            self.lu = None
+
+        h = delta_t
+        x0 = self.explicitPart(engine, h)
+        m = np.repeat(engine.m, 2)
+        scale = self.tol * max(1.0, np.max(np.abs(x0)))
+
+        # Residual of x - x0 - c * h^2 * a(x) = 0, predictor: acceleration of the last step
+        x = x0 + self.c * h * h * (self.a if self.a is not None else 0.0)
+        a = self.acceleration(engine, x)
+        G = (x - x0 - self.c * h * h * a).ravel()
+        residual = np.max(np.abs(G))
+
+        for it in range(self.max_iter):
+            if residual <= scale:
+                break
+            fresh = self.lu is None or (it > 0 and it % self.refactor_after == 0)
+            if fresh:
+                self.factorize(engine, x, h)
+            dx = self.solve(m * G).reshape(x.shape)
+
+            # Backtracking line search on the residual
+            alpha = 1.0
+            while True:
+                x_new = x - alpha * dx
+                a_new = self.acceleration(engine, x_new)
+                G_new = (x_new - x0 - self.c * h * h * a_new).ravel()
+                residual_new = np.max(np.abs(G_new))
+                if residual_new < residual or alpha < 1 / 16:
+                    break
+                alpha /= 2
+            # A stale factorization that needs damping is refreshed in the next iteration
+            if alpha < 1 and not fresh:
+                self.lu = None
+
+            x, a, G, residual = x_new, a_new, G_new, residual_new
+            self.n_newton += 1
+
+        if residual > scale:
+            raise RuntimeError(f"Newton iteration did not converge at t = {engine.t}")
+
+        engine.v[...] = self.newVelocity(engine, x, a, h)
+        engine.pos[...] = x
+        engine.t += h
+        self.a = a
+        self.n_steps += 1
+
+
+class BackwardEuler(ImplicitIntegrator):
+    """
+    Backward (implicit) Euler: x_new = x + h * v_new, v_new = v + h * a(x_new).
+    Unconditionally stable, but damps oscillations numerically.
+    """
+
+    name = "backward_euler"
+    c = 1.0
+
+    def explicitPart(self, engine, h):
+        return engine.pos + h * engine.v
+
+
+    def newVelocity(self, engine, x_new, a_new, h):
+        return engine.v + h * a_new
+
+
+class Trapezoidal(ImplicitIntegrator):
+    """
+    Trapezoidal rule (average acceleration): x_new = x + h * v + h^2 / 4 * (a + a_new),
+    v_new = v + h / 2 * (a + a_new). Unconditionally stable and energy conserving
+    for linear springs.
+    """
+
+    name = "trapezoidal"
+    c = 0.25
+
+    def explicitPart(self, engine, h):
+        if self.a is None:
+            self.a = self.acceleration(engine)
+        return engine.pos + h * engine.v + self.c * h * h * self.a
+
+
+    def newVelocity(self, engine, x_new, a_new, h):
+        return engine.v + 0.5 * h * (self.a + a_new)
+
+
+INTEGRATORS[BackwardEuler.name] = BackwardEuler
+INTEGRATORS[Trapezoidal.name] = Trapezoidal
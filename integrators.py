@@ -0,0 +1,382 @@
+import numpy as np
+
+
+"""
+ Time integrators
+
+ Integrators operate on the packed state of a VectorEngine (engine.py).
+ Every integrator advances the engine by exactly delta_t per call of
+ advance(), so the recorded trajectory stays on the regular time grid of
+ SpringMassSystem. The adaptive integrator (rk45) chooses its internal
+ steps independently of delta_t and interpolates at the grid times.
+"""
+
+
+class Integrator:
+    """
+    Initialize an integrator.
+    Attributes:
+    -n_steps: number of accepted (internal) steps
+    -n_rejected: number of rejected steps (adaptive integrators only)
+    -n_force_evals: number of force evaluations
+
+    stability is the largest omega * delta_t for which undamped oscillations of
+    angular frequency omega stay bounded (see modal.py), None if delta_t does not limit it.
+    """
+
+    name = None
+    stability = None
+
+    def __init__(self):
+        self.n_steps = 0
+        self.n_rejected = 0
+        self.n_force_evals = 0
+
+
+    def acceleration(self, engine, pos = None):
+        """
+        Evaluate the accelerations of the masses (at pos, default: current positions)
+        """
+
+        self.n_force_evals += 1
+        if pos is None:
+            return engine.acceleration()
+        return engine.accelerationAt(pos)
+
+
+    def advance(self, engine, delta_t):
+        """
+        Advance engine.pos, engine.v and engine.t by delta_t
+        """
+
+        raise NotImplementedError
+
+
+    def reset(self):
+        """
+        Discard cached values (call after modifying the engine state from outside)
+        """
+
+        pass
+
+
+    def stats(self):
+        """
+        Step and force evaluation counters as a dictionary
+        """
+
+        return {"integrator": self.name,
+                "steps": self.n_steps,
+                "rejected": self.n_rejected,
+                "force_evals": self.n_force_evals}
+
+
+    def state(self):
+        """
+        Counters and cached values as a dictionary of numbers and arrays
+        (None values are left out), restored with restore() (see checkpoint.py)
+        """
+
+        return {"n_steps": self.n_steps,
+                "n_rejected": self.n_rejected,
+                "n_force_evals": self.n_force_evals}
+
+
+    def restore(self, engine, state):
+        """
+        Restore the counters and cached values saved with state()
+        (engine: engine the integrator advances, already in the saved state)
+        """
+
+        self.n_steps = int(state["n_steps"])
+        self.n_rejected = int(state["n_rejected"])
+        self.n_force_evals = int(state["n_force_evals"])
+
+
+class Euler(Integrator):
+    """
+    Explicit Euler: positions are advanced with the old velocities
+    (scheme of SpringMassSystem.update)
+    """
+
+    name = "euler"
+    stability = 0.0 # Every undamped oscillation grows
+
+    def advance(self, engine, delta_t):
+        a = self.acceleration(engine)
+        engine.pos += engine.v * delta_t
+        engine.v += a * delta_t
+        engine.t += delta_t
+        self.n_steps += 1
+
+
+class SymplecticEuler(Integrator):
+    """
+    Semi-implicit (symplectic) Euler: velocities first, then positions
+    with the new velocities
+    """
+
+    name = "symplectic_euler"
+    stability = 2.0
+
+    def advance(self, engine, delta_t):
+        engine.v += self.acceleration(engine) * delta_t
+        engine.pos += engine.v * delta_t
+        engine.t += delta_t
+        self.n_steps += 1
+
+
+class VelocityVerlet(Integrator):
+    """
+    Velocity Verlet. The acceleration at the end of a step is reused at
+    the beginning of the next one, so a step costs one force evaluation.
+    """
+
+    name = "verlet"
+    stability = 2.0
+
+    def __init__(self):
+        super().__init__()
+        self.a = None
+
+
+    def reset(self):
+        self.a = None
+
+
+    def state(self):
+        state = super().state()
+        if self.a is not None:
+            state["a"] = self.a
+        return state
+
+
+    def restore(self, engine, state):
+        super().restore(engine, state)
+        self.a = np.array(state["a"]) if "a" in state else None
+
+
+    def advance(self, engine, delta_t):
+        if self.a is None:
+            self.a = self.acceleration(engine)
+        engine.v += 0.5 * delta_t * self.a
+        engine.pos += engine.v * delta_t
+        self.a = self.acceleration(engine)
+        engine.v += 0.5 * delta_t * self.a
+        engine.t += delta_t
+        self.n_steps += 1
+
+
+class RK4(Integrator):
+    """
+    Classical fourth order Runge-Kutta method
+    """
+
+    name = "rk4"
+    stability = 2.0 * np.sqrt(2.0)
+
+    def advance(self, engine, delta_t):
+        x, v = engine.pos.copy(), engine.v.copy()
+        h = delta_t
+
+        k1x, k1v = v, self.acceleration(engine, x)
+        k2x, k2v = v + 0.5 * h * k1v, self.acceleration(engine, x + 0.5 * h * k1x)
+        k3x, k3v = v + 0.5 * h * k2v, self.acceleration(engine, x + 0.5 * h * k2x)
+        k4x, k4v = v + h * k3v, self.acceleration(engine, x + h * k3x)
+
+        engine.pos[...] = x + h / 6 * (k1x + 2 * k2x + 2 * k3x + k4x)
+        engine.v[...] = v + h / 6 * (k1v + 2 * k2v + 2 * k3v + k4v)
+        engine.t += delta_t
+        self.n_steps += 1
+
+
+class RK45(Integrator):
+    """
+    Embedded Runge-Kutta 5(4) pair of Dormand and Prince with error
+    controlled step size and dense output: the internal steps do not depend
+    on delta_t, the integrator steps ahead of the engine and interpolates the
+    state at the end of every call of advance() (continuous extension of
+    fourth order). Attributes in addition to Integrator:
+    -rtol, atol: relative and absolute tolerance of the local error
+    -h: size of the next internal step (kept between calls of advance())
+    -t, x, v: time, positions and velocities at the end of the last accepted
+     internal step (at or ahead of the engine, None before the first step)
+    -x0, v0, h0: positions and velocities at the start and size of the last
+     accepted internal step
+    -kx, kv: stages of the last accepted internal step, shape (7,) + shape of
+     the state; the last stage is the first stage of the next step (FSAL)
+
+    The members of a batched engine (see ensemble.py) are stepped independently:
+    h, t and h0 have the batch shape, and every member takes the steps it would
+    take on its own.
+    """
+
+    name = "rk45"
+
+    # Butcher tableau (the system is autonomous, so the nodes c_i are not needed)
+    A = [[],
+         [1 / 5],
+         [3 / 40, 9 / 40],
+         [44 / 45, -56 / 15, 32 / 9],
+         [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+         [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+         [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84]]
+    # Fifth order weights (last row of A) minus fourth order weights
+    E = np.array([71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40])
+    # Dense output: weight of stage i at s = (t - t0) / h0 is P[i] . (s, s^2, s^3, s^4)
+    P = np.array([[1, -8048581381 / 2820520608, 8663915743 / 2820520608, -12715105075 / 11282082432],
+                  [0, 0, 0, 0],
+                  [0, 131558114200 / 32700410799, -68118460800 / 10900136933, 87487479700 / 32700410799],
+                  [0, -1754552775 / 470086768, 14199869525 / 1410260304, -10690763975 / 1880347072],
+                  [0, 127303824393 / 49829197408, -318862633887 / 49829197408, 701980252875 / 199316789632],
+                  [0, -282668133 / 205662961, 2019193451 / 616988883, -1453857185 / 822651844],
+                  [0, 40617522 / 29380423, -110615467 / 29380423, 69997945 / 29380423]])
+
+    def __init__(self, rtol = 1e-6, atol = 1e-9):
+        super().__init__()
+        if rtol <= 0 or atol < 0:
+            raise ValueError("Tolerances must be positive")
+        self.rtol = rtol
+        self.atol = atol
+        self.h = None
+        self.reset()
+
+
+    def reset(self):
+        self.t = self.x = self.v = None
+        self.x0 = self.v0 = self.h0 = None
+        self.kx = self.kv = None
+
+
+    def state(self):
+        state = super().state()
+        if self.h is not None:
+            state["h"] = self.h
+        if self.x is not None:
+            state.update({"t": self.t, "x": self.x, "v": self.v, "x0": self.x0, "v0": self.v0, "h0": self.h0,
+                          "stages_x": self.kx, "stages_v": self.kv})
+        return state
+
+
+    def restore(self, engine, state):
+        super().restore(engine, state)
+        self.reset()
+        self.h = np.array(state["h"], dtype = float) if "h" in state else None
+        if "stages_x" in state:
+            self.t, self.h0 = np.array(state["t"], dtype = float), np.array(state["h0"], dtype = float)
+            self.x, self.v = np.array(state["x"]), np.array(state["v"])
+            self.x0, self.v0 = np.array(state["x0"]), np.array(state["v0"])
+            self.kx, self.kv = np.array(state["stages_x"]), np.array(state["stages_v"])
+
+
+    def start(self, engine):
+        """
+        Start stepping from the state of the engine
+        """
+
+        batch = engine.pos.shape[:-2]
+        self.t = np.full(batch, engine.t)
+        self.x, self.v = engine.pos.copy(), engine.v.copy()
+        self.x0, self.v0, self.h0 = self.x, self.v, np.ones(batch)
+        # Only the last stage (the first stage of the next step) is used
+        self.kx, self.kv = np.zeros((7,) + self.x.shape), np.zeros((7,) + self.x.shape)
+        self.kx[6], self.kv[6] = self.v, self.acceleration(engine, self.x)
+
+
+    def step(self, engine, active):
+        """
+        Try one internal step of size h from (t, x, v) for the active members of a
+        batch (every member has its own step size and error control)
+        """
+
+        h = np.where(active, self.h, 0.0)
+        hb = h[..., None, None]
+        x, v = self.x, self.v
+
+        # First stage is the last stage of the previous accepted step (FSAL)
+        kx, kv = [self.kx[6]], [self.kv[6]]
+        for s in range(1, 7):
+            dx = hb * sum(a * k for a, k in zip(self.A[s], kx))
+            dv = hb * sum(a * k for a, k in zip(self.A[s], kv))
+            kx.append(v + dv)
+            kv.append(self.acceleration(engine, x + dx))
+
+        # The last stage is evaluated at the fifth order solution
+        x_new, v_new = x + dx, kx[6]
+        x_err = hb * sum(e * k for e, k in zip(self.E, kx))
+        v_err = hb * sum(e * k for e, k in zip(self.E, kv))
+
+        scale_x = self.atol + self.rtol * np.maximum(np.abs(x), np.abs(x_new))
+        scale_v = self.atol + self.rtol * np.maximum(np.abs(v), np.abs(v_new))
+        err = np.sqrt(0.5 * (np.mean((x_err / scale_x) ** 2, axis = (-2, -1)) +
+                             np.mean((v_err / scale_v) ** 2, axis = (-2, -1))))
+
+        ok = err <= 1
+        accepted = ok & active
+        at = accepted[..., None, None]
+        self.x0, self.v0 = np.where(at, x, self.x0), np.where(at, v, self.v0)
+        self.h0 = np.where(accepted, h, self.h0)
+        self.kx, self.kv = np.where(at, np.array(kx), self.kx), np.where(at, np.array(kv), self.kv)
+        self.x, self.v = np.where(at, x_new, x), np.where(at, v_new, v)
+        self.t = np.where(accepted, self.t + h, self.t)
+        self.n_steps += int(np.count_nonzero(accepted))
+        self.n_rejected += int(np.count_nonzero(active & ~ok))
+
+        # Step size control
+        with np.errstate(divide = "ignore"):
+            factor = np.where(err == 0, 5.0, np.clip(0.9 * err ** -0.2, 0.2, 5.0))
+        factor = np.where(ok, factor, np.minimum(factor, 1.0))
+        self.h = np.where(active, h * factor, self.h)
+
+
+    def interpolate(self, t):
+        """
+        Positions and velocities at time t within the last accepted internal step
+        """
+
+        s = (t - (self.t - self.h0)) / self.h0
+        w = self.h0[..., None] * (s[..., None] ** np.arange(1, 5) @ self.P.T)
+        x = self.x0 + sum(w[..., i, None, None] * self.kx[i] for i in range(7))
+        v = self.v0 + sum(w[..., i, None, None] * self.kv[i] for i in range(7))
+        return x, v
+
+
+    def advance(self, engine, delta_t):
+        t_end = engine.t + delta_t
+        if self.h is None:
+            self.h = np.full(engine.pos.shape[:-2], delta_t)
+        if self.x is None:
+            self.start(engine)
+
+        while True:
+            active = t_end - self.t > 1e-12 * delta_t
+            if not active.any():
+                break
+            self.step(engine, active)
+
+        x, v = self.interpolate(t_end)
+        end = (np.abs(self.t - t_end) <= 1e-12 * delta_t)[..., None, None]
+        engine.pos[...] = np.where(end, self.x, x)
+        engine.v[...] = np.where(end, self.v, v)
+        engine.t = t_end
+
+
+INTEGRATORS = {c.name: c for c in (Euler, SymplecticEuler, VelocityVerlet, RK4, RK45)}
+# implicit.py adds "backward_euler" and "trapezoidal", multirate.py adds "multirate"
+
+
+def get_integrator(name, **options):
+    """
+    Create an integrator by name (see INTEGRATORS)
+    """
+
+    if isinstance(name, Integrator):
+        return name
+    if name in ("backward_euler", "trapezoidal"):
+        # The implicit integrators need scipy, so they are only imported on demand
+        import implicit
+    if name == "multirate":
+        import multirate
+    if name not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator: {name}")
+    return INTEGRATORS[name](**options)
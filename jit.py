@@ -0,0 +1,212 @@
+import time
+
+import numpy as np
+
+from engine import VectorEngine
+from trajectory import TrajectoryBuffer
+
+
+"""
+ JIT compiled engine
+
+ Fuses the force computation and the time integration of many time steps
+ (by default the whole run) into one loop over the packed state arrays,
+ compiled with numba if it is installed. Without numba, JitEngine behaves
+ like the NumPy engine (VectorEngine).
+
+ Supported integrators: euler, symplectic_euler, verlet. Other
+ integrators, batched (ensemble) states and systems with contact
+ forces use the NumPy engine.
+"""
+
+
+try:
+    import numba
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+
+# Integrators implemented by the kernel
+SCHEMES = {"euler": 0, "symplectic_euler": 1, "verlet": 2}
+
+
+def _accelerations(nodes, m, i, j, k, l0, g, nf, a):
+    """
+    Accelerations of the masses (fixtures are the first nf nodes)
+    """
+
+    a[:] = 0.0
+    for e in range(len(i)):
+        dx = nodes[j[e], 0] - nodes[i[e], 0]
+        dy = nodes[j[e], 1] - nodes[i[e], 1]
+        l = np.sqrt(dx * dx + dy * dy)
+        c = k[e] * (l - l0[e]) / l
+        if i[e] >= nf:
+            a[i[e] - nf, 0] += c * dx
+            a[i[e] - nf, 1] += c * dy
+        if j[e] >= nf:
+            a[j[e] - nf, 0] -= c * dx
+            a[j[e] - nf, 1] -= c * dy
+    for n in range(len(m)):
+        a[n, 0] = a[n, 0] / m[n]
+        a[n, 1] = a[n, 1] / m[n] + g
+
+
+def _integrate(nodes, v, a, have_a, m, i, j, k, l0, g, nf, dt, n_steps, scheme,
+               step0, stride, positions, velocities):
+    """
+    Advance nodes (masses from index nf) and v by n_steps time steps and record
+    every step that is a multiple of stride into positions and velocities.
+    a holds the accelerations of the current state if have_a (velocity Verlet).
+    """
+
+    n_masses = len(m)
+    if scheme == 2 and not have_a:
+        _accelerations(nodes, m, i, j, k, l0, g, nf, a)
+
+    for s in range(n_steps):
+        if scheme == 0:
+            _accelerations(nodes, m, i, j, k, l0, g, nf, a)
+            for n in range(n_masses):
+                for c in range(2):
+                    nodes[nf + n, c] += v[n, c] * dt
+                    v[n, c] += a[n, c] * dt
+        elif scheme == 1:
+            _accelerations(nodes, m, i, j, k, l0, g, nf, a)
+            for n in range(n_masses):
+                for c in range(2):
+                    v[n, c] += a[n, c] * dt
+                    nodes[nf + n, c] += v[n, c] * dt
+        else:
+            for n in range(n_masses):
+                for c in range(2):
+                    v[n, c] += 0.5 * dt * a[n, c]
+                    nodes[nf + n, c] += v[n, c] * dt
+            _accelerations(nodes, m, i, j, k, l0, g, nf, a)
+            for n in range(n_masses):
+                for c in range(2):
+                    v[n, c] += 0.5 * dt * a[n, c]
+
+        step = step0 + s + 1
+        if step % stride == 0 and step // stride < positions.shape[0]:
+            positions[step // stride] = nodes[nf:]
+            velocities[step // stride] = v
+
+
+if HAVE_NUMBA:
+    _accelerations = numba.njit(cache = True)(_accelerations)
+    _integrate = numba.njit(cache = True)(_integrate)
+
+
+class JitEngine(VectorEngine):
+    """
+    Initialize a JIT compiled engine. Same attributes as VectorEngine.
+    advance() runs many time steps in one compiled call.
+    """
+
+    def compiled(self):
+        """
+        Check whether advance() can use the compiled kernel (not with contact forces)
+        """
+
+        return HAVE_NUMBA and self.integrator.name in SCHEMES and self.pos.ndim == 2 and self.contact is None
+
+
+    def advance(self, delta_t, n_steps, recorder = None, step0 = 0):
+        """
+        Advance the system by n_steps time steps of delta_t. The steps step0 + 1
+        to step0 + n_steps that fall on the recording stride are written into recorder.
+        """
+
+        if not self.compiled():
+            for s in range(step0 + 1, step0 + n_steps + 1):
+                self.step(delta_t)
+                if recorder is not None:
+                    recorder.record(s, self.pos, self.v)
+            return
+
+        if recorder is not None and not isinstance(recorder, TrajectoryBuffer):
+            # Recorders without preallocated arrays (see compression.py): compiled calls up
+            # to every recorded step
+            s = step0
+            while s < step0 + n_steps:
+                n = min(step0 + n_steps, (s // recorder.stride + 1) * recorder.stride) - s
+                self.advance(delta_t, n, None, s)
+                s += n
+                recorder.record(s, self.pos, self.v)
+            return
+
+        integrator = self.integrator
+        have_a = getattr(integrator, "a", None) is not None
+        a = integrator.a if have_a else np.empty_like(self.v)
+        if recorder is None:
+            stride, first, positions, velocities = 1, 0, np.empty((0, 0, 2)), np.empty((0, 0, 2))
+        else:
+            # Recorders holding only the latest records start at record recorder.first
+            stride, first = recorder.stride, recorder.first
+            positions, velocities = np.asarray(recorder.positions), np.asarray(recorder.velocities)
+
+        _integrate(self.nodes, self.v, a, have_a, np.ascontiguousarray(self.m, dtype = float),
+                   self.i, self.j, np.ascontiguousarray(self.k, dtype = float),
+                   np.ascontiguousarray(self.l0, dtype = float), float(self.g), self.n_fixtures,
+                   float(delta_t), n_steps, SCHEMES[integrator.name], step0 - first * stride, stride,
+                   positions, velocities)
+
+        # Keep the integrator state and counters consistent with the NumPy engine
+        if integrator.name == "verlet":
+            integrator.a = a
+            integrator.n_force_evals += not have_a
+        integrator.n_steps += n_steps
+        integrator.n_force_evals += n_steps
+        self.t += n_steps * delta_t
+        if recorder is not None:
+            recorder.count = max(recorder.count, first + min((step0 + n_steps) // stride + 1 - first, len(recorder.positions)))
+
+
+def benchmark(scenarios = ("pendulum", "double_pendulum", "triple_pendulum"), python_steps = 2000,
+              integrator = "euler"):
+    """
+    Compare the steps per second of the pure Python engine, the NumPy engine and
+    the JIT engine on the named test setups (see scenarios.py). The Python engine
+    only runs python_steps steps; the other engines run the full setup.
+    Returns a dictionary of results per setup.
+    """
+
+    from scenarios import SCENARIOS
+
+    results = {}
+    for name in scenarios:
+        results[name] = {}
+        for engine in ("python", "numpy", "jit"):
+            sms = SCENARIOS[name](engine = engine, integrator = integrator)
+            if engine == "python":
+                # Same time step, fewer steps
+                sms = SCENARIOS[name](time = sms.delta_t * python_steps, timesteps = python_steps,
+                                      engine = engine, integrator = integrator)
+            sms.start()
+            # Compile outside of the timed region
+            if engine == "jit" and HAVE_NUMBA:
+                sms.state.advance(sms.delta_t, 0)
+            start = time.perf_counter()
+            sms.advance(sms.timesteps)
+            elapsed = time.perf_counter() - start
+            results[name][engine] = {"steps": sms.timesteps, "seconds": elapsed,
+                                     "steps_per_second": sms.timesteps / elapsed}
+
+        python = results[name]["python"]["steps_per_second"]
+        for engine in ("numpy", "jit"):
+            results[name][engine]["speedup"] = results[name][engine]["steps_per_second"] / python
+    return results
+
+
+if __name__ == "__main__":
+    print(f"numba installed: {HAVE_NUMBA}")
+    for name, result in benchmark().items():
+        print(f"{name}:")
+        for engine, r in result.items():
+            # Two significant digits (the numpy engine is slower than python on these small setups)
+            speedup = ""
+            if "speedup" in r:
+                speedup = f", speedup {float(format(r['speedup'], '.2g')):g}x"
+            print(f"  {engine:6s} {r['steps_per_second']:12.0f} steps/s{speedup}")
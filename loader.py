@@ -0,0 +1,165 @@
+import json
+import os
+
+import numpy as np
+
+from main import SpringMassSystem
+from engine import pack_system
+
+
+"""
+ System files
+
+ Loads and saves the description of a spring mass system, so that systems
+ don't have to be typed in with user_input.py.
+
+ JSON / TOML (human-readable, small systems):
+ -fixtures: list of [x, y]
+ -masses: list of {"m", "pos": [x, y], "v": [vx, vy]} or of rows [m, x0, y0, vx0, vy0]
+ -springs: list of {"l0", "k", "conn": [name, name]} or of rows [l0, k, name, name],
+  with names "f<n>" for fixture n and "m<n>" for mass n (counting from 0)
+ -simulation (optional): keyword arguments of SpringMassSystem
+  (time, timesteps, g, engine, integrator, record_every, rtol, atol, ...)
+
+ Example (TOML):
+  fixtures = [[0.0, 10.0]]
+  masses = [[1, -10.0, 10.0, 0.0, 0.0]]
+  springs = [[10, 5000.0, "f0", "m0"]]
+
+  [simulation]
+  time = 6
+  timesteps = 20000
+
+ NPZ (large systems): the arrays of pack_system() (fixtures_pos, m, pos, v,
+ i, j, k, l0; spring ends as node indices, fixtures first, then masses)
+ and the simulation settings as 0-d arrays. NPZ files are loaded straight
+ into the arrays of the system without creating an object per element.
+"""
+
+
+# Arrays of a system in NPZ files (see pack_system)
+ARRAYS = ("fixtures_pos", "m", "pos", "v", "i", "j", "k", "l0")
+
+
+def node_index(name, n_fixtures, n_masses):
+    """
+    Node index of a fixture or mass given by name ("f<n>" or "m<n>")
+    """
+
+    try:
+        kind, n = name[0], int(name[1:])
+    except (TypeError, IndexError, ValueError):
+        raise ValueError(f"Invalid fixture/mass name: {name!r}")
+    if kind == "f" and 0 <= n < n_fixtures:
+        return n
+    if kind == "m" and 0 <= n < n_masses:
+        return n_fixtures + n
+    raise ValueError(f"Unknown fixture/mass: {name!r}")
+
+
+def from_dict(data):
+    """
+    Arrays (see pack_system) and simulation settings of a system description
+    parsed from JSON or TOML
+    """
+
+    fixtures = np.array(data.get("fixtures", []), dtype = float).reshape(-1, 2)
+
+    masses = data.get("masses", [])
+    if masses and isinstance(masses[0], dict):
+        masses = [[m["m"], *m["pos"], *m.get("v", (0.0, 0.0))] for m in masses]
+    masses = np.array(masses, dtype = float).reshape(-1, 5)
+    if np.any(masses[:, 0] <= 0):
+        raise ValueError("Masses must be positive")
+
+    springs = data.get("springs", [])
+    if springs and isinstance(springs[0], dict):
+        springs = [[s["l0"], s["k"], *s["conn"]] for s in springs]
+    ends = np.array([[node_index(name, len(fixtures), len(masses)) for name in s[2:4]] for s in springs],
+                    dtype = np.intp).reshape(-1, 2)
+
+    arrays = {"fixtures_pos": fixtures,
+              "m": masses[:, 0],
+              "pos": masses[:, 1:3],
+              "v": masses[:, 3:5],
+              "i": ends[:, 0],
+              "j": ends[:, 1],
+              "k": np.array([s[1] for s in springs], dtype = float),
+              "l0": np.array([s[0] for s in springs], dtype = float)}
+    return arrays, dict(data.get("simulation", {}))
+
+
+def to_dict(sms):
+    """
+    JSON serializable description of a system and its simulation settings
+    """
+
+    arrays = pack_system(sms)
+    nf = len(arrays["fixtures_pos"])
+    name = lambda n: f"f{n}" if n < nf else f"m{n - nf}"
+    return {"fixtures": arrays["fixtures_pos"].tolist(),
+            "masses": np.column_stack([arrays["m"], arrays["pos"], arrays["v"]]).tolist(),
+            "springs": [[l0, k, name(i), name(j)] for i, j, k, l0
+                        in zip(arrays["i"].tolist(), arrays["j"].tolist(), arrays["k"].tolist(), arrays["l0"].tolist())],
+            "simulation": settings(sms)}
+
+
+def settings(sms):
+    """
+    Keyword arguments of SpringMassSystem that reproduce the settings of sms
+    """
+
+    settings = {"time": sms.time,
+                "timesteps": sms.timesteps,
+                "g": -sms.g,
+                "engine": sms.engine,
+                "integrator": sms.integrator,
+                "record_every": sms.record_every}
+    if sms.engine == "parallel" and sms.workers is not None:
+        settings["workers"] = sms.workers
+    # Tolerances of the rk45 integrator (if set)
+    settings.update({name: value for name, value in (("rtol", sms.rtol), ("atol", sms.atol)) if value is not None})
+    return settings
+
+
+def load(path, **options):
+    """
+    Load a system from a .json, .toml or .npz file. Keyword arguments
+    override the simulation settings of the file.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npz":
+        with np.load(path) as f:
+            arrays = {name: f[name] for name in ARRAYS}
+            simulation = {name: f[name].item() for name in f.files if name not in ARRAYS}
+    elif extension in (".json", ".toml"):
+        if extension == ".json":
+            with open(path) as f:
+                data = json.load(f)
+        else:
+            import tomllib
+            with open(path, "rb") as f:
+                data = tomllib.load(f)
+        arrays, simulation = from_dict(data)
+    else:
+        raise ValueError(f"Unknown system file format: {extension}")
+
+    simulation.update(options)
+    return SpringMassSystem.fromArrays(**arrays, **simulation)
+
+
+def save(sms, path):
+    """
+    Save a system (initial state: call before running it) to a .json or .npz file
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npz":
+        arrays = pack_system(sms)
+        np.savez(path, **{name: arrays[name] for name in ARRAYS}, **settings(sms))
+    elif extension == ".json":
+        with open(path, "w") as f:
+            json.dump(to_dict(sms), f, indent = 1)
+    else:
+        raise ValueError(f"Cannot save systems as {extension} (use .json or .npz)")
@@ -1,13 +1,29 @@
+import math
+import os
+
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+
+import checkpoint
+import compression
+import contact
+import energy
+import profiling
+from engine import VectorEngine, pack_system
+from integrators import get_integrator
+from store import Handles, Store
+from topology import Topology
+from trajectory import TrajectoryBuffer, TrajectoryFile, TrajectoryWindow
 
 
 """
  Spring Mass System Simulator
 
  Simulates a system of connected springs, masses and fixtures.
- The trajectory of the masses can be plotted and saved in a text file.
+ The trajectory of the masses can be plotted and saved in a binary file.
+
+ The simulation only needs NumPy: matplotlib is imported when plotting
+ (see render.py) or animating (Animator, see animator.py), so that
+ headless runs and worker processes start quickly.
 """
 
 
@@ -17,13 +33,33 @@ class Fixture:
     Attributes:
     -pos: position
     -attached: attached objects (mass(es) and/or spring(s))
+
+    Fixtures, masses and springs are handles into the arrays of their system
+    (see store.py): attributes like pos are views into these arrays.
+    Objects that are not part of a system yet are kept in the DETACHED store.
     """
 
+    __slots__ = ("store", "index")
+
     def __init__(self, x, y):
-        self.pos = [x, y]
-        self.attached = [] # List format: [mass/fixture connected to this fixture,
-                           #               spring constant of connecting spring,
-                           #               rest length of connecting spring]
+        DETACHED.fixtures.append(self, pos = (x, y))
+
+
+    @property
+    def pos(self):
+        return self.store.fixtures.arrays["pos"][self.index]
+
+    @pos.setter
+    def pos(self, value):
+        self.store.fixtures.arrays["pos"][self.index] = value
+
+
+    @property
+    def attached(self):
+        # List format: [mass/fixture connected to this fixture,
+        #               spring constant of connecting spring,
+        #               rest length of connecting spring]
+        return self.store.attached(0, self.index)
 
 
 class Mass:
@@ -35,18 +71,64 @@ class Mass:
     -v: velocity
     -f: acting force
     -attached: attached objects (mass(es) and/or spring(s))
-    -trajectory: trajectory
+    -trajectory: trajectory (read-only view into the trajectory buffer of the system after a run)
     """
 
+    __slots__ = ("store", "index")
+
     def __init__(self, m, x0, y0, vx0, vy0):
-        self.m = m
-        self.pos = [x0, y0]
-        self.v = [vx0, vy0]
-        self.f = []
-        self.attached = [] # List format: [mass/fixture connected to this fixture,
-                           #               spring constant of connecting spring,
-                           #               rest length of connecting spring]
-        self.trajectory = [self.pos]
+        DETACHED.masses.append(self, m = m, pos = (x0, y0), v = (vx0, vy0))
+
+
+    @property
+    def m(self):
+        return float(self.store.masses.arrays["m"][self.index])
+
+    @m.setter
+    def m(self, value):
+        self.store.masses.arrays["m"][self.index] = value
+
+
+    @property
+    def pos(self):
+        return self.store.masses.arrays["pos"][self.index]
+
+    @pos.setter
+    def pos(self, value):
+        self.store.masses.arrays["pos"][self.index] = value
+
+
+    @property
+    def v(self):
+        return self.store.masses.arrays["v"][self.index]
+
+    @v.setter
+    def v(self, value):
+        self.store.masses.arrays["v"][self.index] = value
+
+
+    @property
+    def f(self):
+        return self.store.masses.arrays["f"][self.index]
+
+    @f.setter
+    def f(self, value):
+        self.store.masses.arrays["f"][self.index] = value
+
+
+    @property
+    def attached(self):
+        # List format: [mass/fixture connected to this mass,
+        #               spring constant of connecting spring,
+        #               rest length of connecting spring]
+        return self.store.attached(1, self.index)
+
+
+    @property
+    def trajectory(self):
+        if self.store.recorder is None:
+            return [self.pos]
+        return self.store.recorder.trajectory(self.index)
 
 
 class Spring:
@@ -56,18 +138,55 @@ class Spring:
     -l0: rest length
     -k: spring constant
     -conn: objects that the spring connects (list of mass(es) and/or fixture(s))
+    -ends: connected objects while the spring is not part of a system (None otherwise)
     
     Connecting mass(es) and/or fixture(s) must be provided as a list
     """
 
+    __slots__ = ("store", "index", "ends")
+
     def __init__(self, l0, k, conn):
-        self.l0 = l0
-        self.k = k
-        self.conn = conn
+        self.ends = conn
+
+        # Attach spring to both elements (fixture/mass), if they are not part of a system yet
+        kind, end = (-1, -1), (0, 0)
+        if conn[0].store is DETACHED and conn[1].store is DETACHED:
+            kind = (isinstance(conn[0], Mass), isinstance(conn[1], Mass))
+            end = (conn[0].index, conn[1].index)
+        DETACHED.springs.append(self, k = k, l0 = l0, kind = kind, end = end)
+
+
+    @property
+    def l0(self):
+        return float(self.store.springs.arrays["l0"][self.index])
+
+    @l0.setter
+    def l0(self, value):
+        self.store.springs.arrays["l0"][self.index] = value
+
+
+    @property
+    def k(self):
+        return float(self.store.springs.arrays["k"][self.index])
 
-        # Attach spring to second element (fixture/mass)
-        self.conn[0].attached.append([conn[1], self.k, self.l0])
-        self.conn[1].attached.append([conn[0], self.k, self.l0])
+    @k.setter
+    def k(self, value):
+        self.store.springs.arrays["k"][self.index] = value
+
+
+    @property
+    def conn(self):
+        # Springs created by the store (see store.py) have no ends slot
+        ends = getattr(self, "ends", None)
+        if ends is not None:
+            return ends
+        kind = self.store.springs.arrays["kind"][self.index]
+        end = self.store.springs.arrays["end"][self.index]
+        return [self.store.node(kind[0], end[0]), self.store.node(kind[1], end[1])]
+
+
+# Store of the fixtures, masses and springs that are not part of a system
+DETACHED = Store(Fixture, Mass, Spring)
 
 
 class SpringMassSystem:
@@ -79,70 +198,527 @@ class SpringMassSystem:
     -time: length of time interval to be simulated
     -timesteps: number of intervals time is to be divided into
     -g: gravitational acceleration
-    -save: control of function save() that saves trajectories in a file
-
-    Fixtures, masses, and springs must be provided as lists
+    -save: stream the trajectories into the file save_path while running (see trajectory.py)
+    -record_every: record the positions only every record_every-th time step
+     (must divide timesteps, so that the final state is recorded)
+    -engine: "python" walks the Mass objects every step, "numpy" packs the system
+     into arrays (see engine.py) and only writes back to the objects in sync(),
+     "jit" runs many steps in one compiled loop (see jit.py, falls back to "numpy"
+     without numba), "parallel" evaluates the spring forces in worker processes
+     (see parallel.py) (default: "python" for the Euler integrator, "numpy" otherwise)
+    -workers: number of worker processes of the parallel engine (default: number of CPUs)
+    -integrator: time integration scheme of the numpy engine: "euler", "symplectic_euler",
+     "verlet", "rk4" or "rk45" (adaptive, see integrators.py), or "multirate" (stiff springs
+     sub-cycled within the time step, see multirate.py)
+    -rtol, atol: relative and absolute tolerance of the local error of the rk45 integrator
+     (None: defaults of integrators.py)
+    -profiler: timers of the run phases, None unless enabled with profile() (see profiling.py)
+    -contact: contact forces between the masses, None unless enabled with collisions() (see contact.py)
+    -compression: settings of the compressed recording, None unless enabled with compress()
+     (see compression.py)
+    -checkpoint_path, checkpoint_every: checkpoint file written every checkpoint_every-th
+     time step, None unless enabled with autosave() (see checkpoint.py)
+    -checkpoint_records: trajectory file the checkpoints of a run recorded into memory
+     append the records to (see checkpoint.py), None before the first checkpoint of a run
+    -streaming: whether a stream() generator is driving the current run
+    -topology: compiled topology (see compile() and topology.py)
+    -store: arrays of the fixtures, masses and springs (see store.py)
+    -nodes, velocities, m, edges: state of the python engine during a run: positions of all
+     fixtures and masses, velocities and masses of the masses as lists, and the springs
+     as tuples (node index of end a, of end b, a is a mass, b is a mass, k, l0)
+
+    Fixtures, masses, and springs must be provided as lists. The objects become part
+    of the system: their values are moved into the arrays of the system, and
+    self.fixtures, self.masses and self.springs are sequences of the same objects.
     """
 
-    def __init__(self, fixtures, masses, springs, time = 1, timesteps = 100, save = False, g = 9.81):
-        self.fixtures = fixtures
-        self.masses = masses
-        self.springs = springs
+    def __init__(self, fixtures, masses, springs, time = 1, timesteps = 100, save = False, g = 9.81, engine = None, record_every = 1, save_path = "trajectories.traj", integrator = "euler", workers = None, rtol = None, atol = None):
+        self.store = Store(Fixture, Mass, Spring)
+        self.store.fixtures.adopt(fixtures)
+        self.store.masses.adopt(masses)
+        self.adoptSprings(springs)
+        self.fixtures = Handles(self.store.fixtures)
+        self.masses = Handles(self.store.masses)
+        self.springs = Handles(self.store.springs)
         self.g = -g
         self.timesteps = timesteps
         self.time = time
         self.delta_t = time / timesteps
         self.trajectories = []
+        if record_every < 1 or timesteps % record_every:
+            raise ValueError("record_every must divide the number of time steps (the final state is recorded)")
+        self.record_every = record_every
+        self.recorder = None
+        self.step = 0
         self.save_csv = save
+        self.save_path = save_path
         self.E_i = 0
         self.E_f = 0
+        self.arrays = None
+
+        if engine is None:
+            engine = "python" if integrator == "euler" else "numpy"
+        if engine not in ("python", "numpy", "jit", "parallel"):
+            raise ValueError(f"Unknown engine: {engine}")
+        if engine == "python" and integrator != "euler":
+            raise ValueError("The python engine only supports the euler integrator")
+        if (rtol is not None or atol is not None) and integrator != "rk45":
+            raise ValueError("Tolerances only apply to the rk45 integrator")
+        self.engine = engine
+        self.integrator = integrator
+        self.workers = workers
+        self.rtol = rtol
+        self.atol = atol
+        self.state = None
+        self.profiler = None
+        self.contact = None
+        self.compression = None
+        self.checkpoint_path = None
+        self.checkpoint_every = None
+        self.checkpoint_records = None
+        self.streaming = False
+        self.topology = None
+        self.nodes = None
+        self.velocities = None
+        self.m = None
+        self.edges = None
+
+        masses = self.store.masses
+        masses.data("f")[:] = 0
+        masses.data("f")[:, 1] = masses.data("m") * self.g
+
+
+    @classmethod
+    def fromArrays(cls, fixtures_pos, m, pos, v, i, j, k, l0, time = 1, timesteps = 100, **options):
+        """
+        Build a system from arrays without creating Fixture, Mass and Spring objects
+        (they are created when accessed). The arguments are named as in pack_system()
+        (engine.py): i, j are the node indices of the spring ends (fixtures first,
+        then masses). Further keyword arguments are passed on to SpringMassSystem
+        (g is the unsigned gravitational acceleration, as there).
+        """
+
+        sms = cls([], [], [], time, timesteps, **options)
+        fixtures_pos = np.asarray(fixtures_pos, dtype = float).reshape(-1, 2)
+        m = np.asarray(m, dtype = float)
+        nf = len(fixtures_pos)
+        ends = np.stack([np.asarray(i, dtype = np.intp), np.asarray(j, dtype = np.intp)], axis = 1)
+        if ends.size and (ends.min() < 0 or ends.max() >= nf + len(m)):
+            raise ValueError("Spring end point is not a node of the system")
+
+        store = sms.store
+        store.fixtures.extend(nf, pos = fixtures_pos)
+        store.masses.extend(len(m), m = m, pos = pos, v = v, f = 0)
+        store.masses.data("f")[:, 1] = m * sms.g
+        store.springs.extend(len(ends), k = k, l0 = l0, kind = ends >= nf, end = np.where(ends >= nf, ends - nf, ends))
+        return sms
+
+
+    def adoptSprings(self, springs):
+        """
+        Move springs (possibly wrapped in lists, see test.py) connecting fixtures
+        and masses of the system into the arrays of the system
+        """
 
-        for m in self.masses:
-            m.f = [0, m.m * self.g]
+        springs = [s[0] if isinstance(s, list) else s for s in springs]
+        ends = [obj for s in springs for obj in s.conn]
+        if not all(obj.store is self.store for obj in ends):
+            raise ValueError("Spring connects an object that is not part of the system")
+        kind = np.fromiter((isinstance(obj, Mass) for obj in ends), np.int8, len(ends)).reshape(-1, 2)
+        end = np.fromiter((obj.index for obj in ends), np.intp, len(ends)).reshape(-1, 2)
+
+        pool = self.store.springs
+        start = pool.count
+        pool.adopt(springs)
+        pool.arrays["kind"][start:pool.count] = kind
+        pool.arrays["end"][start:pool.count] = end
+        for s in springs:
+            s.ends = None
 
 
     def update(self):
         """
         Update positions and velocities of the masses, and
-        the force acting on them
+        the force acting on them. With profiling enabled, start() wraps
+        the functions called here in timed phases (see profiling.py).
+        """
+
+        self.step += 1
+        if self.engine != "python":
+            self.state.step(self.delta_t)
+        else:
+            self.eulerStep(self.springForces())
+        if self.recorder is not None:
+            self.recordStep()
+
+
+    def recordStep(self):
+        """
+        Record positions and velocities of the masses at the current time step
         """
 
-        # Update forces
-        for m in self.masses:
-            m.f = [0, 0]
-            for elem in m.attached: # elem = [other_mass_or_fixture, spring_constant, rest_length]
-                m.f[0] += -elem[1] * (np.linalg.norm(np.array(elem[0].pos) - np.array(m.pos)) - elem[2]) * ((np.array(m.pos[0]) - np.array(elem[0].pos[0])) / (np.linalg.norm(np.array(elem[0].pos) - np.array(m.pos))))
-                m.f[1] += -elem[1] * (np.linalg.norm(np.array(elem[0].pos) - np.array(m.pos)) - elem[2]) * ((np.array(m.pos[1]) - np.array(elem[0].pos[1])) / (np.linalg.norm(np.array(elem[0].pos) - np.array(m.pos)))) + m.m * self.g
+        if self.engine != "python":
+            self.recorder.record(self.step, self.state.pos, self.state.v)
+        else:
+            masses = self.store.masses
+            self.recorder.record(self.step, masses.data("pos"), masses.data("v"))
+
+
+    def springForces(self):
+        """
+        Forces acting on the masses (python engine): every spring force
+        is computed once and applied to both ends
+        """
+
+        nodes = self.nodes
+        nf = len(nodes) - len(self.velocities)
+        forces = [[0, m * self.g] for m in self.m]
+        for a, b, free_a, free_b, k, l0 in self.edges:
+            dx = nodes[b][0] - nodes[a][0]
+            dy = nodes[b][1] - nodes[a][1]
+            l = math.sqrt(dx * dx + dy * dy)
+            c = k * (l - l0) / l
+            if free_a:
+                forces[a - nf][0] += c * dx
+                forces[a - nf][1] += c * dy
+            if free_b:
+                forces[b - nf][0] -= c * dx
+                forces[b - nf][1] -= c * dy
+        if self.contact is not None:
+            for f, (cx, cy) in zip(forces, self.contact.forces(np.array(nodes[nf:])).tolist()):
+                f[0] += cx
+                f[1] += cy
+        return forces
+
+
+    def eulerStep(self, forces):
+        """
+        Update positions and velocities of the masses (python engine)
+        and write them back into the masses
+        """
+
+        nodes, velocities = self.nodes, self.velocities
+        masses = self.store.masses
+        nf = len(nodes) - len(velocities)
 
         # Update positions
-        for m in self.masses:
-            m.pos[0] += m.v[0] * self.delta_t
-            m.pos[1] += m.v[1] * self.delta_t
-            m.trajectory.append(m.pos[:]) # Deep copy of pos
-            # print(f"Added to trajectory: {m.pos}")
+        for pos, v in zip(nodes[nf:], velocities):
+            pos[0] += v[0] * self.delta_t
+            pos[1] += v[1] * self.delta_t
 
         # Update velocities
-        for m in self.masses:
-            m.v[0] += m.f[0] / m.m * self.delta_t
-            m.v[1] += m.f[1] / m.m * self.delta_t
+        for v, f, m in zip(velocities, forces, self.m):
+            v[0] += f[0] / m * self.delta_t
+            v[1] += f[1] / m * self.delta_t
+
+        # Write the state back into the masses
+        masses.data("pos")[:] = nodes[nf:]
+        masses.data("v")[:] = velocities
+        masses.data("f")[:] = forces
+
+
+    def compile(self, rebuild = False):
+        """
+        Compile the fixtures, masses and springs into a topology of index arrays
+        (cached, see topology.py). The topology is rebuilt if the number of fixtures,
+        masses or springs changed; after changing springs in place (k, l0)
+        call compile(rebuild = True). addSpring() and removeSpring() update the
+        topology incrementally.
+        """
+
+        t = self.topology
+        if rebuild or t is None or (t.n_fixtures, t.n_masses, t.n_springs) != (len(self.fixtures), len(self.masses), len(self.springs)):
+            self.topology = Topology.fromSystem(self)
+        return self.topology
+
+
+    def nodeIndex(self, obj):
+        """
+        Node index of a fixture or mass of the system (fixtures first, then masses)
+        """
+
+        if obj.store is not self.store or isinstance(obj, Spring):
+            raise ValueError("Object is not a fixture or mass of the system")
+        return obj.index + len(self.fixtures) if isinstance(obj, Mass) else obj.index
+
+
+    def addSpring(self, spring):
+        """
+        Add a spring connecting fixtures and/or masses of the system (between runs)
+        """
+
+        if self.recorder is not None and self.step < self.timesteps:
+            raise RuntimeError("The springs cannot be changed during a run")
+        topology = self.compile()
+        i, j = self.nodeIndex(spring.conn[0]), self.nodeIndex(spring.conn[1])
+        self.adoptSprings([spring])
+        self.topology = topology.add(i, j, spring.k, spring.l0)
+
+
+    def removeSpring(self, spring):
+        """
+        Remove a spring from the system (between runs). The spring keeps
+        its values and ends and can be added again.
+        """
+
+        if self.recorder is not None and self.step < self.timesteps:
+            raise RuntimeError("The springs cannot be changed during a run")
+        if spring.store is not self.store or not isinstance(spring, Spring):
+            raise ValueError("Spring is not part of the system")
+        topology = self.compile()
+        n, conn, k, l0 = spring.index, spring.conn, spring.k, spring.l0
+        self.store.springs.delete(n)
+        DETACHED.springs.append(spring, k = k, l0 = l0, kind = (-1, -1))
+        spring.ends = conn
+        self.topology = topology.remove([n])
+
+
+    def reorder(self):
+        """
+        Renumber the masses in reverse Cuthill-McKee order and sort the springs by
+        their end points, so that connected masses are stored close to each other
+        in the arrays of the vectorized engines (between runs). Trajectories and
+        all other per-mass results follow the new order of self.masses.
+        """
+
+        if self.recorder is not None and self.step < self.timesteps:
+            raise RuntimeError("The masses cannot be reordered during a run")
+        topology = self.compile()
+        order = topology.rcm()
+        self.topology, springs = topology.permuted(order)
+
+        # Renumber the mass ends of the springs, then sort the springs
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        kind, end = self.store.springs.data("kind"), self.store.springs.data("end")
+        end[kind == 1] = inverse[end[kind == 1]]
+        self.store.masses.permute(order)
+        self.store.springs.permute(springs)
+        self.arrays = None
+
+
+    def equilibrium(self, apply = True, **options):
+        """
+        Solve for the static equilibrium (rest shape) of the system directly
+        (see equilibrium.py, requires scipy) and return the result. If apply is True,
+        the masses are placed at rest at the equilibrium, so that the next run starts
+        from it. options are passed on to equilibrium.solve() (pos, tol, max_iter).
+        """
+
+        if self.recorder is not None and self.step < self.timesteps:
+            raise RuntimeError("The equilibrium cannot be applied during a run")
+        import equilibrium
+        result = equilibrium.solve(self, **options)
+        if apply:
+            masses = self.store.masses
+            masses.data("pos")[:] = result["pos"]
+            masses.data("v")[:] = 0
+            masses.data("f")[:] = result["force"]
+            self.arrays = None
+        return result
+
+
+    def modes(self, n_modes = 10, equilibrium = False, **options):
+        """
+        Lowest n_modes normal modes of the system linearized about its current positions,
+        or about its static equilibrium if equilibrium is True, with the current positions
+        and velocities as initial state (see modal.py, requires scipy). The returned
+        Modes object evaluates the positions at any times in closed form
+        (modes.positions(t)). options are passed on to modal.solve() (x0, pos, v, sigma, tol).
+        """
+
+        import modal
+        if equilibrium:
+            options["x0"] = self.equilibrium(apply = False)["pos"]
+        return modal.solve(self, n_modes, **options)
+
+
+    def stabilityCheck(self, modes = None):
+        """
+        Compare the time step with the stability limit of the integrator for the highest
+        natural frequency of the system linearized about its current positions
+        (taken from modes, the result of modes(), if given; see modal.py).
+        Returns the largest stable time step.
+        """
+
+        import modal
+        omega_max = modal.omega_max(self) if modes is None else modes.omega_max
+        limit = modal.timestep(omega_max, self.integrator)
+        print("--- STABILITY CHECK ---")
+        print(f"Highest natural frequency: {omega_max / (2 * np.pi):.4g} Hz")
+        print(f"Largest stable time step ({self.integrator}): {limit:.4g} s, time step: {self.delta_t:.4g} s")
+        if limit == 0:
+            print("Warning: the euler integrator lets every oscillation grow, use symplectic_euler or verlet")
+        elif self.delta_t > limit:
+            print("Warning: the time step is too large, oscillations of the stiffest modes will grow")
+        return limit
+
+
+    def profile(self, callback = None, every = 1000):
+        """
+        Enable profiling of the following runs and return the profiler (see profiling.py).
+        callback is called with the progress (time step, fraction done, steps per second,
+        estimated remaining time) every every-th time step.
+        Timers and counters are available after run() with self.profiler.stats() or .json().
+        """
+
+        self.profiler = profiling.Profiler(callback, every)
+        return self.profiler
+
+
+    def phase(self, name):
+        """
+        Context manager timing phase name if profiling is enabled
+        """
+
+        return profiling.phase(self.profiler, name)
+
+
+    def collisions(self, radius, stiffness, skin = None, exclude_connected = True):
+        """
+        Enable penalty contact between the masses of the following runs and return it
+        (see contact.py): masses closer than 2 * radius are pushed apart with
+        stiffness * overlap. Masses connected by a spring do not collide unless
+        exclude_connected is False.
+        """
+
+        self.contact = contact.Contact(radius, stiffness, skin, exclude_connected)
+        return self.contact
+
+
+    def compress(self, tol, method = "linear", vtol = None, quantum = None, max_gap = 64):
+        """
+        Record the following runs compressed (see compression.py): a sample of a mass is
+        only kept where interpolating ("linear" or "hermite") between the kept samples
+        would miss its position by more than tol or its velocity by more than vtol
+        (numbers or one per mass). With save = True, the compressed recording is written
+        to save_path at the end of the run. compress(None) records every time step again.
+        """
+
+        if tol is None:
+            self.compression = None
+            return
+        self.compression = {"tol": tol, "method": method, "vtol": vtol, "quantum": quantum, "max_gap": max_gap}
+
+
+    def autosave(self, path, every = 10000):
+        """
+        Write a checkpoint of the following runs to path every every-th time step
+        (see checkpoint.py). Each checkpoint replaces the previous one.
+        """
+
+        if every < 1:
+            raise ValueError("Checkpoint interval must be at least 1 time step")
+        self.checkpoint_path = path
+        self.checkpoint_every = every
+
+
+    def checkpoint(self, path = None):
+        """
+        Write a checkpoint of the current run to path (default: the autosave path)
+        """
+
+        if path is None:
+            path = self.checkpoint_path
+        with self.phase("io"):
+            checkpoint.write(self, path)
+
+
+    def resume(self, path = None):
+        """
+        Continue a run from a checkpoint (default: the autosave path). The system must
+        be built as for the run that wrote the checkpoint; the run continues with the
+        same results as if it had not been interrupted. Call run() or iterate() afterwards.
+        """
+
+        if path is None:
+            path = self.checkpoint_path
+        with self.phase("io"):
+            data = checkpoint.read(path)
+            checkpoint.check(self, data)
+            recorder = checkpoint.recorder(self, data)
+        self.start(recorder)
+        checkpoint.restore(self, data)
+
+
+    def sync(self):
+        """
+        Write the state of the vectorized engine back into the Mass objects
+        """
+
+        self.state.sync()
+
+
+    def viewTrajectories(self):
+        """
+        Point self.trajectories and the trajectory of every mass
+        to read-only views of the trajectory buffer
+        """
+
+        self.trajectories = self.recorder.trajectories()
+        self.store.recorder = self.recorder
+
+
+    def integratorReport(self):
+        """
+        Print the number of steps taken and rejected and the number of force evaluations
+        """
+
+        stats = self.state.integrator.stats()
+        print("--- INTEGRATOR ---")
+        print(f"Integrator: {stats['integrator']}")
+        print(f"Steps taken: {stats['steps']}, rejected: {stats['rejected']}")
+        print(f"Force evaluations: {stats['force_evals']}")
+        if "spring_evals" in stats:
+            print(f"Springs per level: {stats['levels']}, spring force evaluations: {stats['spring_evals']}")
+
+
+    def compressionReport(self):
+        """
+        Print the number of kept samples and the size of the compressed recording
+        """
+
+        recorder = self.recorder
+        print("--- COMPRESSION ---")
+        print(f"Kept samples: {recorder.n_samples} of {recorder.count * recorder.n_masses}")
+        print(f"Size: {recorder.nbytes / 2**20:.2f} MiB ({recorder.ratio():.1f}x smaller)")
 
 
     def energy(self, t):
         """
         Calculate total energy of the system at a given point in time
+        (index of the record in the trajectory buffer)
+        """
+
+        return self.energySeries(t, t + 1 if t != -1 else None)["total"][0]
+
+
+    def energySeries(self, start = 0, stop = None):
+        """
+        Kinetic, gravitational, elastic and total energy of the system for every
+        recorded time step from record start to stop (exclusive), calculated from the
+        recorded positions and velocities (see energy.py)
         """
 
-        E = 0
+        if self.arrays is None:
+            self.arrays = pack_system(self)
+        positions = self.recorder.view("positions")[start:stop]
+        velocities = self.recorder.view("velocities")[start:stop]
+        with self.phase("energy"):
+            return energy.energies(positions, velocities, self.arrays)
 
-        # Calculate energy of masses
-        for m in self.masses:
-            E += m.m * m.trajectory[t][1] * self.g + m.m * (m.v[0] ** 2 + m.v[1] ** 2) / 2
 
-        # Calculate energy of springs
-        for s in self.springs:
-            E += s[0].k * (np.linalg.norm(np.array(s[0].conn[0].pos) - np.array(s[0].conn[1].pos)) - s[0].l0)
-        
-        return E
+    def energyDrift(self):
+        """
+        Largest deviation of the total energy from the initial total energy
+        over all recorded time steps (relative to the initial total energy)
+        """
+
+        total = self.energySeries()["total"]
+        if self.recorder.first:
+            # Streamed run: the records before the window are gone, their drift was kept
+            return max(self.recorder.drift, energy.max_drift(np.concatenate([[self.E_i], total])))
+        return energy.max_drift(total)
 
     
     def energyCheck(self):
@@ -153,248 +729,342 @@ class SpringMassSystem:
 
         print("--- ENERGY CHECK ---")
         self.E_div = (self.E_f - self.E_i) / self.E_i
+        self.E_drift = self.energyDrift()
         print(f"Deviation from initial total energy: {self.E_div * 100:.2f}%")
+        print(f"Maximum deviation over all time steps: {self.E_drift * 100:.2f}%")
 
 
-    def save(self):
+    def describe(self):
         """
-        Save trajectories to txt file
+        JSON serializable description of the system (stored in trajectory file headers)
         """
 
-        f = open("trajectories", "w")
-        f.write(f"{self.trajectories};")
-        f.close()
+        arrays = pack_system(self)
+        return {"fixtures": arrays["fixtures_pos"].tolist(),
+                "masses": arrays["m"].tolist(),
+                "springs": [[int(i), int(j), float(k), float(l0)] for i, j, k, l0
+                            in zip(arrays["i"], arrays["j"], arrays["k"], arrays["l0"])],
+                "g": self.g,
+                "time": self.time,
+                "timesteps": self.timesteps}
 
 
-    def plot(self):
+    def save(self, path = None):
         """
-        Plot trajectories of masses
+        Save the recorded trajectories to a binary trajectory file
+        (read it back with TrajectoryFile.open(path)); compressed recordings
+        are saved compressed (read them back with compression.load(path))
         """
-        # Plot trajectories
-        # fig, ax = plt.subplots(figsize = (10, 6))
-        # plt.plot([x for x in range(10)])
-        # plt.show()
-        # ax.plot(self.masses[0].trajectory)
 
+        if path is None:
+            path = self.save_path
+        if self.recorder.first:
+            raise RuntimeError("The trajectories of a streamed run are not kept, use stream(history = True)")
+        with self.phase("io"):
+            if isinstance(self.recorder, compression.CompressedTrajectory):
+                self.recorder.save(path, self.describe())
+                return
+
+            if isinstance(self.recorder, TrajectoryFile) and os.path.abspath(self.recorder.path) == os.path.abspath(path):
+                self.recorder.flush()
+                return
+
+            data = self.recorder.view()
+            f = TrajectoryFile.create(path, len(self.masses), self.timesteps, self.record_every,
+                                      self.delta_t, self.describe())
+            f.positions[:len(data)] = data
+            f.velocities[:len(data)] = self.recorder.view("velocities")
+            f.count = len(data)
+            f.flush()
+
+
+    def plot(self, path = None, max_points = 5000):
+        """
+        Plot trajectories of masses (see render.py).
+        Shows the plot in a window, or writes it to path (e.g. .png or .svg)
+        without a display.
         """
-        # Plot fixtures
-        print("Begin second plot")
-
-        for f in self.fixtures:
-            plt.scatter(x = f.pos[0], y = f.pos[1], s = 100, marker = "H")
-        
-        # Plot trajectories
-        for t_i in range(len(self.times)):
-            #print(f"Plotting point {t_i}...")
-            for m in self.masses:
-                plt.scatter(m.trajectory[t_i][0], m.trajectory[t_i][1])
-
-        for m in self.masses:
-            plt.scatter(x = [x[0] for x in self.masses[0].trajectory], y = [y[1] for y in self.masses[0].trajectory], s = 0.1)
 
-        # First dot in green
-        for m in self.masses:
-            plt.scatter(x = m.trajectory[0][0], y = m.trajectory[0][1], c = "green")
+        import render
+        if path is not None:
+            with self.phase("render"):
+                render.save(self, path, max_points)
+            return
 
-        # Last dot in red
-        for m in self.masses:
-            plt.scatter(x = m.trajectory[-1][0], y = m.trajectory[-1][1], c = "red")
-        
+        import matplotlib.pyplot as plt
+        with self.phase("render"):
+            fig, ax = plt.subplots(figsize = (10, 6))
+            render.draw(ax, self, max_points)
         plt.show()
 
-        print("Second plot finished")
-        """
-
-        # Plot trajectories
-        print("Begin plot")
-        for f in self.fixtures:
-            plt.scatter(f.pos[0], f.pos[1], c = "green", s = 100, marker = "H")
-        for t in range(int(self.timesteps / 20)):
-            if self.timesteps % 10 == 0: 
-                plt.scatter(self.trajectories[20 * t][0], self.trajectories[10 * t][1], c = "blue", s = 0.2)
-        
-        # First relevant dot in green
-        for m in self.masses:
-            plt.scatter(x = m.trajectory[1][0], y = m.trajectory[1][1], c = "green")
-
-        # Spring and mass at initial position
-        for s in self.springs:
-            # Calculate initial length of spring
-            l = np.linalg.norm(np.array(s[0].conn[0].pos) - np.array(s[0].conn[1].pos))
-            # Spring radius
-            r = 0.1
-            # Number of turns
-            n = 5 * int(l)
-            # Number of data points for the spring
-            N = 100 * n
-            # Padding for starting point and end point
-            pad1, pad2 = 150, 150
-            # Calculate translation vector of spring
-            # 1) Check which object is higher (larger y-coordinate)
-            # 2) T = initial position of higher object
-            T = np.array([0.0, 0.0])
-            # Calculate rotation angle of spring (in rad)
-            # The try-except blocks iterate over possible combinations of fixtures and massees
-            try:
-                # Spring vector
-                spring_vec = np.array(s[0].conn[1].trajectory[1]) - np.array(s[0].conn[0].trajectory[1])
-                print("Two masses")
-                # T = np.array(s[0].conn[1].trajectory[1])
-                T = np.array(s[0].conn[0].trajectory[1])
-            except:
-                try:
-                    # Spring vector
-                    spring_vec = np.array(s[0].conn[1].pos) - np.array(s[0].conn[0].trajectory[1])
-                    print("Fixture, mass")
-                    # T = np.array(s[0].conn[1].pos)
-                    T = np.array(s[0].conn[0].trajectory[1])
-                except:
-                    try:
-                        # Spring vector
-                        spring_vec = np.array(s[0].conn[1].trajectory[1]) - np.array(s[0].conn[0].pos)
-                        print("Mass, fixture")
-                        print(f"Coordinates of mass: {s[0].conn[1].trajectory[1]}")
-                        print(f"Coordinates of fixture: {s[0].conn[0].pos}")
-                        # T = np.array(s[0].conn[1].trajectory[1])
-                        T = np.array(s[0].conn[0].pos)
-                    except:
-                        raise ValueError
-            # Unit vector in initial direction of spring
-            init_unit_vec = np.array([0.0, -1.0])
-            # Unit vector of spring vector
-            spring_unit_vec = spring_vec / np.linalg.norm(spring_vec)
-            # theta = np.arccos(np.clip((np.dot(spring_unit_vec, init_unit_vec)), -1.0, 1.0))
-            theta = np.arctan2(spring_unit_vec[1], spring_unit_vec[0]) - np.arctan2(init_unit_vec[1], init_unit_vec[0])
-            w = np.linspace(0, l, N)
-            # Setup spring
-            spring = np.zeros(N)
-            spring[pad1:-pad2] = r * np.sin(2 * np.pi * n * w[pad1:-pad2] / l)
-            # Rotate spring
-            R = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
-            x, y = - R @ np.vstack((spring, w))
-            # Translate spring
-            x += T[0]
-            y += T[1]
-            plt.scatter(x, y, c = "k", s = 0.01)
-            print(f"Angle: {theta * 57.3}")
-
-        """
-        # Last relevant dot in red
-        for m in self.masses:
-           plt.scatter(x = m.trajectory[-1][0], y = m.trajectory[-1][1], c = "red")
-        """
-        
-        plt.show()
-        print("Plot finished")
 
-        
-        
-
-    def run(self):
-        """Run the simulation"""
+    def start(self, recorder = None):
+        """
+        Prepare a run: create the trajectory buffer (or file, if saving, or compressed
+        recorder, see compress()), record the initial state, calculate the initial
+        energy and pack the system for the vectorized engine. A recorder already
+        holding the initial state can be passed instead (see resume()).
+        """
 
         # Create time steps
         self.times = np.linspace(0, 1, self.timesteps)
 
+        # Restart the timers of the profiler
+        if self.profiler is not None:
+            self.profiler.reset()
+
+        # Preallocate the trajectory buffer (or file, if saving) and record the initial positions
+        self.step = 0
+        self.checkpoint_records = None
+        if recorder is not None:
+            self.recorder = recorder
+        elif self.compression is not None:
+            self.recorder = compression.CompressedTrajectory(len(self.masses), self.timesteps, self.record_every,
+                                                             self.delta_t, **self.compression)
+        elif self.save_csv:
+            with self.phase("io"):
+                self.recorder = TrajectoryFile.create(self.save_path, len(self.masses), self.timesteps,
+                                                      self.record_every, self.delta_t, self.describe())
+        else:
+            self.recorder = TrajectoryBuffer(len(self.masses), self.timesteps, self.record_every)
+        if recorder is None:
+            self.recorder.record(0, self.store.masses.data("pos"), self.store.masses.data("v"))
+        self.viewTrajectories()
+
         # Calculate initial energy of the system
+        self.arrays = pack_system(self)
         self.E_i = self.energy(0)
 
-        # Update forces, positions and velocities. Create m.trajectory array for each m
-        for t in self.times:
-            self.update()
+        # State of the python engine as lists, springs as an edge table of node indices
+        if self.engine == "python":
+            nf = self.topology.n_fixtures
+            self.nodes = self.arrays["fixtures_pos"].tolist() + self.arrays["pos"].tolist()
+            self.velocities = self.arrays["v"].tolist()
+            self.m = self.arrays["m"].tolist()
+            self.edges = [(i, j, i >= nf, j >= nf, k, l0) for i, j, k, l0
+                          in zip(self.topology.i.tolist(), self.topology.j.tolist(),
+                                 self.topology.k.tolist(), self.topology.l0.tolist())]
+
+        # Pack the system into arrays for the vectorized engine
+        self.state = None
+        integrator = self.integrator
+        tolerances = {name: value for name, value in (("rtol", self.rtol), ("atol", self.atol)) if value is not None}
+        if tolerances:
+            integrator = get_integrator(integrator, **tolerances)
+        if self.engine == "numpy":
+            self.state = VectorEngine.fromSystem(self, integrator)
+        elif self.engine == "jit":
+            from jit import JitEngine
+            self.state = JitEngine.fromSystem(self, integrator)
+        elif self.engine == "parallel":
+            from parallel import ParallelEngine
+            self.state = ParallelEngine.fromSystem(self, integrator, self.workers)
+        if self.contact is not None:
+            self.contact.reset(self.topology)
+            if self.state is not None:
+                self.state.contact = self.contact
+
+        # Time the phases of the time steps (the wrappers of a previous profiled run are dropped)
+        for name in ("springForces", "eulerStep", "recordStep"):
+            self.__dict__.pop(name, None)
+        if self.profiler is not None:
+            self.profiler.instrumentSystem(self)
+
+
+    def iterate(self, every = 1):
+        """
+        Generator running the simulation: updates forces, positions and velocities
+        and yields the number of the current time step after every every-th step.
+        Calls start() first (unless a run has been started and is not finished yet)
+        and finish() at the end. A run left by an abandoned stream() (that only kept
+        its latest records) is started again from the initial state.
+        """
 
-        # Save trajectories of all masses in a single array (trajectories).
-        # One element of the array contains the coordinates of all masses at a given point in time
-        
-        # self.trajectories = [self.timesteps, 2, len(self.masses)]
-        self.trajectories = []
+        if self.recorder is None or self.step >= self.timesteps:
+            self.start()
+        elif isinstance(self.recorder, TrajectoryWindow) and not self.streaming:
+            if self.engine == "parallel":
+                self.state.close()
+            masses = self.store.masses
+            masses.data("pos")[:] = self.arrays["pos"]
+            masses.data("v")[:] = self.arrays["v"]
+            self.start()
+
+        while self.step < self.timesteps:
+            self.advance(min(every - self.step % every, self.timesteps - self.step))
+            yield self.step
+
+        self.finish()
+
+
+    def stream(self, chunk_size = 100, history = False):
+        """
+        Generator running the simulation and yielding a snapshot of every chunk_size
+        recorded time steps as a dictionary: time step numbers ("steps"), times ("t"),
+        "positions" and "velocities" (shape (n, n_masses, 2)). The first chunk starts
+        with the initial state. The simulation only advances when the next chunk is
+        requested. Unless history is True (or the run is saved to a file), only the
+        current chunk is kept in memory: self.trajectories then only holds the last
+        chunk, and the trajectories cannot be saved after the run.
+        """
+
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be at least 1 record")
+
+        # Continue a resumed run, start all others
+        if self.recorder is None or self.step == 0 or self.step >= self.timesteps:
+            recorder = None
+            if not (history or self.save_csv):
+                recorder = TrajectoryWindow(len(self.masses), chunk_size + 1, self.record_every)
+                recorder.record(0, self.store.masses.data("pos"), self.store.masses.data("v"))
+            self.start(recorder)
+
+        recorder = self.recorder
+        start = recorder.count if self.step else 0
+        if isinstance(recorder, TrajectoryWindow) and self.step:
+            # Resumed streamed run: its last chunk was already yielded
+            recorder.drift = self.energyDrift()
+            recorder.shift(chunk_size + 1)
+        # Streams closed early leave the run to be continued by another stream()
+        # (or started again by iterate())
+        self.streaming = True
+        try:
+            for step in self.iterate(every = chunk_size * self.record_every):
+                view = slice(start - recorder.first, None)
+                steps = np.arange(start, recorder.count) * self.record_every
+                start = recorder.count
+                yield {"steps": steps,
+                       "t": steps * self.delta_t,
+                       "positions": np.array(recorder.view("positions")[view]),
+                       "velocities": np.array(recorder.view("velocities")[view])}
+
+                if isinstance(recorder, TrajectoryWindow):
+                    recorder.drift = self.energyDrift()
+                    recorder.shift()
+        finally:
+            self.streaming = False
+
+
+    async def astream(self, chunk_size = 100, history = False):
+        """
+        Asynchronous generator version of stream() for asyncio: every chunk is
+        computed in a worker thread, so the event loop is not blocked
+        """
 
-        for t in range(len(self.times)):
-            x_coords = [m.trajectory[t][0] for m in self.masses]
-            y_coords = [m.trajectory[t][1] for m in self.masses]
-            self.trajectories.append([x_coords, y_coords])
+        import asyncio
+        chunks = self.stream(chunk_size, history)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            chunks.close()
+
+
+    def advance(self, n_steps):
+        """
+        Run n_steps time steps (the jit engine runs them in one compiled call,
+        force evaluation and recording included)
+        """
+
+        profiler = self.profiler
+        every = self.checkpoint_every
+        while n_steps > 0:
+            # Stop when the progress callback of the profiler or a checkpoint is due
+            n = n_steps if profiler is None else profiler.chunk(self.step, n_steps)
+            if every is not None:
+                n = min(n, every - self.step % every)
+
+            if self.engine == "jit":
+                with self.phase("integrate"):
+                    self.state.advance(self.delta_t, n, self.recorder, self.step)
+                self.step += n
+            else:
+                for _ in range(n):
+                    self.update()
+
+            n_steps -= n
+            if profiler is not None:
+                profiler.tick(self.step, self.timesteps, n)
+            if every is not None and self.step % every == 0 and self.step < self.timesteps:
+                self.checkpoint()
+
+
+    def positions(self):
+        """
+        Current positions of the masses, shape (n_masses, 2)
+        """
+
+        if self.state is not None:
+            return self.state.pos
+        return self.store.masses.data("pos").copy()
+
+
+    def finish(self):
+        """
+        Finish a run: write back the engine state, check the energy and save
+        """
+
+        # Write the state of the vectorized engine back into the Mass objects
+        if self.engine != "python":
+            self.sync()
+            self.integratorReport()
+        if isinstance(self.recorder, compression.CompressedTrajectory):
+            self.compressionReport()
+
+        # Expose the trajectories of all masses as read-only views of the buffer.
+        # One element of self.trajectories contains the coordinates of all masses at a given point in time
+        self.viewTrajectories()
 
         # Calculate final energy of the system
-        self.E_f = self.energy(self.timesteps)
+        self.E_f = self.energy(-1)
 
         # Check plausibility of results
         self.energyCheck()
 
-
         # Save to file if user wishes
         if self.save_csv == True:
             self.save()
-            print(f"Saved trajectories to \"trajectories.txt\"")
-        
-        # Plot trajectories
-        self.plot()
+            print(f"Saved trajectories to \"{self.save_path}\"")
+
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler.report()
+
+        # Stop the worker processes of the parallel engine
+        if self.engine == "parallel":
+            self.state.close()
 
-        # Start animation
-        # a = Animator(self)
-        # a.animate()
 
-        
-        
+    def run(self, plot = False, cache = None):
+        """
+        Run the simulation (and plot the trajectories if plot is True).
+        With a ResultCache (see cache.py), identical runs are read from the
+        cache and longer runs continue the cached ones.
+        """
+
+        if cache is not None:
+            cache.run(self)
+        else:
+            for step in self.iterate(every = self.timesteps):
+                pass
+
+        # Plot trajectories if user wishes
+        if plot:
+            self.plot()
+
 
 # -----------------------------------------------
 
-# Not used currently
-
-class Animator:
-
-    def __init__(self, sms):
-        self.fixtures = sms.fixtures
-        self.masses = sms.masses
-        self.springs = sms.springs
-        self.timesteps = sms.timesteps
-        self.time = sms.time
-        self.delta_t = self.time / self.timesteps
-        self.trajectories = sms.trajectories
-        self.pause = 1
-        self.j = 0
-
-        f = open("trajectories", "w")
-        for line in self.trajectories:
-            f.write(f"{line}\n")
-        f.close()
-
-        # Create canvas
-        self.fig = plt.figure()
-        self.axis = plt.axes(xlim =(-50, 50), ylim =(-50, 50))
-
-        self.line, = self.axis.plot([], [], "bo")
-
-        # Initialize coordinate arrays
-        self.xdata = []
-        self.ydata = []
-
-        # Set data for line on canvas
-        # def init():
-        self.line.set_data([], [])
-        # return self.line,
-
-
-
-    # Called every time step
-    def update(self, i):
-        # Parameter for speed setting
-        t = 0.1 * i
-
-        # Update arrays for line to plot
-        for coords in self.trajectories[i]:
-            self.xdata.append(coords[0])
-            self.ydata.append(coords[1])
-
-        self.line.set_data(self.xdata, self.ydata)
-        # print(f"i: {i}")
-        # print("Data to plot:")
-        # print(f"xdata: {self.xdata}")
-        # print(f"ydata: {self.ydata}")
-        if i == 11999:
-            f = open("xdata_ydata", "w")
-            f.write(f"xdata and ydata at i = {i}: \n {self.xdata} \n {self.ydata}")
-        return self.line,
-
-    def animate(self):  
-        anim = animation.FuncAnimation(self.fig, self.update, frames = self.timesteps, interval = self.pause, blit = True)
-        plt.show()
+def __getattr__(name):
+    """
+    Animator (see animator.py) is imported on first use of main.Animator,
+    so that the simulation core loads without matplotlib
+    """
+
+    if name == "Animator":
+        from animator import Animator
+        return Animator
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
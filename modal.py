@@ -0,0 +1,287 @@
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+from engine import VectorEngine, pack_system
+from implicit import SparseJacobian
+from integrators import get_integrator
+
+
+"""
+ Modal analysis
+
+ Linearizes a spring mass system about a state x0 (its static equilibrium,
+ see equilibrium.py, or any given positions): for small displacements
+ u = x - x0 the equations of motion become M u'' + K u = F0, with the
+ diagonal mass matrix M, the sparse stiffness matrix K = -dF/dx of the
+ springs at x0 (see implicit.py) and the total force F0 at x0 (zero at
+ the equilibrium). Their solution is a sum of normal modes: mode n has the
+ angular frequency omega_n (omega_n^2 are the eigenvalues of K u = omega^2 M u)
+ and moves along its mode shape as a cosine and sine in time.
+
+ The lowest modes are computed by subspace iteration in shift-invert mode
+ (a block of vectors is repeatedly multiplied with the inverse of K - sigma M,
+ from a sparse LU factorization, and the modes are extracted from the block):
+ unlike Lanczos (scipy.sparse.linalg.eigsh), it finds every copy of repeated
+ frequencies, which are common in regular meshes. The highest natural
+ frequency comes from a Lanczos iteration; small systems are solved densely.
+ The positions of the masses are then evaluated at any times in closed form,
+ at a cost of O(n_modes * n_masses) per time independent of delta_t.
+ Displacements and velocities outside the computed modes are dropped,
+ see captured.
+
+ The highest natural frequency limits the time step of the explicit
+ integrators: oscillations stay bounded only for omega_max * delta_t up to
+ the stability limit of the integrator (2 for symplectic Euler and Verlet).
+
+ Requires scipy.
+"""
+
+
+# Systems up to this many degrees of freedom are solved with a dense eigensolver
+DENSE = 1000
+
+
+def matrices(engine, pos = None):
+    """
+    Sparse mass matrix M (diagonal) and stiffness matrix K = -dF/dx of the springs
+    with the masses at pos (default: current positions of engine); DOF 2 * n + c
+    is coordinate c of mass n
+    """
+
+    nodes = engine.nodes.copy()
+    if pos is not None:
+        nodes[engine.n_fixtures:] = pos
+    jacobian = SparseJacobian(engine)
+    K = -jacobian.matrix(jacobian.data(engine, nodes, definite = False))
+    M = sp.diags(np.repeat(engine.m, 2))
+    return M, K
+
+
+class Modes:
+    """
+    Initialize the normal modes of a system linearized about x0, with the initial
+    state pos, v (at time 0).
+    Attributes:
+    -x0: positions of the masses the system is linearized about, shape (n_masses, 2)
+    -m: masses
+    -eigenvalues: omega^2 of the modes, ascending (negative: unstable about x0)
+    -shapes: mass normalized mode shapes, shape (n_modes, n_masses, 2)
+    -omega: angular frequencies of the modes (0 for rigid body and unstable modes)
+    -omega_max: highest angular frequency of the linearized system
+    -force: total force acting on the masses at x0 (zero at the equilibrium)
+    -q0, dq0, c: modal coordinates of the initial displacement, velocity and of force
+    -captured: part of the initial displacement and of the initial velocity represented
+     by the modes, whichever is smaller (mass weighted norms, 1: completely)
+    """
+
+    def __init__(self, x0, m, eigenvalues, shapes, omega_max, force, pos, v):
+        self.x0 = x0
+        self.m = m
+        self.eigenvalues = eigenvalues
+        self.shapes = shapes
+        self.omega = np.sqrt(np.maximum(eigenvalues, 0.0))
+        self.omega_max = omega_max
+        self.force = force
+
+        # Mass normalized: the modal coordinates are projections with the mass matrix
+        phi = shapes.reshape(len(eigenvalues), -1)
+        w = np.repeat(m, 2)
+        u0 = (np.asarray(pos, dtype = float) - x0).ravel()
+        v0 = np.asarray(v, dtype = float).ravel()
+        self.q0 = phi @ (w * u0)
+        self.dq0 = phi @ (w * v0)
+        self.c = phi @ force.ravel()
+        self.captured = 1.0
+        for q, x in ((self.q0, u0), (self.dq0, v0)):
+            norm = x @ (w * x)
+            if norm > 0:
+                self.captured = min(self.captured, np.sqrt(q @ q / norm))
+
+        # Eigenvalues this close to zero are rigid body modes (free motion under the force)
+        self.rigid = np.abs(eigenvalues) <= 1e-9 * max(omega_max ** 2, 1e-300)
+
+
+    def coordinates(self, t):
+        """
+        Modal coordinates q and their time derivatives at the times t, shape (n_modes, len(t))
+        """
+
+        t = np.atleast_1d(np.asarray(t, dtype = float))
+        lam = self.eigenvalues[:, None]
+        q0, dq0, c = self.q0[:, None], self.dq0[:, None], self.c[:, None]
+        rigid = self.rigid[:, None]
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            # Oscillation (or exponential growth) about the static displacement c / omega^2
+            r = np.sqrt(np.abs(lam))
+            qs = np.where(rigid, 0.0, c / lam)
+            rt = r * t
+            stable = lam > 0
+            cos = np.where(stable, np.cos(rt), np.cosh(rt))
+            sin = np.where(stable, np.sin(rt), np.sinh(rt))
+            q = qs + (q0 - qs) * cos + dq0 / r * sin
+            dq = np.where(stable, -r, r) * (q0 - qs) * sin + dq0 * cos
+        # Rigid body modes: uniform acceleration
+        q = np.where(rigid, q0 + dq0 * t + 0.5 * c * t * t, q)
+        dq = np.where(rigid, dq0 + c * t, dq)
+        return q, dq
+
+
+    def positions(self, t):
+        """
+        Positions of the masses at the times t (closed form), shape (len(t), n_masses, 2)
+        """
+
+        q, _ = self.coordinates(t)
+        return self.x0 + np.einsum("kt,knc->tnc", q, self.shapes)
+
+
+    def velocities(self, t):
+        """
+        Velocities of the masses at the times t (closed form), shape (len(t), n_masses, 2)
+        """
+
+        _, dq = self.coordinates(t)
+        return np.einsum("kt,knc->tnc", dq, self.shapes)
+
+
+    def frequencies(self):
+        """
+        Natural frequencies of the modes in Hz
+        """
+
+        return self.omega / (2 * np.pi)
+
+
+    def timestep(self, integrator = "verlet"):
+        """
+        Largest time step for which the integrator keeps all oscillations of the
+        linearized system bounded (inf for implicit and adaptive integrators,
+        0 for explicit Euler, which lets every undamped oscillation grow)
+        """
+
+        return timestep(self.omega_max, integrator)
+
+
+def timestep(omega_max, integrator = "verlet"):
+    """
+    Largest time step for which the integrator keeps oscillations of angular
+    frequencies up to omega_max bounded (see Integrator.stability)
+    """
+
+    stability = get_integrator(integrator).stability
+    if stability is None or omega_max == 0:
+        return np.inf
+    return stability / omega_max
+
+
+def normalized(engine):
+    """
+    Stiffness matrix scaled with the masses, A = M^-1/2 K M^-1/2 (CSC), and the scale
+    M^-1/2: the eigenvalues of A are omega^2, its eigenvectors y give the mode shapes
+    u = M^-1/2 y, mass normalized if y is normalized
+    """
+
+    # The entries are scaled in place: sparse matrix arithmetic would drop the explicit
+    # zeros of unstressed springs, and SuperLU is much slower on the thinned pattern
+    M, K = matrices(engine)
+    scale = 1 / np.sqrt(M.diagonal())
+    A = K.tocsc()
+    A.data *= scale[A.indices] * np.repeat(scale, np.diff(A.indptr))
+    return A, scale
+
+
+def largest(A):
+    """
+    Estimate of the largest eigenvalue of the symmetric matrix A, on the high side
+    """
+
+    if A.shape[0] <= DENSE:
+        return np.linalg.eigvalsh(A.toarray())[-1] if A.shape[0] else 0.0
+
+    # Lanczos Ritz value plus its residual (an upper bound of the eigenvalue it approximates),
+    # at most the Gershgorin bound. The top of the spectrum is dense, so a loose tolerance
+    # keeps Lanczos fast
+    start = np.random.default_rng(0).standard_normal(A.shape[0])
+    ritz, y = spla.eigsh(A, 1, which = "LA", tol = 1e-4, v0 = start)
+    residual = np.linalg.norm(A @ y[:, 0] - ritz[0] * y[:, 0])
+    return min(ritz[0] + residual, np.max(abs(A).sum(axis = 1)))
+
+
+def subspace(A, lu, n_modes, tol, max_iter = 1000):
+    """
+    n_modes eigenvalues (ascending) and eigenvectors of the symmetric matrix A closest
+    to sigma by subspace iteration (block inverse iteration with Rayleigh-Ritz projection)
+    with the LU factors lu of A - sigma * I, until the residual of every eigenvector is below tol
+    """
+
+    n_block = min(max(2 * n_modes, n_modes + 8), A.shape[0])
+    X = np.random.default_rng(0).standard_normal((A.shape[0], n_block))
+    for _ in range(max_iter):
+        Q, _ = np.linalg.qr(lu.solve(X))
+        AQ = A @ Q
+        eigenvalues, S = np.linalg.eigh(Q.T @ AQ)
+        X = Q @ S
+        residual = AQ @ S[:, :n_modes] - X[:, :n_modes] * eigenvalues[:n_modes]
+        if np.max(np.linalg.norm(residual, axis = 0)) <= tol:
+            return eigenvalues[:n_modes], X[:, :n_modes]
+    raise RuntimeError(f"Modes not converged after {max_iter} subspace iterations")
+
+
+def linearized(sms, x0 = None):
+    """
+    Engine of a SpringMassSystem with the masses at x0 (default: current positions)
+    """
+
+    arrays = pack_system(sms)
+    if x0 is not None:
+        arrays["pos"] = x0
+    return VectorEngine(**arrays)
+
+
+def omega_max(sms, x0 = None):
+    """
+    Highest angular frequency of a SpringMassSystem linearized about the positions x0
+    (default: current positions of the masses), estimated on the high side
+    """
+
+    A, _ = normalized(linearized(sms, x0))
+    return np.sqrt(max(largest(A), 0.0))
+
+
+def solve(sms, n_modes = 10, x0 = None, pos = None, v = None, sigma = None, tol = 1e-10):
+    """
+    Lowest n_modes normal modes of a SpringMassSystem linearized about the positions
+    x0 (default: current positions of the masses), with the initial state pos, v
+    (default: current positions and velocities of the masses). sigma is the shift of
+    the inverse iteration (default: slightly below zero, so that the modes closest to
+    zero frequency are found), tol the largest residual of the modes relative to
+    omega_max^2. Returns a Modes object.
+    """
+
+    masses = sms.store.masses
+    pos = masses.data("pos").copy() if pos is None else pos
+    v = masses.data("v").copy() if v is None else v
+    engine = linearized(sms, x0)
+    force = engine.acceleration() * engine.m[:, None]
+
+    A, scale = normalized(engine)
+    n_dofs = A.shape[0]
+    n_modes = min(n_modes, n_dofs)
+
+    if n_dofs <= DENSE or n_modes >= n_dofs - 1:
+        eigenvalues, y = np.linalg.eigh(A.toarray())
+        lam_max = eigenvalues[-1] if n_dofs else 0.0
+        eigenvalues, y = eigenvalues[:n_modes], y[:, :n_modes]
+    else:
+        lam_max = largest(A)
+        if sigma is None:
+            sigma = -1e-6 * lam_max
+        # Symmetric fill-reducing ordering and pivots from the diagonal, as in equilibrium.py
+        shifted = A.copy()
+        shifted.setdiag(A.diagonal() - sigma)
+        lu = spla.splu(shifted, permc_spec = "MMD_AT_PLUS_A", diag_pivot_thresh = 0.0)
+        eigenvalues, y = subspace(A, lu, n_modes, tol * lam_max)
+
+    shapes = (scale[:, None] * y).T.reshape(n_modes, -1, 2)
+    return Modes(engine.pos.copy(), engine.m, eigenvalues, shapes, np.sqrt(max(lam_max, 0.0)), force, pos, v)
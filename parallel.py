@@ -0,0 +1,202 @@
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from engine import VectorEngine, pack_system
+
+
+"""
+ Parallel engine
+
+ Spreads the spring force evaluation of one large system over worker
+ processes (engine = "parallel"). The springs are sorted by their first
+ node and split into one domain of consecutive springs per worker.
+ The node positions, the forces and one accumulator per worker live in
+ a single block of shared memory (multiprocessing.shared_memory), so
+ nothing is copied between processes during a run.
+
+ A force evaluation has two phases separated by barriers:
+ -every worker computes the forces of its springs and scatters them into
+  its own accumulator, which only covers the range of nodes its springs
+  touch (no write conflicts)
+ -every worker sums the accumulators overlapping its share of the nodes
+  into the shared force array (parallel reduction)
+
+ The accumulators are small when connected nodes have close indices,
+ so reorder the masses (sms.reorder()) before running large systems.
+ Forces agree with the numpy engine up to rounding (different summation order).
+"""
+
+
+def _arrays(buffer, n_nodes, n_acc):
+    """
+    Views of the shared memory: node positions, forces and accumulators
+    """
+
+    nodes = np.ndarray((n_nodes, 2), dtype = float, buffer = buffer)
+    F = np.ndarray((n_nodes, 2), dtype = float, buffer = buffer, offset = nodes.nbytes)
+    acc = np.ndarray((n_acc, 2), dtype = float, buffer = buffer, offset = 2 * nodes.nbytes)
+    return nodes, F, acc
+
+
+def _worker(name, n_nodes, n_acc, w, springs, spans, rows, barrier, stop):
+    """
+    Worker process w: evaluates the forces of its springs (i, j, k, l0) whenever
+    the main process passes the barrier, until stop is set
+    """
+
+    shm = shared_memory.SharedMemory(name = name)
+    nodes, F, acc = _arrays(shm.buf, n_nodes, n_acc)
+    i, j, k, l0 = springs
+    lo, hi, offset = spans[w]
+    own = acc[offset:offset + hi - lo]
+    i, j = i - lo, j - lo
+    first, last = rows
+
+    # Accumulators overlapping the own rows of the force array
+    sources = [(max(a, first), min(b, last), o - a) for a, b, o in spans if a < last and b > first]
+
+    try:
+        while True:
+            barrier.wait()
+            if stop.value:
+                break
+
+            # Spring forces into the own accumulator (end i gets f, end j gets -f)
+            if len(k):
+                x = nodes[lo:hi]
+                d = x[j] - x[i]
+                l = np.sqrt(np.einsum("ec,ec->e", d, d))
+                f = (k * (l - l0) / l)[:, None] * d
+                for c in range(2):
+                    own[:, c] = np.bincount(i, f[:, c], hi - lo) - np.bincount(j, f[:, c], hi - lo)
+            barrier.wait()
+
+            # Reduction of the own rows
+            F[first:last] = 0.0
+            for a, b, o in sources:
+                F[a:b] += acc[a + o:b + o]
+            barrier.wait()
+    finally:
+        del nodes, F, acc, own
+        shm.close()
+
+
+def _shutdown(processes, barrier, stop, shm):
+    """
+    Stop the worker processes and free the shared memory
+    """
+
+    if any(p.is_alive() for p in processes):
+        stop.value = 1
+        try:
+            barrier.wait(timeout = 10)
+        except Exception:
+            pass
+    for p in processes:
+        p.join(timeout = 10)
+        if p.is_alive():
+            p.terminate()
+    try:
+        shm.close()
+    except BufferError:
+        # Views of the shared memory are still alive, they keep the mapping
+        pass
+    shm.unlink()
+
+
+class ParallelEngine(VectorEngine):
+    """
+    Initialize a parallel engine. Same attributes as VectorEngine, and:
+    -workers: number of worker processes
+    -spans: first node, end node and accumulator offset of every worker
+    -rows: nodes of the force array summed by every worker
+
+    Batched (ensemble) states are not supported. Call close() to stop the workers
+    (also done when the engine is garbage collected).
+    """
+
+    def __init__(self, fixtures_pos, m, pos, v, i, j, k, l0, g = -9.81, integrator = "euler", workers = None):
+        super().__init__(fixtures_pos, m, pos, v, i, j, k, l0, g, integrator)
+        if self.pos.ndim != 2:
+            raise ValueError("The parallel engine does not support batched engines")
+        self.workers = workers or os.cpu_count() or 1
+        n_nodes = len(self.nodes)
+
+        # Domains: consecutive springs in the order of their first node
+        order = np.argsort(np.minimum(self.i, self.j), kind = "stable")
+        domains = np.array_split(order, self.workers)
+        self.spans = []
+        offset = 0
+        for springs in domains:
+            if len(springs):
+                lo = int(min(self.i[springs].min(), self.j[springs].min()))
+                hi = int(max(self.i[springs].max(), self.j[springs].max())) + 1
+            else:
+                lo = hi = 0
+            self.spans.append((lo, hi, offset))
+            offset += hi - lo
+        bounds = np.linspace(0, n_nodes, self.workers + 1).astype(int)
+        self.rows = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+        size = max((2 * n_nodes + offset) * 2 * 8, 1)
+        self.shm = shared_memory.SharedMemory(create = True, size = size)
+        self.shared_nodes, self.shared_forces, _ = _arrays(self.shm.buf, n_nodes, offset)
+
+        context = multiprocessing.get_context()
+        self.barrier = context.Barrier(self.workers + 1)
+        self.stop = context.Value("b", 0, lock = False)
+        self.processes = []
+        for w, springs in enumerate(domains):
+            p = context.Process(target = _worker, daemon = True,
+                                args = (self.shm.name, n_nodes, offset, w,
+                                        (self.i[springs], self.j[springs], self.k[springs], self.l0[springs]),
+                                        self.spans, self.rows[w], self.barrier, self.stop))
+            p.start()
+            self.processes.append(p)
+        self.finalizer = weakref.finalize(self, _shutdown, self.processes, self.barrier, self.stop, self.shm)
+
+
+    @classmethod
+    def fromSystem(cls, sms, integrator = "euler", workers = None):
+        """
+        Pack the Fixture, Mass and Spring objects of a SpringMassSystem
+        """
+
+        engine = cls(**pack_system(sms), integrator = integrator, workers = workers)
+        engine.system = sms
+        return engine
+
+
+    def forces(self, nodes = None):
+        """
+        Calculate the total force acting on every node with the worker processes
+        """
+
+        if nodes is None:
+            nodes = self.nodes
+        if not self.finalizer.alive:
+            raise RuntimeError("The workers of the parallel engine have been stopped")
+
+        self.shared_nodes[...] = nodes
+        # Start, end of the spring forces, end of the reduction
+        for _ in range(3):
+            self.barrier.wait()
+        F = self.shared_forces.copy()
+
+        if self.contact is not None:
+            F[self.n_fixtures:] += self.contact.forces(nodes[self.n_fixtures:])
+        return F
+
+
+    def close(self):
+        """
+        Stop the worker processes and free the shared memory
+        """
+
+        if self.finalizer.alive:
+            del self.shared_nodes, self.shared_forces
+            self.finalizer()
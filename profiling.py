@@ -0,0 +1,263 @@
+import contextlib
+import json
+import time
+
+
+"""
+ Profiling
+
+ Opt-in instrumentation of a SpringMassSystem run (sms.profile()).
+ The time spent in every phase (force evaluation, time integration,
+ trajectory recording, energy calculation, file I/O and rendering) is
+ accumulated exclusively: time spent in a nested phase (e.g. the force
+ evaluations of an integrator step) only counts for the nested phase.
+ A callback can be called every N time steps with the progress and an
+ estimate of the remaining time.
+
+ The phases of the time steps are timed by wrapping the functions a time
+ step calls (instrumentSystem()): when profiling is disabled, SpringMassSystem
+ runs its time steps without entering any phase; the remaining phases
+ (energy, I/O, rendering) enter an empty context.
+"""
+
+
+PHASES = ("force", "integrate", "record", "energy", "io", "render")
+
+# Shared empty context for disabled profiling
+_disabled = contextlib.nullcontext()
+
+
+def phase(profiler, name):
+    """
+    Context manager timing phase name with profiler (does nothing if profiler is None)
+    """
+
+    if profiler is None:
+        return _disabled
+    return profiler.phase(name)
+
+
+class Phase:
+    """
+    Initialize a reusable timing context for one phase of a profiler
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+
+    def __enter__(self):
+        self.profiler.push(self.name)
+        return self
+
+
+    def __exit__(self, *exc):
+        self.profiler.pop()
+        return False
+
+
+class Profiler:
+    """
+    Initialize a profiler.
+    Attributes:
+    -callback: function called with the progress dictionary (see progress())
+     every every-th time step and after the last one (optional)
+    -every: number of time steps between callbacks
+    -seconds: time spent in every phase (exclusive of nested phases)
+    -calls: number of times every phase was entered
+    -steps: number of time steps taken
+    """
+
+    def __init__(self, callback = None, every = 1000):
+        if every < 1:
+            raise ValueError("Callback interval must be at least 1 time step")
+        self.callback = callback
+        self.every = every
+        self.phases = {name: Phase(self, name) for name in PHASES}
+        self.reset()
+
+
+    def reset(self):
+        """
+        Clear all timers and counters and start the wall clock
+        """
+
+        self.seconds = {name: 0.0 for name in PHASES}
+        self.calls = {name: 0 for name in PHASES}
+        self.steps = 0
+        self.stack = []
+        self.started = time.perf_counter()
+        self.stopped = None
+
+
+    def stop(self):
+        """
+        Stop the wall clock (end of a run)
+        """
+
+        self.stopped = time.perf_counter()
+
+
+    def elapsed(self):
+        """
+        Wall time since reset() (until stop(), if stopped)
+        """
+
+        return (self.stopped or time.perf_counter()) - self.started
+
+
+    def phase(self, name):
+        """
+        Reusable context manager timing phase name
+        """
+
+        if name not in self.phases:
+            self.phases[name] = Phase(self, name)
+            self.seconds[name] = 0.0
+            self.calls[name] = 0
+        return self.phases[name]
+
+
+    def push(self, name):
+        """
+        Enter phase name
+        """
+
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+
+    def pop(self):
+        """
+        Leave the current phase and add its time, minus the time spent
+        in nested phases, to its timer
+        """
+
+        name, start, nested = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.seconds[name] += elapsed - nested
+        self.calls[name] += 1
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+
+    def timed(self, name, function):
+        """
+        Wrap function so that its calls are timed as phase name
+        """
+
+        timer = self.phase(name)
+
+        def wrapper(*args, **kwargs):
+            with timer:
+                return function(*args, **kwargs)
+
+        return wrapper
+
+
+    def instrument(self, engine):
+        """
+        Time the time steps and force evaluations of a vectorized engine (see engine.py),
+        including the level forces of the multi-rate integrator (see multirate.py).
+        The compiled kernel of the jit engine evaluates its forces within the
+        time steps: they count as integrate (see jit.py)
+        """
+
+        engine.step = self.timed("integrate", engine.step)
+        engine.forces = self.timed("force", engine.forces)
+        integrator = engine.integrator
+        if hasattr(integrator, "levelAcceleration"):
+            # Wrap the method of the class: an integrator reused by the next run is not timed twice
+            integrator.levelAcceleration = self.timed("force", type(integrator).levelAcceleration.__get__(integrator))
+
+
+    def instrumentSystem(self, sms):
+        """
+        Time the phases of the time steps of a SpringMassSystem run
+        (the functions called by SpringMassSystem.update())
+        """
+
+        if sms.state is not None:
+            self.instrument(sms.state)
+        else:
+            sms.springForces = self.timed("force", sms.springForces)
+            sms.eulerStep = self.timed("integrate", sms.eulerStep)
+        sms.recordStep = self.timed("record", sms.recordStep)
+
+
+    def chunk(self, step, n_steps):
+        """
+        Number of the next n_steps time steps (starting after time step step)
+        to run before the next callback is due
+        """
+
+        if self.callback is None:
+            return n_steps
+        return min(n_steps, self.every - step % self.every)
+
+
+    def tick(self, step, timesteps, n_steps = 1):
+        """
+        Count n_steps time steps that ended at time step step
+        and call the callback if it is due
+        """
+
+        self.steps += n_steps
+        if self.callback is not None and (step % self.every == 0 or step == timesteps):
+            self.callback(self.progress(step, timesteps))
+
+
+    def progress(self, step, timesteps):
+        """
+        Progress of a run: current time step, fraction done, elapsed wall time,
+        steps per second and estimated remaining time (seconds)
+        """
+
+        elapsed = self.elapsed()
+        rate = self.steps / elapsed if elapsed > 0 else 0.0
+        return {"step": step,
+                "timesteps": timesteps,
+                "fraction": step / timesteps,
+                "elapsed": elapsed,
+                "steps_per_second": rate,
+                "eta": (timesteps - step) / rate if rate > 0 else float("inf")}
+
+
+    def stats(self):
+        """
+        Timers and counters as a dictionary
+        """
+
+        elapsed = self.elapsed()
+        stepping = sum(self.seconds[name] for name in ("force", "integrate", "record"))
+        return {"seconds": dict(self.seconds),
+                "calls": dict(self.calls),
+                "steps": self.steps,
+                "wall_seconds": elapsed,
+                "other_seconds": max(elapsed - sum(self.seconds.values()), 0.0),
+                "steps_per_second": self.steps / stepping if stepping > 0 else 0.0}
+
+
+    def json(self, path = None):
+        """
+        Timers and counters as a JSON string (also written to path, if given)
+        """
+
+        text = json.dumps(self.stats(), indent = 1)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+
+    def report(self):
+        """
+        Print the time spent in every phase
+        """
+
+        stats = self.stats()
+        print("--- PROFILE ---")
+        for name, seconds in stats["seconds"].items():
+            if stats["calls"][name]:
+                print(f"{name:10s} {seconds:10.4f} s ({seconds / stats['wall_seconds'] * 100:5.1f}%), {stats['calls'][name]} calls")
+        print(f"Wall time: {stats['wall_seconds']:.4f} s, {stats['steps_per_second']:.0f} steps/s")
@@ -0,0 +1,113 @@
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+from engine import pack_system
+
+
+"""
+ Rendering
+
+ Draws the recorded trajectories of a SpringMassSystem after the run.
+ Every mass trajectory is one decimated polyline, and all of them go
+ into a single LineCollection. Springs are drawn as helices at their
+ initial positions from a cached unit helix. Files are written through
+ the Agg canvas, so no display is needed.
+"""
+
+
+# Unit helices (spring along the y axis from 0 to 1) by number of turns
+_helices = {}
+
+
+def decimation(n_points, max_points):
+    """
+    Index of at most max_points of the n_points vertices of a polyline
+    (first and last vertex are kept)
+    """
+
+    if n_points <= max_points:
+        return slice(None)
+    return np.linspace(0, n_points - 1, max_points).round().astype(int)
+
+
+def decimate(path, max_points):
+    """
+    Keep at most max_points vertices of a polyline (first and last vertex are kept)
+    """
+
+    return path[decimation(len(path), max_points)]
+
+
+def helix(turns, points_per_turn = 20, pad = 0.1):
+    """
+    Unit helix with the given number of turns, straight for the first and
+    last pad fraction of its length (cached)
+    """
+
+    if turns not in _helices:
+        w = np.linspace(0, 1, max(turns, 1) * points_per_turn + 1)
+        x = np.zeros_like(w)
+        coil = (w > pad) & (w < 1 - pad)
+        x[coil] = np.sin(2 * np.pi * turns * (w[coil] - pad) / (1 - 2 * pad))
+        _helices[turns] = np.column_stack([x, w])
+    return _helices[turns]
+
+
+def spring_path(p0, p1, r = 0.1):
+    """
+    Vertices of a spring drawn from p0 to p1 with radius r
+    (5 turns per unit length, as in the original plot)
+    """
+
+    d = np.asarray(p1, dtype = float) - np.asarray(p0, dtype = float)
+    l = np.linalg.norm(d)
+    if l == 0:
+        return np.array([p0, p1], dtype = float)
+    unit = helix(5 * int(l))
+    u = d / l
+    n = np.array([u[1], -u[0]])
+    return np.asarray(p0) + np.outer(unit[:, 0] * r, n) + np.outer(unit[:, 1] * l, u)
+
+
+def draw(ax, sms, max_points = 5000, springs = True):
+    """
+    Draw fixtures, trajectories and (initial) springs of a SpringMassSystem into ax
+    """
+
+    positions = sms.recorder.view()
+    fixtures = sms.store.fixtures.data("pos")
+
+    # Trajectories: one decimated polyline per mass in a single collection. Only the kept
+    # records are read (from a trajectory file or compressed recording)
+    kept = np.asarray(positions[decimation(len(positions), max_points)])
+    paths = [kept[:, n] for n in range(kept.shape[1])]
+    ax.add_collection(LineCollection(paths, colors = "blue", linewidths = 0.5))
+
+    # Springs at their initial positions
+    if springs:
+        nodes = np.concatenate([fixtures, positions[0]])
+        arrays = sms.arrays if sms.arrays is not None else pack_system(sms)
+        coils = [spring_path(nodes[i], nodes[j]) for i, j in zip(arrays["i"], arrays["j"])]
+        ax.add_collection(LineCollection(coils, colors = "k", linewidths = 0.5))
+
+    # Fixtures, first (green) and last (red) position of the masses
+    ax.scatter(fixtures[:, 0], fixtures[:, 1], c = "green", s = 100, marker = "H")
+    ax.scatter(positions[0, :, 0], positions[0, :, 1], c = "green", s = 10)
+    ax.scatter(positions[-1, :, 0], positions[-1, :, 1], c = "red", s = 10)
+
+    ax.autoscale_view()
+    ax.set_aspect("equal", adjustable = "datalim")
+
+
+def save(sms, path, max_points = 5000, springs = True, dpi = 150):
+    """
+    Render a SpringMassSystem to an image file (format from the file
+    extension, e.g. .png or .svg) without a display
+    """
+
+    fig = Figure(figsize = (10, 6))
+    FigureCanvasAgg(fig)
+    draw(fig.add_subplot(), sms, max_points, springs)
+    fig.savefig(path, dpi = dpi)
@@ -0,0 +1,143 @@
+import numpy as np
+
+from main import *
+
+
+"""
+ Named test setups
+
+ The setups of test.py as functions returning an unrun SpringMassSystem,
+ so that they can be used by benchmarks without uncommenting code.
+ Keyword arguments are passed on to SpringMassSystem (e.g. engine, integrator).
+"""
+
+
+def pendulum(time = 6, timesteps = 20000, **options):
+    """Pendulum starting from a horizontal position with spring at rest length"""
+
+    f = Fixture(0.0, 10.0)
+    m1 = Mass(1, -10.0, 10.0, 0.0, 0.0)
+    s1 = Spring(10, 5000.0, [f, m1])
+    return SpringMassSystem([f], [m1], [s1], time, timesteps, **options)
+
+
+def double_pendulum(time = 3, timesteps = 12000, **options):
+    """Double pendulum with masses starting at slight displacement"""
+
+    f = Fixture(0.0, 10.0)
+    m1 = Mass(1, -3.0, 3.0, 0.0, 0.0)
+    m2 = Mass(2, -3.0, 2.0, 0.0, 0.0)
+    s1 = Spring(7.615, 5000.0, [f, m1])
+    s2 = Spring(1.0, 5000.0, [m1, m2])
+    return SpringMassSystem([f], [m1, m2], [s1, s2], time, timesteps, **options)
+
+
+def double_pendulum_vertical(time = 6, timesteps = 50000, **options):
+    """Double pendulum with masses starting at vertical position above the fixture"""
+
+    f = Fixture(0.0, 10.0)
+    m1 = Mass(1, 0.0, 13.0, 0.0, 0.0)
+    m2 = Mass(2, 0.0, 16.0, -0.1, 0.0)
+    s1 = Spring(3, 5000.0, [f, m1])
+    s2 = Spring(3, 5000.0, [m1, m2])
+    return SpringMassSystem([f], [m1, m2], [s1, s2], time, timesteps, **options)
+
+
+def triple_pendulum(time = 20, timesteps = 100000, **options):
+    """Triple pendulum with masses starting at vertical position above the fixture"""
+
+    f = Fixture(0.0, 10.0)
+    m1 = Mass(1, 0.0, 13.0, 0.0, 0.0)
+    m2 = Mass(1, 0.0, 16.0, 0.0, 0.0)
+    m3 = Mass(2, -0.1, 19.0, 0.0, 0.0)
+    s1 = Spring(3.0, 5000.0, [f, m1])
+    s2 = Spring(3.0, 5000.0, [m1, m2])
+    s3 = Spring(3.0, 5000.0, [m2, m3])
+    return SpringMassSystem([f], [m1, m2, m3], [s1, s2, s3], time, timesteps, **options)
+
+
+def tethered_chain(time = 5, timesteps = 40000, **options):
+    """Tethered chain of 3 masses connected by springs. Left mass has an initial vertical velocity"""
+
+    f1 = Fixture(0.0, 10.0)
+    f2 = Fixture(12.0, 10.0)
+    m1 = Mass(1, 3, 10, 0.0, 5.0)
+    m2 = Mass(1, 6, 10, 0.0, 0.0)
+    m3 = Mass(1, 9, 10, 0.0, 0.0)
+    s1 = Spring(3, 500.0, [f1, m1])
+    s2 = Spring(3, 5000.0, [m1, m2])
+    s3 = Spring(3, 5000.0, [m2, m3])
+    s4 = Spring(3, 5000.0, [m3, f2])
+    return SpringMassSystem([f1, f2], [m1, m2, m3], [s1, s2, s3, s4], time, timesteps, **options)
+
+
+SCENARIOS = {"pendulum": pendulum,
+             "double_pendulum": double_pendulum,
+             "double_pendulum_vertical": double_pendulum_vertical,
+             "triple_pendulum": triple_pendulum,
+             "tethered_chain": tethered_chain}
+
+
+# -----------------------------------------------
+
+# Synthetic systems of arbitrary size for benchmarks, built from arrays
+# (SpringMassSystem.fromArrays, node indices: fixtures first, then masses)
+
+def chain(n, time = 0.02, timesteps = 200, k = 5000.0, **options):
+    """Horizontal chain of n unit masses between two fixtures, springs at rest length"""
+
+    fixtures = [[0.0, 0.0], [n + 1.0, 0.0]]
+    pos = np.column_stack([np.arange(1.0, n + 1), np.zeros(n)])
+    nodes = np.concatenate([[0], np.arange(2, n + 2), [1]])
+    return SpringMassSystem.fromArrays(fixtures, np.ones(n), pos, np.zeros((n, 2)), nodes[:-1], nodes[1:],
+                                       k, 1.0, time, timesteps, **options)
+
+
+def grid(n, time = 0.02, timesteps = 200, k = 5000.0, **options):
+    """Square cloth of about n unit masses hanging from fixtures above its top row"""
+
+    side = max(int(round(n ** 0.5)), 2)
+    y, x = np.divmod(np.arange(side * side), side)
+    fixtures = np.column_stack([np.arange(side, dtype = float), np.ones(side)])
+    pos = np.column_stack([x, -y]).astype(float)
+
+    # Fixture springs, then a spring to the right and below every mass
+    node = side + np.arange(side * side)
+    right, down = x + 1 < side, y + 1 < side
+    i = np.concatenate([np.arange(side), node[right], node[down]])
+    j = np.concatenate([side + np.arange(side), node[right] + 1, node[down] + side])
+    return SpringMassSystem.fromArrays(fixtures, np.ones(side * side), pos, np.zeros((side * side, 2)), i, j,
+                                       k, 1.0, time, timesteps, **options)
+
+
+def random_graph(n, degree = 4, seed = 0, time = 0.02, timesteps = 200, k = 5000.0, **options):
+    """
+    n unit masses at random positions, each connected to about degree others
+    (springs at rest length), and the 4 highest masses tied to fixtures
+    """
+
+    rng = np.random.default_rng(seed)
+    size = n ** 0.5
+    xy = rng.uniform(0, size, (n, 2))
+
+    # Connect every mass to degree / 2 random partners among its 2 * degree index neighbours
+    # after sorting by x, so springs stay short
+    order = np.argsort(xy[:, 0])
+    i, j = [], []
+    for a in range(n):
+        for b in rng.choice(np.arange(a + 1, min(a + 2 * degree, n)), size = min(degree // 2, n - a - 1), replace = False):
+            i.append(order[a])
+            j.append(order[b])
+
+    top = np.argsort(xy[:, 1])[-4:]
+    fixtures = xy[top] + [0.0, 1.0]
+    i = np.concatenate([np.arange(len(top)), len(top) + np.array(i, dtype = np.intp)])
+    j = np.concatenate([len(top) + top, len(top) + np.array(j, dtype = np.intp)])
+    l0 = np.linalg.norm(np.concatenate([fixtures, xy])[j] - np.concatenate([fixtures, xy])[i], axis = 1)
+    return SpringMassSystem.fromArrays(fixtures, np.ones(n), xy, np.zeros((n, 2)), i, j,
+                                       k, l0, time, timesteps, **options)
+
+
+GENERATORS = {"chain": chain,
+              "grid": grid,
+              "random_graph": random_graph}
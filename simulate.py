@@ -0,0 +1,77 @@
+import argparse
+import json
+
+import loader
+
+
+"""
+ Headless simulation
+
+ Loads a system file (.json, .toml or .npz, see loader.py), runs it without
+ a display and writes the results: the trajectories (binary trajectory file),
+ optionally a plot of the trajectories and a JSON summary with the energy
+ check and the profile of the run.
+
+ Usage:
+ python simulate.py system.toml --out trajectories.traj --plot trajectories.png --summary summary.json
+ python simulate.py system.npz --engine jit --integrator verlet --timesteps 100000
+ python simulate.py system.toml --integrator rk45 --rtol 1e-8 --atol 1e-10
+ python simulate.py system.npz --engine parallel --workers 4 --integrator verlet
+"""
+
+
+def simulate(path, out = None, plot = None, summary = None, profile = False, **options):
+    """
+    Load a system from path, run it and write the requested outputs.
+    Keyword arguments override the simulation settings of the file.
+    Returns the system.
+    """
+
+    if out is not None:
+        # Record directly into the output file
+        options.update(save = True, save_path = out)
+    sms = loader.load(path, **options)
+    if profile or summary is not None:
+        sms.profile()
+    sms.run()
+
+    if plot is not None:
+        sms.plot(plot)
+    if summary is not None:
+        with open(summary, "w") as f:
+            json.dump({"system": path,
+                       "masses": len(sms.masses),
+                       "springs": len(sms.springs),
+                       "settings": loader.settings(sms),
+                       "energy": {"initial": sms.E_i,
+                                  "final": sms.E_f,
+                                  "deviation": sms.E_div,
+                                  "max_drift": sms.E_drift},
+                       "profile": sms.profiler.stats()}, f, indent = 1)
+    return sms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run a spring mass system from a file without a display")
+    parser.add_argument("system", help = "system file (.json, .toml or .npz)")
+    parser.add_argument("--out", help = "trajectory file to write")
+    parser.add_argument("--plot", help = "image file of the trajectories (e.g. .png or .svg)")
+    parser.add_argument("--summary", help = "JSON file with energies and profile")
+    parser.add_argument("--profile", action = "store_true", help = "print the time spent in every phase")
+    parser.add_argument("--time", type = float)
+    parser.add_argument("--timesteps", type = int)
+    parser.add_argument("--engine", choices = ["python", "numpy", "jit", "parallel"])
+    parser.add_argument("--workers", type = int, help = "worker processes of the parallel engine")
+    parser.add_argument("--integrator")
+    parser.add_argument("--rtol", type = float, help = "relative tolerance of the rk45 integrator")
+    parser.add_argument("--atol", type = float, help = "absolute tolerance of the rk45 integrator")
+    parser.add_argument("--record-every", type = int)
+    args = parser.parse_args()
+
+    # Only settings given on the command line override the file
+    options = {name: value for name, value in (("time", args.time), ("timesteps", args.timesteps),
+                                               ("engine", args.engine), ("workers", args.workers),
+                                               ("integrator", args.integrator),
+                                               ("rtol", args.rtol), ("atol", args.atol),
+                                               ("record_every", args.record_every)) if value is not None}
+    simulate(args.system, args.out, args.plot, args.summary, args.profile, **options)
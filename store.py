@@ -0,0 +1,387 @@
+import numpy as np
+
+
+"""
+ Array store
+
+ Keeps the data of all fixtures, masses and springs of a system in
+ growable arrays (one array per field), so that the Fixture, Mass and
+ Spring objects (main.py) are small handles holding only their store
+ and their index. Attributes of a handle (e.g. Mass.pos) are views into
+ the arrays of its store.
+
+ Handles are created lazily: systems built from arrays
+ (SpringMassSystem.fromArrays) only create a Python object for an
+ element when it is accessed.
+"""
+
+
+class Pool:
+    """
+    Initialize a pool of elements of one kind.
+    Attributes:
+    -store: store the pool belongs to
+    -name: name of the pool in its store
+    -cls: handle class of the elements
+    -arrays: one array per field, first axis = element (capacity >= count)
+    -count: number of elements
+    -handles: handle of every element (None until created)
+    -released: indices of the elements whose handles moved to another store
+     (see release())
+
+    Elements appended one at a time (by the constructors of the handles) are
+    buffered and written into the arrays in bulk when the arrays are accessed.
+    """
+
+    def __init__(self, store, name, cls, fields, capacity = 16):
+        self.store = store
+        self.name = name
+        self.cls = cls
+        self.columns = {name: np.zeros((capacity,) + shape, dtype = dtype) for name, (shape, dtype) in fields.items()}
+        self.count = 0
+        self.handles = []
+        self.pending = []
+        self.released = []
+
+
+    def __len__(self):
+        return self.count
+
+
+    @property
+    def arrays(self):
+        if self.pending:
+            self.flush()
+        return self.columns
+
+
+    def flush(self):
+        """
+        Write the buffered elements into the arrays
+        """
+
+        pending, self.pending = self.pending, []
+        start = self.count - len(pending)
+        self.reserve(start, len(pending))
+        for name, a in self.columns.items():
+            try:
+                a[start:self.count] = [row[name] for row in pending]
+            except KeyError:
+                # Fields not given are zero
+                a[start:self.count] = 0
+                rows = [n for n, row in enumerate(pending) if name in row]
+                if rows:
+                    a[start + np.array(rows, dtype = np.intp)] = [pending[n][name] for n in rows]
+
+
+    def data(self, name):
+        """
+        Values of field name of all elements (view)
+        """
+
+        return self.arrays[name][:self.count]
+
+
+    def reserve(self, count, n):
+        """
+        Grow the arrays (by doubling) to hold at least count + n elements,
+        keeping the first count
+        """
+
+        capacity = len(next(iter(self.columns.values())))
+        if count + n <= capacity:
+            return
+        capacity = max(2 * capacity, count + n)
+        for name, a in self.columns.items():
+            grown = np.zeros((capacity,) + a.shape[1:], dtype = a.dtype)
+            grown[:count] = a[:count]
+            self.columns[name] = grown
+
+
+    def extend(self, n, **values):
+        """
+        Append n elements with the given field values (arrays of n values,
+        or values broadcast to n elements). Returns the index of the first one.
+        """
+
+        if self.pending:
+            self.flush()
+        self.reserve(self.count, n)
+        start = self.count
+        for name, value in values.items():
+            self.columns[name][start:start + n] = value
+        self.count += n
+        self.handles.extend([None] * n)
+        return start
+
+
+    def append(self, handle, **values):
+        """
+        Append one element (buffered) and bind handle to it
+        """
+
+        handle.store = self.store
+        handle.index = self.count
+        self.count += 1
+        self.pending.append(values)
+        self.handles.append(handle)
+
+
+    def adopt(self, handles):
+        """
+        Move handles of other stores into this pool: their values are copied
+        (in bulk per source store) and the handles are bound to the new elements
+        """
+
+        stores = [h.store for h in handles]
+        indices = [h.index for h in handles]
+        if any(store is self.store for store in stores):
+            raise ValueError("Object is already part of the system")
+
+        # Usually all handles come from one store (DETACHED)
+        groups = {}
+        if stores and all(store is stores[0] for store in stores):
+            groups[id(stores[0])] = (stores[0], np.arange(len(handles)), indices)
+        else:
+            for n, (store, index) in enumerate(zip(stores, indices)):
+                group = groups.setdefault(id(store), (store, [], []))
+                group[1].append(n)
+                group[2].append(index)
+
+        start = self.extend(len(handles))
+        for store, targets, sources in groups.values():
+            source = getattr(store, self.name).arrays
+            for name, a in self.columns.items():
+                a[start + np.array(targets, dtype = np.intp)] = source[name][sources]
+
+        for n, h in enumerate(handles):
+            h.store = self.store
+            h.index = start + n
+        self.handles[start:] = handles
+
+        for store, targets, sources in groups.values():
+            store.release(self.name, sources)
+
+
+    def handle(self, n):
+        """
+        Handle of element n (created on first access)
+        """
+
+        h = self.handles[n]
+        if h is None:
+            h = self.cls.__new__(self.cls)
+            h.store = self.store
+            h.index = n
+            self.handles[n] = h
+        return h
+
+
+    def delete(self, n):
+        """
+        Remove element n; the following elements move up by one
+        """
+
+        for a in self.arrays.values():
+            a[n:self.count - 1] = a[n + 1:self.count]
+        self.count -= 1
+        del self.handles[n]
+        for h in self.handles[n:]:
+            if h is not None:
+                h.index -= 1
+
+
+    def permute(self, order):
+        """
+        Reorder the elements so that new element n is old element order[n]
+        """
+
+        for name, a in self.arrays.items():
+            a[:self.count] = a[:self.count][order]
+        self.handles = [self.handles[n] for n in order]
+        for n, h in enumerate(self.handles):
+            if h is not None:
+                h.index = n
+
+
+    def release(self, indices):
+        """
+        Mark elements whose handles moved to another store as free, and remove
+        the free elements once they are at least half of the elements.
+        Returns the new index of every old element (-1: removed) if the
+        elements were removed, None otherwise.
+        """
+
+        self.released.extend(indices)
+        if 2 * len(self.released) < self.count:
+            return None
+        return self.compact()
+
+
+    def compact(self):
+        """
+        Remove the free elements (see release()), shrinking the arrays;
+        the other elements keep their order. Returns the new index of
+        every old element (-1: removed).
+        """
+
+        arrays = self.arrays
+        keep = np.ones(self.count, dtype = bool)
+        keep[np.array(self.released, dtype = np.intp)] = False
+        remap = np.full(self.count, -1, dtype = np.intp)
+        remap[keep] = np.arange(np.count_nonzero(keep))
+
+        count = int(np.count_nonzero(keep))
+        capacity = max(16, 2 * count)
+        for name, a in arrays.items():
+            compacted = np.zeros((capacity,) + a.shape[1:], dtype = a.dtype)
+            compacted[:count] = a[:self.count][keep]
+            self.columns[name] = compacted
+        self.handles = [h for h, kept in zip(self.handles, keep) if kept]
+        for n, h in enumerate(self.handles):
+            if h is not None:
+                h.index = n
+        self.count = count
+        self.released = []
+        return remap
+
+
+    def clear(self):
+        """
+        Remove all elements
+        """
+
+        for name, a in self.columns.items():
+            self.columns[name] = np.zeros((16,) + a.shape[1:], dtype = a.dtype)
+        self.count = 0
+        self.handles = []
+        self.pending = []
+        self.released = []
+
+
+class Handles:
+    """
+    Initialize a read-only sequence of the handles of a pool
+    (used for SpringMassSystem.fixtures, .masses and .springs)
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+
+    def __len__(self):
+        return self.pool.count
+
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self.pool.handle(i) for i in range(*n.indices(self.pool.count))]
+        if n < 0:
+            n += self.pool.count
+        if not 0 <= n < self.pool.count:
+            raise IndexError("Handle index out of range")
+        return self.pool.handle(n)
+
+
+    def __iter__(self):
+        for n in range(self.pool.count):
+            yield self.pool.handle(n)
+
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+
+    def __contains__(self, h):
+        return getattr(h, "store", None) is self.pool.store and isinstance(h, self.pool.cls)
+
+
+    def index(self, h):
+        if h not in self:
+            raise ValueError("Object is not part of the system")
+        return h.index
+
+
+class Store:
+    """
+    Initialize an array store.
+    Attributes:
+    -fixtures: pool of fixtures (field pos)
+    -masses: pool of masses (fields m, pos, v, f)
+    -springs: pool of springs (fields k, l0, and the ends: kind (0: fixture, 1: mass)
+     and index of the end in its pool)
+    -recorder: trajectory buffer of the last run (see trajectory.py)
+    """
+
+    def __init__(self, fixture, mass, spring):
+        self.fixtures = Pool(self, "fixtures", fixture, {"pos": ((2,), float)})
+        self.masses = Pool(self, "masses", mass, {"m": ((), float), "pos": ((2,), float),
+                                                  "v": ((2,), float), "f": ((2,), float)})
+        self.springs = Pool(self, "springs", spring, {"k": ((), float), "l0": ((), float),
+                                                      "kind": ((2,), np.int8), "end": ((2,), np.intp)})
+        self.recorder = None
+
+
+    def pool(self, kind):
+        """
+        Pool of the fixtures (kind 0) or of the masses (kind 1)
+        """
+
+        return self.masses if kind else self.fixtures
+
+
+    def node(self, kind, n):
+        """
+        Handle of fixture (kind 0) or mass (kind 1) n
+        """
+
+        return self.pool(kind).handle(n)
+
+
+    def nodeIndex(self):
+        """
+        Node indices (fixtures first, then masses) of the two ends of every spring
+        """
+
+        kind, end = self.springs.data("kind"), self.springs.data("end")
+        return np.where(kind == 1, self.fixtures.count + end, end)
+
+
+    def attached(self, kind, n):
+        """
+        [other end, spring constant, rest length] of every spring attached to fixture
+        (kind 0) or mass (kind 1) n
+        """
+
+        kinds, ends = self.springs.data("kind"), self.springs.data("end")
+        result = []
+        for s, side in zip(*np.nonzero((kinds == kind) & (ends == n))):
+            result.append([self.node(kinds[s, 1 - side], ends[s, 1 - side]),
+                           float(self.springs.data("k")[s]), float(self.springs.data("l0")[s])])
+        return result
+
+
+    def release(self, name, indices):
+        """
+        Free the elements (indices) of pool name whose handles moved to another
+        store (see Pool.release()), so that a store whose objects keep moving
+        away (DETACHED) does not grow. Springs whose ends were removed no
+        longer refer to them.
+        """
+
+        remap = getattr(self, name).release(indices)
+        if remap is None or name == "springs":
+            return
+        kinds, ends = self.springs.data("kind"), self.springs.data("end")
+        at = kinds == int(name == "masses")
+        ends[at] = remap[ends[at]]
+        kinds[(ends == -1).any(axis = 1)] = -1
+
+
+    def clear(self):
+        """
+        Remove all elements
+        """
+
+        for pool in (self.fixtures, self.masses, self.springs):
+            pool.clear()
@@ -25,7 +25,7 @@ f = create_fixture(0.0, 10.0)
 m1 = create_mass(1, -10.0, 10.0, 0.0, 0.0)
 s1 = create_spring(10, 5000.0, [f, m1])
 sms = create_system([f], [m1], [s1], 6, 20000)
-sms[0].run()
+sms[0].run(plot = True)
 """
 
 """
@@ -37,7 +37,7 @@ m2 = create_mass(2, -3.0, 2.0, 0.0, 0.0)
 s1 = create_spring(7.615, 5000.0, [f, m1])
 s2 = create_spring(1.0, 5000.0, [m1, m2])
 sms = create_system([f], [m1, m2], [s1, s2], 3, 12000)
-sms[0].run()
+sms[0].run(plot = True)
 """
 
 """
@@ -50,7 +50,7 @@ m2 = create_mass(2, 0.0, 16.0, -0.1, 0.0)
 s1 = create_spring(3, 5000.0, [f, m1])
 s2 = create_spring(3, 5000.0, [m1, m2])
 sms = create_system([f], [m1, m2], [s1, s2], 6, 50000)
-sms[0].run()
+sms[0].run(plot = True)
 """
 
 """
@@ -65,7 +65,7 @@ s1 = create_spring(3.0, 5000.0, [f, m1])
 s2 = create_spring(3.0, 5000.0, [m1, m2])
 s3 = create_spring(3.0, 5000.0, [m2, m3])
 sms = create_system([f], [m1, m2, m3], [s1, s2, s3], 20, 100000)
-sms[0].run()
+sms[0].run(plot = True)
 """
 
 """
@@ -82,8 +82,564 @@ s2 = create_spring(3, 5000.0, [m1, m2])
 s3 = create_spring(3, 5000.0, [m2, m3])
 s4 = create_spring(3, 5000.0, [m3, f2])
 sms = create_system([f1, f2], [m1, m2, m3], [s1, s2, s3, s4], 5, 40000)
-sms[0].run()
+sms[0].run(plot = True)
 """
 
 
 
+# BEHAVIOR TESTS (run them with: python test.py)
+
+import os
+import tempfile
+
+
+def create_chain(timesteps = 400, time = 0.2, **options):
+    """Tethered chain of 3 masses (setup 3) with a short run"""
+    f1 = create_fixture(0.0, 10.0)
+    f2 = create_fixture(12.0, 10.0)
+    m1 = create_mass(1, 3, 10, 0.0, 5.0)
+    m2 = create_mass(1, 6, 10, 0.0, 0.0)
+    m3 = create_mass(1, 9, 10, 0.0, 0.0)
+    s1 = create_spring(3, 500.0, [f1, m1])
+    s2 = create_spring(3, 5000.0, [m1, m2])
+    s3 = create_spring(3, 5000.0, [m2, m3])
+    s4 = create_spring(3, 5000.0, [m3, f2])
+    return SpringMassSystem([f1, f2], [m1, m2, m3], s1 + s2 + s3 + s4, time, timesteps, **options)
+
+
+def test_save_velocities():
+    sms = create_chain(engine = "numpy", integrator = "verlet")
+    sms.run()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chain.traj")
+        sms.save(path)
+        f = TrajectoryFile.open(path)
+        assert f.count == sms.recorder.count
+        assert np.array_equal(f.positions[:f.count], sms.recorder.view("positions"))
+        assert np.array_equal(f.velocities[:f.count], sms.recorder.view("velocities"))
+        del f
+
+
+def test_detached_store_bounded():
+    import main
+    lonely = create_mass(1, 0.0, 0.0, 0.0, 0.0)
+    f = create_fixture(0.0, 0.0)
+    m = create_mass(1, 1.0, 0.0, 0.0, 0.0)
+    s = create_spring(1.0, 10.0, [f, m])
+    for _ in range(200):
+        create_chain(timesteps = 10)
+    detached = main.DETACHED
+    assert detached.masses.count <= 8 and len(detached.masses.columns["pos"]) <= 32
+    assert detached.springs.count <= 8 and detached.fixtures.count <= 8
+    assert np.array_equal(lonely.pos, [0.0, 0.0]) and np.array_equal(m.pos, [1.0, 0.0])
+    assert m.attached[0][0] is f and f.attached[0][0] is m
+    sms = create_system([f], [m], [s], 1, 10)
+    assert sms[0].springs[0].conn == [f, m]
+
+
+def test_profiled_run_matches():
+    for engine, integrator in (("python", "euler"), ("numpy", "verlet"), ("numpy", "multirate")):
+        plain = create_chain(engine = engine, integrator = integrator)
+        plain.run()
+        profiled = create_chain(engine = engine, integrator = integrator)
+        profiler = profiled.profile(every = 100)
+        profiled.run()
+        assert np.array_equal(plain.recorder.view(), profiled.recorder.view())
+        assert profiler.calls["integrate"] >= profiled.timesteps
+        assert profiler.calls["record"] == profiled.timesteps
+        assert profiler.calls["force"] >= profiled.timesteps
+
+
+def test_final_state_recorded():
+    sms = create_chain(timesteps = 400, record_every = 8, engine = "numpy", integrator = "verlet")
+    sms.run()
+    assert sms.recorder.count == 51
+    assert np.array_equal(sms.recorder.view()[-1], sms.positions())
+    try:
+        create_chain(timesteps = 400, record_every = 7)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("record_every must divide the number of time steps")
+
+
+def test_rk45_dense_output():
+    # The internal steps do not depend on the output grid and may be longer than a time step
+    coarse = create_chain(timesteps = 20, integrator = "rk45", rtol = 1e-9, atol = 1e-12)
+    coarse.run()
+    fine = create_chain(timesteps = 2000, integrator = "rk45", rtol = 1e-9, atol = 1e-12)
+    fine.run()
+    assert fine.state.integrator.n_steps < fine.timesteps
+    assert abs(coarse.state.integrator.n_steps - fine.state.integrator.n_steps) <= 2
+    assert np.allclose(coarse.recorder.view(), fine.recorder.view()[::100], atol = 1e-6)
+
+    loose = create_chain(timesteps = 20, integrator = "rk45", rtol = 1e-4, atol = 1e-7)
+    loose.run()
+    assert loose.state.integrator.n_steps < coarse.state.integrator.n_steps
+    try:
+        create_chain(integrator = "verlet", rtol = 1e-4)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Tolerances only apply to the rk45 integrator")
+
+
+def test_stream_matches_run():
+    for integrator in ("euler", "symplectic_euler", "verlet", "rk4", "rk45"):
+        sms = create_chain(integrator = integrator)
+        sms.run()
+        streamed = create_chain(integrator = integrator)
+        chunks = list(streamed.stream(chunk_size = 7))
+        positions = np.concatenate([chunk["positions"] for chunk in chunks])
+        steps = np.concatenate([chunk["steps"] for chunk in chunks])
+        assert np.array_equal(steps, np.arange(sms.timesteps + 1))
+        assert np.array_equal(positions, sms.recorder.view()), integrator
+
+
+def test_ensemble_batches():
+    from ensemble import Ensemble
+    sms = create_chain(integrator = "rk45", rtol = 1e-7)
+    ensemble = Ensemble(sms, {"k": np.linspace(100.0, 900.0, 6), "m": [1.0, 2.0, 1.0, 2.0, 1.0, 2.0]})
+    assert ensemble.integrator == "rk45" and ensemble.tolerances == {"rtol": 1e-7}
+    single = ensemble.run(batch_size = 1, workers = 1)
+    for batch_size in (4, 6):
+        assert np.allclose(ensemble.run(batch_size = batch_size, workers = 1), single, rtol = 0, atol = 1e-12)
+
+
+def test_checkpoint_resume():
+    for engine, integrator in (("python", "euler"), ("numpy", "verlet"), ("numpy", "rk45")):
+        sms = create_chain(engine = engine, integrator = integrator)
+        sms.run()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "chain.ckpt")
+            crashed = create_chain(engine = engine, integrator = integrator)
+            crashed.autosave(path, every = 50)
+            crashed.start()
+            crashed.advance(80)
+            size = os.path.getsize(path)
+            crashed.advance(150)
+            # Only the records since the previous checkpoint are written
+            assert os.path.getsize(path) == size
+
+            # Crash again after more checkpoints of the resumed run
+            resumed = create_chain(engine = engine, integrator = integrator)
+            resumed.autosave(path, every = 50)
+            resumed.resume()
+            assert resumed.step == 200
+            resumed.advance(120)
+            resumed = create_chain(engine = engine, integrator = integrator)
+            resumed.resume(path)
+            assert resumed.step == 300
+            resumed.run()
+            assert np.array_equal(resumed.recorder.view(), sms.recorder.view())
+            assert np.array_equal(resumed.recorder.view("velocities"), sms.recorder.view("velocities"))
+
+
+def test_compression_error_bound():
+    import compression
+    sms = create_chain(timesteps = 2000, time = 1.0, engine = "numpy", integrator = "verlet")
+    sms.run()
+    for method in ("linear", "hermite"):
+        compressed = create_chain(timesteps = 2000, time = 1.0, engine = "numpy", integrator = "verlet")
+        compressed.compress(1e-3, method = method, vtol = 1e-2)
+        compressed.run()
+        recorder = compressed.recorder
+        assert recorder.n_samples < recorder.count * recorder.n_masses
+        assert np.abs(np.array(recorder.view()) - sms.recorder.view()).max() <= 1e-3
+        assert np.abs(np.array(recorder.view("velocities")) - sms.recorder.view("velocities")).max() <= 1e-2
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "chain.traj")
+            compressed.save(path)
+            assert np.array_equal(np.array(compression.load(path).view()), np.array(recorder.view()))
+
+
+def test_result_cache():
+    from cache import ResultCache
+    def chain(timesteps, k = 5000.0):
+        sms = create_chain(timesteps = timesteps, time = 0.0005 * timesteps, engine = "numpy", integrator = "verlet")
+        sms.springs[1].k = k
+        return sms
+
+    full = chain(400)
+    full.run()
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory)
+        first = chain(200)
+        first.run(cache = cache)
+        assert (cache.hits, cache.misses, cache.resumed) == (0, 1, 0)
+
+        # Identical and shorter runs are read from the cache
+        again = chain(200)
+        again.run(cache = cache)
+        shorter = chain(100)
+        shorter.run(cache = cache)
+        assert cache.hits == 2
+        assert np.array_equal(again.recorder.view(), first.recorder.view())
+        assert np.array_equal(shorter.positions(), full.recorder.view()[100])
+
+        # A longer run continues the cached one, with the same results as a fresh run
+        longer = chain(400)
+        longer.run(cache = cache)
+        assert cache.resumed == 1 and len(cache.index) == 1
+        assert np.array_equal(longer.recorder.view(), full.recorder.view())
+        assert np.array_equal(longer.recorder.view("velocities"), full.recorder.view("velocities"))
+
+        # The least recently used results are evicted, the latest one is kept
+        cache.max_bytes = cache.size() + 1
+        chain(400, k = 4000.0).run(cache = cache)
+        assert len(cache.index) == 1 and cache.size() > 0
+        assert len([name for name in os.listdir(directory) if name.endswith(".traj")]) == 1
+
+
+def test_abandoned_stream():
+    for engine, integrator in (("python", "euler"), ("numpy", "verlet")):
+        sms = create_chain(engine = engine, integrator = integrator)
+        sms.run()
+        abandoned = create_chain(engine = engine, integrator = integrator)
+        chunks = abandoned.stream(chunk_size = 10)
+        next(chunks)
+        next(chunks)
+        chunks.close()
+        abandoned.run()
+        assert abandoned.recorder.count == sms.timesteps + 1
+        assert np.array_equal(abandoned.recorder.view(), sms.recorder.view())
+        assert abandoned.E_f == sms.E_f
+
+        # A stream closed early is continued by the next stream
+        continued = create_chain(engine = engine, integrator = integrator)
+        chunks = continued.stream(chunk_size = 10)
+        first = [next(chunks), next(chunks)]
+        chunks.close()
+        rest = list(continued.stream(chunk_size = 10))
+        positions = np.concatenate([chunk["positions"] for chunk in first + rest])
+        assert np.array_equal(positions, sms.recorder.view())
+
+
+def test_multirate_without_springs():
+    # Free masses colliding under gravity: only level 0 (gravity and contact)
+    def free_masses(integrator):
+        masses = [create_mass(1, x, 10.0, vx, 0.0) for x, vx in ((0.0, 1.0), (0.5, 0.0), (1.0, -1.0))]
+        sms = SpringMassSystem([], masses, [], 0.5, 200, integrator = integrator)
+        sms.collisions(0.3, 1000.0)
+        sms.run()
+        return sms
+
+    multirate = free_masses("multirate")
+    verlet = free_masses("verlet")
+    assert multirate.state.integrator.stats()["levels"] == [0]
+    assert np.allclose(multirate.recorder.view(), verlet.recorder.view(), rtol = 0, atol = 1e-12)
+
+
+def test_incremental_topology():
+    def same(a, b):
+        for name in ("i", "j", "k", "l0", "indptr", "indices", "edges"):
+            assert np.array_equal(getattr(a, name), getattr(b, name)), name
+
+    sms = create_chain()
+    m1, m2, m3 = sms.masses
+    f1, f2 = sms.fixtures
+    extra = create_spring(4.0, 100.0, [m3, m1]) + create_spring(5.0, 100.0, [f2, m2])
+    sms.compile()
+    sms.reorder()
+    for spring in extra:
+        sms.addSpring(spring)
+        same(sms.topology, Topology.fromSystem(sms))
+    sms.removeSpring(sms.springs[1])
+    same(sms.topology, Topology.fromSystem(sms))
+    sms.addSpring(create_spring(6.0, 100.0, [m2, f1])[0])
+    same(sms.topology, Topology.fromSystem(sms))
+    sms.run()
+
+
+def test_profiled_multirate_forces():
+    # The level forces of the multi-rate integrator are timed once, in every run
+    sms = create_chain(integrator = "multirate")
+    profiler = sms.profile()
+    for _ in range(2):
+        sms.run()
+        assert profiler.calls["force"] == sms.state.integrator.n_force_evals + 1
+        assert profiler.calls["integrate"] == sms.timesteps
+
+
+def test_render_decimated():
+    import render
+    from matplotlib.figure import Figure
+    for compress in (False, True):
+        sms = create_chain(timesteps = 2000, time = 1.0, engine = "numpy", integrator = "verlet")
+        if compress:
+            sms.compress(1e-3)
+        sms.run()
+        positions = np.array(sms.recorder.view())
+        ax = Figure().add_subplot()
+        render.draw(ax, sms, max_points = 50, springs = False)
+        paths = ax.collections[0].get_segments()
+        assert len(paths) == len(sms.masses)
+        for n, path in enumerate(paths):
+            assert np.allclose(path, render.decimate(positions[:, n], 50))
+            assert len(path) == 50 and np.allclose(path[-1], positions[-1, n])
+
+
+def test_vector_engine_matches_python():
+    python = create_chain(engine = "python")
+    python.run()
+    vector = create_chain(engine = "numpy", integrator = "euler")
+    vector.run()
+    for field in ("positions", "velocities"):
+        assert np.allclose(vector.recorder.view(field), python.recorder.view(field), rtol = 0, atol = 1e-12)
+
+    # A batch of systems with different spring constants advances like the single systems
+    arrays = pack_system(vector)
+    k = np.stack([arrays["k"], 2 * arrays["k"]])
+    batch = VectorEngine(**dict(arrays, k = k))
+    singles = [VectorEngine(**dict(arrays, k = row)) for row in k]
+    for engine in [batch] + singles:
+        for _ in range(100):
+            engine.step(vector.delta_t)
+    assert np.allclose(batch.pos, [single.pos for single in singles], rtol = 0, atol = 1e-12)
+
+
+def test_trajectory_file_streamed():
+    sms = create_chain(record_every = 4, engine = "numpy", integrator = "verlet")
+    sms.run()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chain.traj")
+        saved = create_chain(record_every = 4, engine = "numpy", integrator = "verlet", save = True, save_path = path)
+        saved.run()
+        f = TrajectoryFile.open(path)
+        assert f.count == sms.recorder.count == 101 and f.stride == 4
+        assert np.array_equal(f.window(), sms.recorder.view())
+        assert np.array_equal(f.window(10, 20, [0, 2], "velocities"), sms.recorder.view("velocities")[10:20, [0, 2]])
+        assert np.allclose(f.times()[-1], saved.time)
+        del f
+
+
+def test_implicit_order():
+    reference = create_chain(timesteps = 50, integrator = "rk45", rtol = 1e-11, atol = 1e-13)
+    reference.run()
+    for integrator, order in (("backward_euler", 1), ("trapezoidal", 2)):
+        errors = []
+        for timesteps in (100, 200, 400):
+            sms = create_chain(timesteps = timesteps, integrator = integrator)
+            sms.run()
+            errors.append(np.abs(sms.positions() - reference.positions()).max())
+        for coarse, fine in zip(errors, errors[1:]):
+            assert abs(np.log2(coarse / fine) - order) < 0.2, integrator
+
+    # Backward Euler stays stable (and damps) with time steps of several periods of the stiff springs
+    sms = create_chain(timesteps = 10, time = 2.0, integrator = "backward_euler")
+    sms.run()
+    assert np.abs(sms.state.v).max() < 0.1 and sms.state.integrator.stats()["rejected"] == 0
+
+
+def test_animator_frames():
+    from animator import Animator
+    from matplotlib.figure import Figure
+    sms = create_chain(engine = "numpy", integrator = "verlet")
+    sms.run()
+    animated = create_chain(engine = "numpy", integrator = "verlet")
+    animator = Animator(animated, trail = 5, fps = 50)
+    animator.setup(Figure(), blit = False)
+    # Every frame advances the simulation to the time of the frame
+    for frame in range(1, 8):
+        pos = animator.advance(frame / animator.fps)
+        assert animated.step == frame * 40
+        assert np.array_equal(pos, sms.recorder.view()[animated.step])
+        animator.draw(pos)
+    # The trail holds the positions of the last 5 frames of every mass, oldest first
+    x, y = animator.trails.get_data()
+    trail = np.column_stack([x, y]).reshape(len(pos), 6, 2)[:, :5]
+    assert np.array_equal(trail.transpose(1, 0, 2), sms.recorder.view()[120:281:40])
+    animator.advance(1.0)
+    assert animator.done and np.array_equal(animated.recorder.view(), sms.recorder.view())
+
+
+def test_system_files():
+    import json
+    import loader
+    from simulate import simulate
+    sms = create_chain(record_every = 2, engine = "numpy", integrator = "rk45", rtol = 1e-8)
+    arrays = pack_system(sms)
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in (".json", ".npz"):
+            path = os.path.join(directory, "chain" + extension)
+            loader.save(sms, path)
+            loaded = loader.load(path)
+            assert loader.settings(loaded) == loader.settings(sms), extension
+            for name, array in pack_system(loaded).items():
+                assert np.array_equal(array, arrays[name]), (extension, name)
+
+        # The headless run of a system file records the same trajectory
+        path = os.path.join(directory, "chain.toml")
+        with open(path, "w") as f:
+            f.write("fixtures = [[0.0, 10.0]]\n"
+                    "masses = [[1, -10.0, 10.0, 0.0, 0.0]]\n"
+                    "springs = [[10, 5000.0, \"f0\", \"m0\"]]\n"
+                    "[simulation]\ntime = 0.1\ntimesteps = 200\nintegrator = \"verlet\"\n")
+        out, summary = os.path.join(directory, "pendulum.traj"), os.path.join(directory, "summary.json")
+        simulate(path, out = out, summary = summary)
+        f = create_fixture(0.0, 10.0)
+        m = create_mass(1, -10.0, 10.0, 0.0, 0.0)
+        pendulum = SpringMassSystem([f], [m], create_spring(10, 5000.0, [f, m]), 0.1, 200, integrator = "verlet")
+        pendulum.run()
+        assert np.array_equal(TrajectoryFile.open(out).window(), pendulum.recorder.view())
+        with open(summary) as f:
+            assert json.load(f)["settings"]["timesteps"] == 200
+
+
+def test_contact_matches_brute_force():
+    from contact import Contact
+    def brute_force(pos, radius, stiffness):
+        F = np.zeros_like(pos)
+        for a in range(len(pos)):
+            for b in range(a + 1, len(pos)):
+                d = pos[b] - pos[a]
+                l = np.sqrt(d @ d)
+                if 0 < l < 2 * radius:
+                    f = stiffness * (2 * radius - l) / l * d
+                    F[b] += f
+                    F[a] -= f
+        return F
+
+    rng = np.random.default_rng(1)
+    pos = rng.uniform(0.0, 10.0, (300, 2))
+    contact = Contact(0.3, 1000.0)
+    for _ in range(5):
+        assert np.allclose(contact.forces(pos), brute_force(pos, 0.3, 1000.0), rtol = 0, atol = 1e-9)
+        # Small moves reuse the pair list, large ones rebuild it
+        pos = pos + rng.normal(0.0, 0.02, pos.shape)
+    assert 1 < contact.n_builds < 5 and contact.n_contacts > 0
+
+
+def test_parallel_forces_match():
+    from parallel import ParallelEngine
+    # Random graph of 5 fixtures and 200 masses
+    rng = np.random.default_rng(2)
+    i, j = rng.integers(0, 205, (2, 600))
+    i, j = i[i != j], j[i != j]
+    arrays = dict(fixtures_pos = rng.uniform(0.0, 10.0, (5, 2)), m = rng.uniform(1.0, 2.0, 200),
+                  pos = rng.uniform(0.0, 10.0, (200, 2)), v = np.zeros((200, 2)),
+                  i = i, j = j, k = rng.uniform(100.0, 1000.0, len(i)), l0 = rng.uniform(0.5, 2.0, len(i)))
+    numpy_engine = VectorEngine(**arrays)
+    for workers in (1, 3):
+        parallel = ParallelEngine(**arrays, workers = workers)
+        for _ in range(3):
+            nodes = numpy_engine.nodes + rng.normal(0.0, 0.1, numpy_engine.nodes.shape)
+            assert np.allclose(parallel.forces(nodes), numpy_engine.forces(nodes), rtol = 1e-12, atol = 1e-9)
+        parallel.close()
+
+    sms = create_chain(engine = "numpy", integrator = "rk4")
+    sms.run()
+    parallel = create_chain(engine = "parallel", integrator = "rk4", workers = 2)
+    parallel.run()
+    assert np.allclose(parallel.recorder.view(), sms.recorder.view(), rtol = 0, atol = 1e-12)
+
+
+def test_equilibrium_at_rest():
+    sms = create_chain(engine = "numpy", integrator = "verlet")
+    result = sms.equilibrium()
+    engine = VectorEngine(**pack_system(sms))
+    weight = np.max(engine.m) * abs(sms.g)
+    assert result["residual"] <= 1e-9 * max(weight, 5000.0)
+    assert np.abs(engine.acceleration()).max() <= 1e-6
+    # A run started at the equilibrium stays there
+    sms.run()
+    assert np.abs(sms.recorder.view() - result["pos"]).max() < 1e-9
+
+    # Far from the equilibrium: pendulum starting horizontally at rest length
+    f = create_fixture(0.0, 10.0)
+    m = create_mass(1, -10.0, 10.0, 0.0, 0.0)
+    pendulum = SpringMassSystem([f], [m], create_spring(10, 5000.0, [f, m]), 1, 100)
+    result = pendulum.equilibrium(apply = False)
+    assert np.allclose(result["pos"], [[0.0, 10.0 - 10.0 - 9.81 / 5000.0]], rtol = 0, atol = 1e-9)
+    assert np.array_equal(pendulum.positions(), [[-10.0, 10.0]])
+
+
+def test_modal_playback():
+    # Small oscillation about the equilibrium: the closed form follows the integrated run
+    sms = create_chain(timesteps = 4000, time = 0.5, engine = "numpy", integrator = "verlet")
+    sms.equilibrium()
+    sms.store.masses.data("v")[0] = [0.0, 1e-3]
+    modes = sms.modes(6)
+    assert modes.captured > 1 - 1e-12
+    sms.run()
+    t = np.arange(sms.timesteps + 1) * sms.delta_t
+    positions = np.array(sms.recorder.view())
+    amplitude = np.abs(positions - positions[0]).max()
+    assert np.abs(modes.positions(t) - positions).max() < 1e-3 * amplitude
+    assert np.abs(modes.velocities(t) - sms.recorder.view("velocities")).max() < 1e-3 * 1e-3
+
+    # Subspace iteration (large systems) finds the modes of the dense eigensolver
+    import modal
+    import scenarios
+    cloth = scenarios.grid(576)
+    cloth.equilibrium()
+    iterated = modal.solve(cloth, 6)
+    dense = modal.DENSE
+    modal.DENSE = 2 * len(cloth.masses)
+    try:
+        direct = modal.solve(cloth, 6)
+    finally:
+        modal.DENSE = dense
+    assert np.allclose(iterated.eigenvalues, direct.eigenvalues, rtol = 1e-8)
+    assert np.isclose(iterated.omega_max, direct.omega_max, rtol = 1e-4)
+
+
+def test_multirate_levels():
+    # Steps short enough for every spring: a single level, same steps as velocity Verlet
+    sms = create_chain(integrator = "verlet")
+    sms.run()
+    multirate = create_chain(integrator = "multirate")
+    multirate.run()
+    assert multirate.state.integrator.stats()["levels"] == [4]
+    assert np.allclose(multirate.recorder.view(), sms.recorder.view(), rtol = 0, atol = 1e-12)
+
+    # Longer steps: the stiff springs sub-cycle twice in every step of the soft spring
+    reference = create_chain(timesteps = 8000, integrator = "verlet")
+    reference.run()
+    multirate = create_chain(timesteps = 20, integrator = "multirate")
+    multirate.run()
+    stats = multirate.state.integrator.stats()
+    assert stats["levels"] == [1, 3] and stats["spring_evals"] == 4 + 20 * (1 + 2 * 3)
+    assert np.abs(multirate.recorder.view() - reference.recorder.view()[::400]).max() < 1e-3
+
+
+def test_core_without_matplotlib():
+    import subprocess
+    import sys
+    code = ("import sys, main, loader, simulate\n"
+            "from test import create_chain\n"
+            "create_chain(engine = 'numpy', integrator = 'verlet').run()\n"
+            "assert 'matplotlib' not in sys.modules\n"
+            "main.Animator\n"
+            "assert 'matplotlib' in sys.modules\n")
+    subprocess.run([sys.executable, "-c", code], cwd = os.path.dirname(os.path.abspath(__file__)), check = True,
+                   stdout = subprocess.DEVNULL)
+
+
+def test_topology_adjacency():
+    import scenarios
+    topology = Topology.fromSystem(scenarios.random_graph(200))
+    for n in range(topology.n_fixtures + topology.n_masses):
+        neighbours, springs = topology.neighbours(n)
+        expected = np.flatnonzero((topology.i == n) | (topology.j == n))
+        assert np.array_equal(springs, expected)
+        assert np.array_equal(neighbours, np.where(topology.i[expected] == n, topology.j[expected], topology.i[expected]))
+    try:
+        topology.k[0] = 1.0
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Topology arrays are read-only")
+
+    # Reverse Cuthill-McKee restores the bandwidth of a shuffled cloth
+    cloth = Topology.fromSystem(scenarios.grid(100))
+    shuffled, _ = cloth.permuted(np.random.default_rng(3).permutation(cloth.n_masses))
+    ordered, _ = shuffled.permuted(shuffled.rcm())
+    assert shuffled.bandwidth() > 5 * cloth.bandwidth() and ordered.bandwidth() <= cloth.bandwidth()
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"{name}: ok")
@@ -0,0 +1,204 @@
+import numpy as np
+
+
+"""
+ Compiled topology
+
+ The connectivity of a spring mass system as frozen arrays: an edge table
+ (node indices of both ends, spring constant and rest length of every
+ spring) and a CSR adjacency (neighbours and springs of every node).
+ Nodes are numbered as in pack_system() (engine.py): fixtures first,
+ then masses.
+
+ Topologies are immutable. add() and remove() return a new topology that
+ shares nothing with the old one, so caches keyed on the identity of the
+ edge arrays (e.g. the sparse Jacobian pattern in implicit.py) are
+ rebuilt exactly when the topology changes, and only the edge table and
+ the affected adjacency rows are updated instead of walking the Fixture,
+ Mass and Spring objects again.
+"""
+
+
+def _frozen(a, dtype):
+    a = np.array(a, dtype = dtype)
+    a.flags.writeable = False
+    return a
+
+
+class Topology:
+    """
+    Initialize a compiled topology.
+    Attributes:
+    -n_fixtures: number of fixtures (node indices 0 to n_fixtures - 1)
+    -n_masses: number of masses (node indices from n_fixtures)
+    -fixtures, masses: node indices of the fixtures and of the masses
+    -i, j: node indices of the two ends of every spring
+    -k, l0: spring constants and rest lengths
+    -indptr, indices, edges: CSR adjacency, the neighbours of node n are
+     indices[indptr[n]:indptr[n + 1]], connected by springs edges[indptr[n]:indptr[n + 1]]
+     (every row ordered by spring)
+
+    All arrays are read-only.
+    """
+
+    def __init__(self, n_fixtures, n_masses, i, j, k, l0, adjacency = None):
+        self.n_fixtures = n_fixtures
+        self.n_masses = n_masses
+        self.fixtures = _frozen(np.arange(n_fixtures), np.intp)
+        self.masses = _frozen(np.arange(n_fixtures, n_fixtures + n_masses), np.intp)
+        self.i = _frozen(i, np.intp)
+        self.j = _frozen(j, np.intp)
+        self.k = _frozen(k, float)
+        self.l0 = _frozen(l0, float)
+
+        n_nodes = n_fixtures + n_masses
+        if len(self.i) and (min(self.i.min(), self.j.min()) < 0 or max(self.i.max(), self.j.max()) >= n_nodes):
+            raise ValueError("Spring end point is not a node of the system")
+
+        if adjacency is None:
+            # Every spring appears in the rows of both of its ends
+            rows = np.concatenate([self.i, self.j])
+            edges = np.concatenate([np.arange(len(self.i))] * 2)
+            order = np.lexsort((edges, rows))
+            adjacency = (np.concatenate([[0], np.cumsum(np.bincount(rows, minlength = n_nodes))]),
+                         np.concatenate([self.j, self.i])[order],
+                         edges[order])
+        self.indptr, self.indices, self.edges = (_frozen(a, np.intp) for a in adjacency)
+
+
+    @classmethod
+    def fromSystem(cls, sms):
+        """
+        Compile the fixtures, masses and springs of a SpringMassSystem
+        (from the arrays of its store, see store.py)
+        """
+
+        springs = sms.store.springs
+        ends = sms.store.nodeIndex()
+        return cls(len(sms.fixtures), len(sms.masses), ends[:, 0], ends[:, 1],
+                   springs.data("k"), springs.data("l0"))
+
+
+    @property
+    def n_springs(self):
+        return len(self.i)
+
+
+    def degree(self):
+        """
+        Number of springs attached to every node
+        """
+
+        return np.diff(self.indptr)
+
+
+    def neighbours(self, n):
+        """
+        Node indices of the neighbours of node n and the springs connecting them
+        """
+
+        return self.indices[self.indptr[n]:self.indptr[n + 1]], self.edges[self.indptr[n]:self.indptr[n + 1]]
+
+
+    def add(self, i, j, k, l0):
+        """
+        Topology with additional springs between nodes i and j (scalars or arrays).
+        The new springs are appended to the edge table and inserted into
+        the adjacency rows of their end points only.
+        """
+
+        i, j = np.atleast_1d(np.asarray(i, dtype = np.intp)), np.atleast_1d(np.asarray(j, dtype = np.intp))
+        k, l0 = np.broadcast_to(k, i.shape), np.broadcast_to(l0, i.shape)
+        edges = np.arange(self.n_springs, self.n_springs + len(i))
+
+        # The new springs have the highest numbers: insert them at the end of the rows,
+        # ordered by spring, so every row stays ordered by spring
+        rows = np.concatenate([i, j])
+        edges = np.concatenate([edges, edges])
+        order = np.lexsort((edges, rows))
+        rows = rows[order]
+        indices = np.insert(self.indices, self.indptr[rows + 1], np.concatenate([j, i])[order])
+        edges = np.insert(self.edges, self.indptr[rows + 1], edges[order])
+        indptr = self.indptr + np.concatenate([[0], np.cumsum(np.bincount(rows, minlength = len(self.indptr) - 1))])
+
+        return Topology(self.n_fixtures, self.n_masses,
+                        np.concatenate([self.i, i]), np.concatenate([self.j, j]),
+                        np.concatenate([self.k, k]), np.concatenate([self.l0, l0]),
+                        (indptr, indices, edges))
+
+
+    def remove(self, springs):
+        """
+        Topology without the given springs (indices into the edge table).
+        The remaining springs keep their order and are renumbered (so every
+        row stays ordered by spring).
+        """
+
+        keep = np.ones(self.n_springs, dtype = bool)
+        keep[np.asarray(springs, dtype = np.intp)] = False
+        renumber = np.cumsum(keep) - 1
+
+        entries = keep[self.edges]
+        rows = np.repeat(np.arange(len(self.indptr) - 1), self.degree())
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[entries], minlength = len(self.indptr) - 1))])
+
+        return Topology(self.n_fixtures, self.n_masses, self.i[keep], self.j[keep], self.k[keep], self.l0[keep],
+                        (indptr, self.indices[entries], renumber[self.edges[entries]]))
+
+
+    def rcm(self):
+        """
+        Reverse Cuthill-McKee ordering of the masses: a permutation of the mass
+        indices (0 to n_masses - 1) that numbers connected masses close to each
+        other, so that the node arrays are accessed with good locality
+        """
+
+        nf = self.n_fixtures
+        degree = self.degree()
+        visited = np.zeros(nf + self.n_masses, dtype = bool)
+        visited[:nf] = True
+
+        order = []
+        # Start every connected component at one of its masses of lowest degree
+        for start in nf + np.argsort(degree[nf:], kind = "stable"):
+            if visited[start]:
+                continue
+            visited[start] = True
+            queue = [start]
+            head = 0
+            while head < len(queue):
+                n = queue[head]
+                head += 1
+                neighbours = np.unique(self.indices[self.indptr[n]:self.indptr[n + 1]])
+                neighbours = neighbours[~visited[neighbours]]
+                neighbours = neighbours[np.argsort(degree[neighbours], kind = "stable")]
+                visited[neighbours] = True
+                queue.extend(neighbours)
+            order.extend(queue)
+
+        return np.array(order[::-1], dtype = np.intp) - nf
+
+
+    def permuted(self, order):
+        """
+        Topology with the masses renumbered so that new mass n is old mass order[n],
+        and the springs sorted by their end points. Returns the topology and the
+        order of the springs (new spring s is old spring springs[s]).
+        """
+
+        nf = self.n_fixtures
+        relabel = np.arange(nf + self.n_masses)
+        relabel[nf + np.asarray(order)] = np.arange(nf, nf + self.n_masses)
+        i, j = relabel[self.i], relabel[self.j]
+        springs = np.lexsort((np.maximum(i, j), np.minimum(i, j)))
+        return Topology(nf, self.n_masses, i[springs], j[springs], self.k[springs], self.l0[springs]), springs
+
+
+    def bandwidth(self):
+        """
+        Largest difference of the node indices of the two ends of a spring
+        connecting two masses (fixtures do not move and are ignored)
+        """
+
+        free = (self.i >= self.n_fixtures) & (self.j >= self.n_fixtures)
+        return int(np.abs(self.i - self.j)[free].max()) if free.any() else 0
@@ -0,0 +1,253 @@
+import json
+import struct
+
+import numpy as np
+
+
+"""
+ Trajectory storage
+
+ Keeps the recorded positions and velocities of all masses in single
+ preallocated arrays instead of growing Python lists every time step.
+ TrajectoryFile does the same on disk via np.memmap, so that runs can be
+ longer than memory and saved trajectories can be read back lazily.
+
+ File layout:
+ -preamble: magic (8 bytes), header length (uint32), padding (uint32),
+  number of records written (uint64)
+ -header: JSON (system description, delta_t, stride, shape and fields of the data)
+ -data: one float64 array of shape (n_records, n_masses, 2) per field
+  (positions, velocities), starting at a multiple of 64 bytes
+"""
+
+
+MAGIC = b"SMSTRAJ1"
+PREAMBLE = struct.Struct("<8sIIQ")
+ALIGN = 64
+
+
+class TrajectoryBuffer:
+    """
+    Initialize a trajectory buffer.
+    Attributes:
+    -stride: record every stride-th time step
+    -positions: recorded positions, shape (timesteps // stride + 1, n_masses, 2)
+    -velocities: recorded velocities, same shape
+    -count: number of records written so far
+
+    Record r holds the state after time step r * stride
+    (record 0 holds the initial state).
+    """
+
+    # Number of the record held in the first row of the arrays
+    first = 0
+
+    def __init__(self, n_masses, timesteps, stride = 1):
+        if stride < 1:
+            raise ValueError("Recording stride must be at least 1")
+        self.stride = stride
+        self.positions = np.full((timesteps // stride + 1, n_masses, 2), np.nan)
+        self.velocities = np.full((timesteps // stride + 1, n_masses, 2), np.nan)
+        self.count = 0
+
+
+    def record(self, step, pos, v = None):
+        """
+        Store the positions (and velocities) of time step step
+        if it falls on the recording stride
+        """
+
+        if step % self.stride:
+            return
+        r = step // self.stride
+        if r < len(self.positions):
+            self.positions[r] = pos
+            if v is not None:
+                self.velocities[r] = v
+            self.count = r + 1
+
+
+    def view(self, field = "positions"):
+        """
+        Read-only view of the records written so far, shape (count, n_masses, 2)
+        (field: "positions" or "velocities")
+        """
+
+        view = getattr(self, field)[:self.count]
+        view.flags.writeable = False
+        return view
+
+
+    def trajectories(self):
+        """
+        Read-only view in the layout of SpringMassSystem.trajectories:
+        one element per record containing [x_coords, y_coords] of all masses
+        """
+
+        return self.view().transpose(0, 2, 1)
+
+
+    def trajectory(self, n):
+        """
+        Read-only view of the trajectory of mass n, shape (count, 2)
+        """
+
+        return self.view()[:, n]
+
+
+class TrajectoryWindow(TrajectoryBuffer):
+    """
+    Initialize a trajectory window that only holds the latest records of a run
+    (see SpringMassSystem.stream()).
+    Attributes:
+    -stride: record every stride-th time step
+    -positions, velocities: held records, shape (size, n_masses, 2)
+    -first: number of the record held in the first row
+    -count: number of records written so far (in the whole run)
+    -drift: largest energy drift of the records discarded by shift()
+     (set by SpringMassSystem.stream())
+    """
+
+    def __init__(self, n_masses, size, stride = 1):
+        if size < 2:
+            raise ValueError("Trajectory window must hold at least 2 records")
+        super().__init__(n_masses, (size - 1) * stride, stride)
+        self.first = 0
+        self.drift = 0.0
+
+
+    def record(self, step, pos, v = None):
+        if step % self.stride:
+            return
+        r = step // self.stride - self.first
+        if 0 <= r < len(self.positions):
+            self.positions[r] = pos
+            if v is not None:
+                self.velocities[r] = v
+            self.count = self.first + r + 1
+
+
+    def view(self, field = "positions"):
+        view = getattr(self, field)[:self.count - self.first]
+        view.flags.writeable = False
+        return view
+
+
+    def shift(self, size = None):
+        """
+        Discard all records but the latest one, making room for new records
+        (and change the number of records held to size, if given)
+        """
+
+        last = self.count - self.first - 1
+        for field in ("positions", "velocities"):
+            data = getattr(self, field)
+            if size is not None and size != len(data):
+                if size < 2:
+                    raise ValueError("Trajectory window must hold at least 2 records")
+                resized = np.full((size,) + data.shape[1:], np.nan)
+                resized[0] = data[last]
+                setattr(self, field, resized)
+            else:
+                data[0] = data[last]
+        self.first = self.count - 1
+
+
+class TrajectoryFile(TrajectoryBuffer):
+    """
+    Initialize a memory-mapped trajectory file. Use TrajectoryFile.create()
+    to write a new file and TrajectoryFile.open() to read an existing one.
+    Attributes:
+    -path: file path
+    -header: header dictionary (system description, delta_t, stride, shape, fields)
+    -stride: record every stride-th time step
+    -positions: np.memmap of the recorded positions, shape (n_records, n_masses, 2)
+    -velocities: np.memmap of the recorded velocities, same shape
+    -count: number of records written so far
+    """
+
+    def __init__(self, path, header, count, offset, mode):
+        self.path = path
+        self.header = header
+        self.stride = header["stride"]
+        self.count = count
+
+        shape = tuple(header["shape"])
+        for field in header.get("fields", ["positions"]):
+            data = np.memmap(path, dtype = np.float64, mode = mode, offset = offset, shape = shape)
+            setattr(self, field, data)
+            offset += data.nbytes
+
+
+    @classmethod
+    def create(cls, path, n_masses, timesteps, stride = 1, delta_t = None, system = None):
+        """
+        Create a trajectory file for timesteps // stride + 1 records.
+        system is a JSON serializable description of the simulated system.
+        """
+
+        if stride < 1:
+            raise ValueError("Recording stride must be at least 1")
+        header = {"delta_t": delta_t,
+                  "stride": stride,
+                  "shape": [timesteps // stride + 1, n_masses, 2],
+                  "fields": ["positions", "velocities"],
+                  "system": system}
+        data = json.dumps(header).encode()
+        offset = -(-(PREAMBLE.size + len(data)) // ALIGN) * ALIGN
+
+        with open(path, "wb") as f:
+            f.write(PREAMBLE.pack(MAGIC, len(data), 0, 0))
+            f.write(data)
+            f.write(b"\0" * (offset - PREAMBLE.size - len(data)))
+
+        return cls(path, header, 0, offset, "r+")
+
+
+    @classmethod
+    def open(cls, path, mode = "r"):
+        """
+        Open an existing trajectory file without loading the data.
+        Use mode = "r+" to continue writing to it.
+        """
+
+        with open(path, "rb") as f:
+            magic, length, _, count = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a trajectory file")
+            header = json.loads(f.read(length))
+        offset = -(-(PREAMBLE.size + length) // ALIGN) * ALIGN
+
+        return cls(path, header, count, offset, mode)
+
+
+    def flush(self):
+        """
+        Write pending records and the record count to disk
+        """
+
+        for field in self.header.get("fields", ["positions"]):
+            getattr(self, field).flush()
+        with open(self.path, "r+b") as f:
+            f.seek(PREAMBLE.size - 8)
+            f.write(struct.pack("<Q", self.count))
+
+
+    def window(self, start = 0, stop = None, masses = None, field = "positions"):
+        """
+        Load the positions (or velocities) of the records start to stop (exclusive)
+        for the given mass indices (all masses by default)
+        """
+
+        data = self.view(field)[start:stop]
+        if masses is not None:
+            data = data[:, masses]
+        return np.array(data)
+
+
+    def times(self):
+        """
+        Simulated time of every written record
+        """
+
+        return np.arange(self.count) * self.stride * self.header["delta_t"]
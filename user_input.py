@@ -125,30 +125,36 @@ def smsInit():
         while True:
             obj1_name = input(f"Enter name of first connected fixture/mass: ")
 
-            if obj1_name[0] == "f":
-                obj1 = fixtures[int(obj1_name[1])]
-                break
+            try:
+                if obj1_name[0] == "f":
+                    obj1 = fixtures[int(obj1_name[1:])]
+                    break
 
-            elif obj1_name[0] == "m":
-                obj1 = masses[int(obj1_name[1])]
-                break
+                elif obj1_name[0] == "m":
+                    obj1 = masses[int(obj1_name[1:])]
+                    break
+
+            except (IndexError, ValueError):
+                pass
 
-            else:
-                print("Invalid name! Try again.")
+            print("Invalid name! Try again.")
 
         while True:
             obj2_name = input(f"Enter name of second connected fixture/mass: ")
 
-            if obj2_name[0] == "f":
-                obj2 = fixtures[int(obj2_name[1])]
-                break
+            try:
+                if obj2_name[0] == "f":
+                    obj2 = fixtures[int(obj2_name[1:])]
+                    break
 
-            elif obj2_name[0] == "m":
-                obj2 = masses[int(obj2_name[1])]
-                break
+                elif obj2_name[0] == "m":
+                    obj2 = masses[int(obj2_name[1:])]
+                    break
+
+            except (IndexError, ValueError):
+                pass
 
-            else:
-                print("Invalid name! Try again.")
+            print("Invalid name! Try again.")
 
         springs.append(Spring(l0, k, [obj1, obj2]))
 
@@ -193,7 +199,7 @@ except:
 
 try:
     sms = SpringMassSystem(fixtures, masses, springs, time, timesteps, save)
-    sms.run()
+    sms.run(plot = True)
 
 except:
     print("Unknown exception occured while running simulation!")
\ No newline at end of file